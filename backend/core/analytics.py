@@ -0,0 +1,372 @@
+"""
+Portfolio analytics aggregates
+Computed in SQL so the API never iterates over loans or repayments in Python.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import (
+    Case, When, F, Q, Count, Sum, Min, Max, Avg, Value, DecimalField, DateField, OuterRef, Subquery
+)
+from django.db.models.functions import Coalesce, Greatest, TruncMonth
+from django.utils import timezone
+
+from .models import Loan, Repayment
+
+# Days-past-due thresholds reported as portfolio at risk
+PAR_BUCKETS = (30, 60, 90)
+
+MONEY = DecimalField(max_digits=15, decimal_places=2)
+
+
+def _unpaid(prefix=''):
+    """Installment not paid in full"""
+    return Q(**{f'{prefix}actual_amount_paid__lt': F(f'{prefix}scheduled_total')})
+
+
+def _principal_paid(prefix=''):
+    """
+    Scheduled principal covered by an installment's payment; a partial
+    payment covers principal pro rata to the installment total
+    """
+    return Case(
+        When(~_unpaid(prefix), then=F(f'{prefix}scheduled_principal')),
+        When(
+            **{f'{prefix}scheduled_total__gt': 0},
+            then=F(f'{prefix}actual_amount_paid') * F(f'{prefix}scheduled_principal') / F(f'{prefix}scheduled_total')
+        ),
+        default=Value(Decimal('0')),
+        output_field=MONEY
+    )
+
+
+def outstanding_annotations(as_of=None):
+    """
+    Per-loan annotations over the repayment schedule:
+      principal_repaid - scheduled principal covered by payments
+      outstanding - principal_amount minus principal_repaid, floored at 0
+      oldest_due - scheduled date of the oldest installment past due and not
+        paid in full, NULL when the loan is current
+    """
+    as_of = as_of or timezone.now().date()
+    principal_repaid = Coalesce(Sum(_principal_paid('repayments__')), Value(Decimal('0')), output_field=MONEY)
+    return {
+        'principal_repaid': principal_repaid,
+        'outstanding': Greatest(F('principal_amount') - principal_repaid, Value(Decimal('0')), output_field=MONEY),
+        'oldest_due': Min(
+            'repayments__scheduled_date',
+            filter=_unpaid('repayments__') & Q(repayments__scheduled_date__lt=as_of)
+        ),
+    }
+
+
+def outstanding_subqueries(as_of=None):
+    """
+    The outstanding and oldest_due values of outstanding_annotations as
+    correlated subqueries, for querysets that GROUP BY something other than
+    the loan (see cube_query).
+    """
+    as_of = as_of or timezone.now().date()
+    schedule = Repayment.objects.filter(loan=OuterRef('pk')).order_by().values('loan')
+    repaid = schedule.annotate(total=Sum(_principal_paid())).values('total')
+    oldest_due = schedule.filter(_unpaid(), scheduled_date__lt=as_of).annotate(
+        first=Min('scheduled_date')
+    ).values('first')
+    return {
+        'loan_outstanding': Greatest(
+            F('principal_amount') - Coalesce(Subquery(repaid, output_field=MONEY), Value(Decimal('0'))),
+            Value(Decimal('0')),
+            output_field=MONEY
+        ),
+        'loan_oldest_due': Subquery(oldest_due, output_field=DateField()),
+    }
+
+
+def portfolio_at_risk(queryset, as_of=None, **extra):
+    """
+    Outstanding principal and PAR30/60/90 for a Loan queryset in one query.
+    A loan is at risk in bucket N when its oldest unpaid installment is more
+    than N days past due; the whole outstanding balance counts as at risk.
+    Returns total_outstanding, total_at_risk_<N> and par<N>_rate for each bucket.
+    extra names further aggregates over the per-loan rows (which carry
+    outstanding and any annotations of queryset), computed in the same query.
+    """
+    as_of = as_of or timezone.now().date()
+    per_loan = queryset.order_by().annotate(**outstanding_annotations(as_of))
+
+    # Django wraps the per-loan GROUP BY in a subquery and sums over it
+    measures = {'total_outstanding': Coalesce(Sum('outstanding'), Value(Decimal('0')), output_field=MONEY)}
+    for days in PAR_BUCKETS:
+        measures[f'total_at_risk_{days}'] = Coalesce(
+            Sum('outstanding', filter=Q(oldest_due__lt=as_of - timedelta(days=days))),
+            Value(Decimal('0')),
+            output_field=MONEY
+        )
+    totals = per_loan.aggregate(**measures, **extra)
+
+    total = totals['total_outstanding']
+    for days in PAR_BUCKETS:
+        at_risk = totals[f'total_at_risk_{days}']
+        totals[f'par{days}_rate'] = (at_risk / total) if total > 0 else 0
+    return totals
+
+
+# Dimensions accepted by the statistics endpoints' group_by parameter
+LOAN_DIMENSIONS = {
+    'branch': 'branch__name',
+    'loan_type': 'loan_type',
+    'status': 'status',
+    'loan_officer': 'loan_officer__employee_id',
+}
+REPAYMENT_DIMENSIONS = {
+    'branch': 'loan__branch__name',
+    'loan_type': 'loan__loan_type',
+    'payment_status': 'payment_status',
+}
+
+
+def loan_measures():
+    """Additive per-group loan measures; averages are derived in loan_statistics"""
+    return {
+        'total_loans': Count('id'),
+        'total_principal': Coalesce(Sum('principal_amount'), Value(Decimal('0')), output_field=MONEY),
+        'active_loans': Count('id', filter=Q(status='ACTIVE')),
+        'defaulted_loans': Count('id', filter=Q(status='DEFAULTED')),
+    }
+
+
+def repayment_measures():
+    """Additive per-group repayment measures; rates are derived in repayment_statistics"""
+    return {
+        'total_repayments': Count('id'),
+        'on_time_count': Count('id', filter=Q(payment_status='ON_TIME')),
+        'late_count': Count('id', filter=Q(payment_status='LATE_PAYMENT')),
+        'partial_count': Count('id', filter=Q(payment_status='PARTIAL_PAYMENT')),
+        'missed_count': Count('id', filter=Q(payment_status='MISSED_PAYMENT')),
+        'late_installments': Count('id', filter=Q(days_late__gt=0)),
+        'total_days_late': Coalesce(Sum('days_late', filter=Q(days_late__gt=0)), 0),
+    }
+
+
+def _rollup(rows, fields, key=None):
+    """Sum additive measures over grouped rows, overall or per value of key"""
+    totals = {}
+    for row in rows:
+        group = totals.setdefault(row[key] if key else None, dict.fromkeys(fields, 0))
+        for field in fields:
+            group[field] += row[field]
+    return totals
+
+
+def _loan_stats(measures):
+    stats = dict(measures)
+    stats['avg_loan_amount'] = (measures['total_principal'] / measures['total_loans']) if measures['total_loans'] else 0
+    return stats
+
+
+def _repayment_stats(measures):
+    stats = {k: v for k, v in measures.items() if k not in ('late_installments', 'total_days_late')}
+    total = measures['total_repayments']
+    stats['on_time_rate'] = (measures['on_time_count'] / total) if total else 0
+    late = measures['late_installments']
+    stats['avg_days_late'] = (measures['total_days_late'] / late) if late else 0
+    return stats
+
+
+def loan_statistics(queryset, group_by=None):
+    """
+    Loan counts, principal totals and per-type / per-branch breakdowns from a
+    single GROUP BY query. group_by (a LOAN_DIMENSIONS key) adds the full set
+    of measures per group under "groups".
+    """
+    measures = loan_measures()
+    dimensions = ['loan_type', 'branch__name']
+    if group_by and LOAN_DIMENSIONS[group_by] not in dimensions:
+        dimensions.append(LOAN_DIMENSIONS[group_by])
+    rows = list(queryset.order_by().values(*dimensions).annotate(**measures))
+
+    fields = list(measures)
+    empty = dict.fromkeys(fields, 0)
+    data = _loan_stats(_rollup(rows, fields).get(None, empty))
+    data['by_loan_type'] = {k: v['total_loans'] for k, v in _rollup(rows, fields, 'loan_type').items()}
+    data['by_branch'] = {k: v['total_loans'] for k, v in _rollup(rows, fields, 'branch__name').items()}
+    if group_by:
+        data['group_by'] = group_by
+        data['groups'] = {
+            k: _loan_stats(v) for k, v in _rollup(rows, fields, LOAN_DIMENSIONS[group_by]).items()
+        }
+    return data
+
+
+def repayment_statistics(queryset, group_by=None):
+    """
+    Repayment status counts, on-time rate and average days late in one query.
+    group_by (a REPAYMENT_DIMENSIONS key) adds the same measures per group
+    under "groups".
+    """
+    measures = repayment_measures()
+    fields = list(measures)
+    empty = dict.fromkeys(fields, 0)
+    if not group_by:
+        return _repayment_stats(queryset.order_by().aggregate(**measures))
+
+    dimension = REPAYMENT_DIMENSIONS[group_by]
+    rows = list(queryset.order_by().values(dimension).annotate(**measures))
+    data = _repayment_stats(_rollup(rows, fields).get(None, empty))
+    data['group_by'] = group_by
+    data['groups'] = {k: _repayment_stats(v) for k, v in _rollup(rows, fields, dimension).items()}
+    return data
+
+
+def borrower_annotations(as_of=None):
+    """
+    Per-borrower loan summary as correlated subqueries, so a borrower page is
+    one query without a GROUP BY:
+      loan_count - all loans of the borrower
+      outstanding_exposure - outstanding principal over active loans
+      last_loan_status - status of the most recent application
+    """
+    loans = Loan.objects.filter(borrower=OuterRef('pk')).order_by()
+    count = loans.values('borrower').annotate(total=Count('id')).values('total')
+    exposure = loans.filter(status='ACTIVE').annotate(
+        loan_outstanding=outstanding_subqueries(as_of)['loan_outstanding']
+    ).values('borrower').annotate(total=Sum('loan_outstanding')).values('total')
+    last_status = loans.order_by('-application_date', '-id').values('status')[:1]
+    return {
+        'loan_count': Coalesce(Subquery(count), 0),
+        'outstanding_exposure': Coalesce(Subquery(exposure, output_field=MONEY), Value(Decimal('0')), output_field=MONEY),
+        'last_loan_status': Subquery(last_status),
+    }
+
+
+# Window for "recent" repayment behavior on the borrower 360 view
+RECENT_BEHAVIOR_DAYS = 365
+
+
+def repayment_behavior(queryset, as_of=None, recent_days=RECENT_BEHAVIOR_DAYS):
+    """
+    Repayment behavior over installments already due, in one aggregate query:
+    counts by outcome, on-time ratio, worst and average lateness, last payment,
+    plus the worst lateness and on-time ratio over the last recent_days.
+    """
+    as_of = as_of or timezone.now().date()
+    recent = Q(scheduled_date__gt=as_of - timedelta(days=recent_days))
+    totals = queryset.filter(scheduled_date__lte=as_of).order_by().aggregate(
+        installments_due=Count('id'),
+        on_time_count=Count('id', filter=Q(payment_status='ON_TIME')),
+        late_count=Count('id', filter=Q(payment_status='LATE_PAYMENT')),
+        partial_count=Count('id', filter=Q(payment_status='PARTIAL_PAYMENT')),
+        missed_count=Count('id', filter=Q(payment_status='MISSED_PAYMENT')),
+        max_days_late=Coalesce(Max('days_late'), 0),
+        avg_days_late=Avg('days_late', filter=Q(days_late__gt=0)),
+        last_payment_date=Max('actual_payment_date'),
+        recent_due=Count('id', filter=recent),
+        recent_on_time=Count('id', filter=recent & Q(payment_status='ON_TIME')),
+        recent_max_days_late=Coalesce(Max('days_late', filter=recent), 0),
+    )
+    due, recent_due = totals['installments_due'], totals.pop('recent_due')
+    recent_on_time = totals.pop('recent_on_time')
+    totals['on_time_ratio'] = (totals['on_time_count'] / due) if due else None
+    totals['recent_on_time_ratio'] = (recent_on_time / recent_due) if recent_due else None
+    totals['avg_days_late'] = totals['avg_days_late'] or 0
+    return totals
+
+
+def loan_summary(queryset):
+    """Loan counts by status, principal and application dates in one aggregate query"""
+    return queryset.order_by().aggregate(
+        total_loans=Count('id'),
+        active_loans=Count('id', filter=Q(status='ACTIVE')),
+        closed_loans=Count('id', filter=Q(status='CLOSED')),
+        defaulted_loans=Count('id', filter=Q(status__in=['DEFAULTED', 'WRITTEN_OFF'])),
+        total_principal=Coalesce(Sum('principal_amount'), Value(Decimal('0')), output_field=MONEY),
+        first_application=Min('application_date'),
+        last_application=Max('application_date'),
+    )
+
+
+def loan_behavior_annotations(as_of=None):
+    """Per-loan repayment behavior over installments already due (GROUP BY loan)"""
+    as_of = as_of or timezone.now().date()
+    due = Q(repayments__scheduled_date__lte=as_of)
+    return {
+        'installments_due': Count('repayments', filter=due),
+        'installments_on_time': Count('repayments', filter=due & Q(repayments__payment_status='ON_TIME')),
+        'max_days_late': Coalesce(Max('repayments__days_late', filter=due), 0),
+    }
+
+
+# Dimensions and measures accepted by the analytics cube endpoint
+CUBE_DIMENSIONS = {
+    'branch': F('branch__name'),
+    'loan_type': F('loan_type'),
+    'tenure_months': F('tenure_months'),
+    'status': F('status'),
+    'district': F('borrower__district'),
+    'business_industry': F('borrower__business_industry'),
+    'disbursement_month': TruncMonth('disbursement_date'),
+}
+CUBE_MEASURES = (
+    'count', 'principal', 'outstanding',
+    *(f'at_risk_{days}' for days in PAR_BUCKETS), *(f'par{days}' for days in PAR_BUCKETS),
+    'avg_pd', 'avg_lgd', 'expected_loss',
+)
+
+
+def cube_query(queryset, dimensions, measures, as_of=None):
+    """
+    Group a Loan queryset by dimensions and compute measures in one SQL query.
+    Outstanding principal comes from correlated repayment subqueries, so the
+    GROUP BY stays on the requested dimensions. PAR rates are at-risk amounts
+    over outstanding principal. Returns columnar data: {name: [values, ...]}
+    for every dimension and measure, one entry per group.
+    """
+    as_of = as_of or timezone.now().date()
+    needed = set(measures)
+    for days in PAR_BUCKETS:
+        if f'par{days}' in needed:
+            needed |= {f'at_risk_{days}', 'outstanding'}
+    needs_arrears = any(f'at_risk_{days}' in needed for days in PAR_BUCKETS)
+
+    subqueries = outstanding_subqueries(as_of)
+    per_loan = {}
+    if 'outstanding' in needed or needs_arrears:
+        per_loan['loan_outstanding'] = subqueries['loan_outstanding']
+    if needs_arrears:
+        per_loan['loan_oldest_due'] = subqueries['loan_oldest_due']
+
+    aggregates = {
+        'count': Count('id'),
+        'principal': Coalesce(Sum('principal_amount'), Value(Decimal('0')), output_field=MONEY),
+        'outstanding': Coalesce(Sum('loan_outstanding'), Value(Decimal('0')), output_field=MONEY),
+        'avg_pd': Avg('risk_metric__pd_mean'),
+        'avg_lgd': Avg('risk_metric__lgd_mean'),
+        'expected_loss': Coalesce(Sum('risk_metric__expected_loss'), Value(Decimal('0')), output_field=MONEY),
+    }
+    for days in PAR_BUCKETS:
+        aggregates[f'at_risk_{days}'] = Coalesce(
+            Sum('loan_outstanding', filter=Q(loan_oldest_due__lt=as_of - timedelta(days=days))),
+            Value(Decimal('0')),
+            output_field=MONEY
+        )
+
+    group_names = [f'dim_{name}' for name in dimensions]
+    queryset = queryset.order_by().annotate(**per_loan).annotate(
+        **{f'dim_{name}': CUBE_DIMENSIONS[name] for name in dimensions}
+    )
+    selected = {name: aggregates[name] for name in aggregates if name in needed}
+    if group_names:
+        rows = list(queryset.values(*group_names).annotate(**selected).order_by(*group_names))
+    else:
+        rows = [queryset.aggregate(**selected)]
+
+    columns = {name: [row[f'dim_{name}'] for row in rows] for name in dimensions}
+    for name in measures:
+        if name.startswith('par'):
+            days = int(name[3:])
+            columns[name] = [
+                (row[f'at_risk_{days}'] / row['outstanding']) if row['outstanding'] else 0 for row in rows
+            ]
+        else:
+            columns[name] = [row[name] for row in rows]
+    return columns
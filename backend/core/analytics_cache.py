@@ -0,0 +1,122 @@
+"""
+Response cache for the analytics actions
+Entries live in the "analytics" cache (a bounded LRU LocMemCache by default)
+and are keyed by action, normalized query parameters and the current
+generation of every model the action reads. Writes to those models bump
+their generation (see core/signals.py), so stale entries are simply never
+looked up again and age out under LRU eviction.
+
+LocMemCache is per process: with several workers, point the "analytics"
+alias at a shared backend (Redis, Memcached) so invalidation reaches all of
+them. ANALYTICS_CACHE_TIMEOUT bounds staleness either way.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+CACHE_ALIAS = 'analytics'
+
+# Tracked sources; writes to these models invalidate dependent entries
+LOAN = 'loan'
+REPAYMENT = 'repayment'
+RECOVERY = 'recovery'
+RISK_METRIC = 'risk_metric'
+
+# Query parameters that do not change the payload
+IGNORED_PARAMS = {'format'}
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _generation_key(source):
+    return f"gen:{source}"
+
+
+def generation(source):
+    """
+    Current generation of a source. A missing counter (first use or evicted)
+    restarts from the clock, so it can never fall back to a value that older
+    entries were stored under.
+    """
+    cache = _cache()
+    value = cache.get(_generation_key(source))
+    if value is None:
+        value = time.time_ns()
+        if not cache.add(_generation_key(source), value, timeout=None):
+            value = cache.get(_generation_key(source), value)
+    return value
+
+
+def bump(*sources):
+    """Invalidate every cached entry that depends on any of the sources"""
+    cache = _cache()
+    for source in sources:
+        try:
+            cache.incr(_generation_key(source))
+        except ValueError:
+            cache.set(_generation_key(source), time.time_ns(), timeout=None)
+
+
+def _count(name):
+    cache = _cache()
+    try:
+        cache.incr(f"stats:{name}")
+    except ValueError:
+        cache.add(f"stats:{name}", 1, timeout=None)
+
+
+def cache_key(name, params, sources):
+    """Key for an action, its normalized query parameters and source generations"""
+    normalized = sorted(
+        (key, tuple(sorted(values)))
+        for key, values in params.lists()
+        if key not in IGNORED_PARAMS
+    )
+    generations = [(source, generation(source)) for source in sources]
+    digest = hashlib.sha1(repr((normalized, generations)).encode()).hexdigest()
+    return f"response:{name}:{digest}"
+
+
+def cached_analytics(*sources):
+    """
+    Cache a read-only viewset action's response data until one of the
+    sources is written to. Only 200 responses are stored.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            cache = _cache()
+            key = cache_key(f"{self.basename}.{method.__name__}", request.query_params, sources)
+            data = cache.get(key)
+            if data is not None:
+                _count('hits')
+                return Response(data, headers={'X-Cache': 'HIT'})
+
+            _count('misses')
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, timeout=settings.ANALYTICS_CACHE_TIMEOUT)
+                response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    """Hit/miss counters for the analytics cache and its hit ratio"""
+    cache = _cache()
+    hits = cache.get('stats:hits', 0)
+    misses = cache.get('stats:misses', 0)
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": (hits / lookups) if lookups else None,
+        "generations": {source: generation(source) for source in (LOAN, REPAYMENT, RECOVERY, RISK_METRIC)},
+    }
@@ -3,8 +3,7 @@ Bayesian Risk Models Implementation
 Uses analytical approximations and conjugate priors for efficient real-time inference.
 """
 import numpy as np
-from scipy import stats
-from scipy.optimize import minimize
+from scipy import stats, special
 from dataclasses import dataclass
 from typing import List, Tuple, Dict, Optional
 
@@ -16,6 +15,15 @@ class BayesianResult:
     distribution: str
     params: Dict[str, float]
 
+@dataclass
+class BayesianBatchResult:
+    """Per-row posterior summaries for a batch of instances"""
+    mean: np.ndarray
+    lower_hdi: np.ndarray
+    upper_hdi: np.ndarray
+    distribution: str
+    params: Dict[str, float]
+
 class BayesianPDModel:
     """
     Bayesian Logistic Regression for Probability of Default (PD)
@@ -24,68 +32,106 @@ class BayesianPDModel:
     def __init__(self):
         self.coef_mean = None
         self.coef_cov = None
+        # Cholesky factor of coef_cov, cached for sampling
+        self.coef_chol = None
         
     def sigmoid(self, z):
         return 1 / (1 + np.exp(-z))
         
-    def fit(self, X: np.ndarray, y: np.ndarray, prior_precision: float = 1.0):
+    def fit(self, X: np.ndarray, y: np.ndarray, prior_precision: float = 1.0,
+            max_iter: int = 50, tol: float = 1e-8):
         """
         Fit using Laplace Approximation (finding MAP and Hessian)
         X: Feature matrix (n_samples, n_features)
         y: Target vector (n_samples,)
+
+        The MAP is found with Newton's method (IRLS) using the analytic
+        gradient and Hessian of the negative log posterior. The Hessian is
+        accumulated from per-row weights, so memory is O(n_samples * n_features)
+        and never O(n_samples^2).
         """
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
         n_samples, n_features = X.shape
-        
-        # Negative Log Posterior
+        prior = prior_precision * np.eye(n_features)
+
         def neg_log_posterior(w):
             # Prior: w ~ N(0, I/prior_precision)
-            prior = 0.5 * prior_precision * np.sum(w**2)
-            
-            # Likelihood: Bernoulli
             logits = X @ w
-            # Stable log-likelihood
-            # log(p) = log(1 / (1 + exp(-logits))) = -log(1 + exp(-logits))
-            # log(1-p) = -logits - log(1 + exp(-logits))
-            # ll = y * log(p) + (1-y) * log(1-p)
-            #    = y * (-log(1+exp(-logits))) + (1-y) * (-logits - log(1+exp(-logits)))
-            #    = -y*logits + y*logits - logits - log(...) -> Wait, standard derivation:
-            # ll = sum(y_i * log(p_i) + (1-y_i) * log(1-p_i))
-            
-            # Use logaddexp for stability
-            log_p = -np.logaddexp(0, -logits)
-            log_1_minus_p = -np.logaddexp(0, logits)
-            
-            ll = np.sum(y * log_p + (1 - y) * log_1_minus_p)
-            
-            return prior - ll
+            # Stable Bernoulli log-likelihood via logaddexp
+            ll = np.sum(y * -np.logaddexp(0, -logits) + (1 - y) * -np.logaddexp(0, logits))
+            return 0.5 * prior_precision * np.sum(w**2) - ll
 
-        # Find MAP estimate
-        w0 = np.zeros(n_features)
-        res = minimize(neg_log_posterior, w0, method='BFGS')
-        self.coef_mean = res.x
-        
-        # Compute Hessian at MAP (Inverse Covariance)
-        # H = X.T @ S @ X + prior_precision * I
-        # where S = diag(p * (1-p))
+        # Newton / IRLS for the MAP estimate
+        w = np.zeros(n_features)
+        nlp = neg_log_posterior(w)
+        for _ in range(max_iter):
+            p = self.sigmoid(X @ w)
+            grad = X.T @ (p - y) + prior_precision * w
+            # H = X.T @ diag(s) @ X + prior, with s = p * (1 - p), built without diag(s)
+            H = (X * (p * (1 - p))[:, None]).T @ X + prior
+            step = np.linalg.solve(H, grad)
+
+            # Backtracking keeps the step monotone on separable data
+            t = 1.0
+            while t > 1e-6:
+                w_new = w - t * step
+                nlp_new = neg_log_posterior(w_new)
+                if nlp_new <= nlp:
+                    break
+                t *= 0.5
+            else:
+                break
+
+            converged = abs(nlp - nlp_new) <= tol * (1 + abs(nlp))
+            w, nlp = w_new, nlp_new
+            if converged:
+                break
+
+        self.coef_mean = w
+
+        # Hessian at MAP (Inverse Covariance)
         p = self.sigmoid(X @ self.coef_mean)
-        S = np.diag(p * (1 - p))
-        H = X.T @ S @ X + prior_precision * np.eye(n_features)
-        
+        H = (X * (p * (1 - p))[:, None]).T @ X + prior
+
         try:
             self.coef_cov = np.linalg.inv(H)
         except np.linalg.LinAlgError:
             self.coef_cov = np.eye(n_features) * 1e-6
+        self.coef_chol = None
+
+    def cholesky(self) -> np.ndarray:
+        """Lower Cholesky factor of the posterior covariance (computed once)"""
+        if self.coef_chol is None:
+            self.coef_chol = np.linalg.cholesky(self.coef_cov)
+        return self.coef_chol
+
+    def sample_weights(self, n_samples: int) -> np.ndarray:
+        """Draw posterior weight samples N(mu, Sigma) as mu + z @ L.T"""
+        z = np.random.standard_normal((n_samples, self.coef_mean.shape[0]))
+        return self.coef_mean + z @ self.cholesky().T
 
-    def predict_proba(self, X: np.ndarray, n_samples: int = 1000) -> BayesianResult:
+    def predict_proba(self, X: np.ndarray, n_samples: int = 1000, method: str = "sampling") -> BayesianResult:
         """
-        Predict PD with uncertainty using Monte Carlo sampling from posterior approximation
+        Predict PD with uncertainty using Monte Carlo sampling from posterior approximation.
+        method="probit" uses the deterministic closed form instead (see predict_proba_closed_form).
         """
         if self.coef_mean is None:
             # Default fallback if not fitted
             return BayesianResult(0.05, 0.01, 0.10, "Beta", {})
+
+        if method == "probit":
+            batch = self.predict_proba_closed_form(np.atleast_2d(X))
+            return BayesianResult(
+                mean=float(batch.mean[0]),
+                lower_hdi=float(batch.lower_hdi[0]),
+                upper_hdi=float(batch.upper_hdi[0]),
+                distribution=batch.distribution,
+                params=batch.params
+            )
             
         # Sample weights from posterior N(mu, Sigma)
-        w_samples = np.random.multivariate_normal(self.coef_mean, self.coef_cov, size=n_samples)
+        w_samples = self.sample_weights(n_samples)
         
         # Calculate logits and probs for each sample
         logits = X @ w_samples.T
@@ -105,106 +151,463 @@ class BayesianPDModel:
             params={"n_samples": n_samples}
         )
 
+    def predict_proba_batch(self, X: np.ndarray, n_samples: int = 1000,
+                            chunk_size: int = 5000, method: str = "sampling") -> BayesianBatchResult:
+        """
+        Predict PD with uncertainty for every row of X.
+        Posterior weights are sampled once per call and shared by all rows;
+        rows are scored in chunks so memory stays O(chunk_size * n_samples).
+        method="probit" uses the deterministic closed form instead.
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        n_rows = X.shape[0]
+
+        if self.coef_mean is None:
+            # Default fallback if not fitted
+            return BayesianBatchResult(
+                mean=np.full(n_rows, 0.05),
+                lower_hdi=np.full(n_rows, 0.01),
+                upper_hdi=np.full(n_rows, 0.10),
+                distribution="Beta",
+                params={}
+            )
+
+        if method == "probit":
+            return self.predict_proba_closed_form(X)
+
+        w_samples = self.sample_weights(n_samples)
+
+        mean_pd = np.empty(n_rows)
+        lower_hdi = np.empty(n_rows)
+        upper_hdi = np.empty(n_rows)
+        for start in range(0, n_rows, chunk_size):
+            stop = start + chunk_size
+            probs = self.sigmoid(X[start:stop] @ w_samples.T)
+            mean_pd[start:stop] = probs.mean(axis=1)
+            lower_hdi[start:stop], upper_hdi[start:stop] = np.percentile(probs, [2.5, 97.5], axis=1)
+
+        return BayesianBatchResult(
+            mean=mean_pd,
+            lower_hdi=lower_hdi,
+            upper_hdi=upper_hdi,
+            distribution="Posterior Predictive",
+            params={"n_samples": n_samples}
+        )
+
+    def predict_proba_closed_form(self, X: np.ndarray, hdi_prob: float = 0.95) -> BayesianBatchResult:
+        """
+        Deterministic posterior predictive PD from the Laplace posterior.
+        The logit a = x.w is Gaussian with mean x.mu and variance x.Sigma.x, so
+        - mean PD uses the probit approximation sigmoid(mu_a / sqrt(1 + pi * var_a / 8))
+        - HDI bounds are the sigmoid of the Gaussian logit quantiles
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+
+        mu_a = X @ self.coef_mean
+        var_a = np.einsum('ij,jk,ik->i', X, self.coef_cov, X)
+        sd_a = np.sqrt(np.maximum(var_a, 0.0))
+        z = stats.norm.ppf(0.5 + hdi_prob / 2)
+
+        return BayesianBatchResult(
+            mean=self.sigmoid(mu_a / np.sqrt(1 + np.pi * var_a / 8)),
+            lower_hdi=self.sigmoid(mu_a - z * sd_a),
+            upper_hdi=self.sigmoid(mu_a + z * sd_a),
+            distribution="Probit Approximation",
+            params={"hdi_prob": hdi_prob}
+        )
+
+@dataclass
+class BetaSufficientStats:
+    """
+    Sufficient statistics of LGD observations on [0, 1].
+    Interior observations feed the Beta likelihood (n and the sums); exact 0s
+    (full recovery) and 1s (total loss) are counted as point masses, since
+    their log terms are infinite and clipping them would bend the Beta fit.
+    Additive, so they can be updated one observation at a time and merged across shards.
+    """
+    n: float = 0.0
+    sum_log_x: float = 0.0
+    sum_log_1mx: float = 0.0
+    sum_x: float = 0.0
+    sum_x2: float = 0.0
+    n_zero: float = 0.0
+    n_one: float = 0.0
+
+    @classmethod
+    def from_observations(cls, x: np.ndarray) -> 'BetaSufficientStats':
+        x = np.asarray(x, dtype=float)
+        interior = x[(x > 0) & (x < 1)]
+        return cls(
+            n=float(interior.size),
+            sum_log_x=float(np.sum(np.log(interior))),
+            sum_log_1mx=float(np.sum(np.log1p(-interior))),
+            sum_x=float(np.sum(interior)),
+            sum_x2=float(np.sum(interior**2)),
+            n_zero=float(np.sum(x <= 0)),
+            n_one=float(np.sum(x >= 1))
+        )
+
+    def __add__(self, other: 'BetaSufficientStats') -> 'BetaSufficientStats':
+        return BetaSufficientStats(*(a + b for a, b in zip(self.to_array(), other.to_array())))
+
+    def __sub__(self, other: 'BetaSufficientStats') -> 'BetaSufficientStats':
+        return BetaSufficientStats(*(a - b for a, b in zip(self.to_array(), other.to_array())))
+
+    def to_array(self) -> np.ndarray:
+        return np.array([self.n, self.sum_log_x, self.sum_log_1mx, self.sum_x, self.sum_x2, self.n_zero, self.n_one])
+
+    @classmethod
+    def from_array(cls, values) -> 'BetaSufficientStats':
+        return cls(*(float(v) for v in values))
+
 class BayesianLGDModel:
     """
     Bayesian LGD Model using Conjugate Priors (Beta Distribution)
-    LGD is modeled as Beta(alpha, beta).
-    Prior: Beta(a0, b0)
-    Likelihood: Binomial (conceptually) or direct Beta updates
+    LGD is modeled as zero-one inflated Beta: point masses at 0 and 1 with
+    probabilities p_zero and p_one, Beta(alpha, beta) in between.
+    Prior: the conjugate prior of the Beta likelihood,
+        p(a, b) ∝ B(a, b)^-nu0 * exp((a - 1) * s1_0 + (b - 1) * s2_0)
+    with pseudo-statistics chosen so its mode is Beta(a0, b0) at strength nu0.
+    The posterior has the same form with nu = nu0 + n, s1 = s1_0 + sum(log x),
+    s2 = s2_0 + sum(log(1 - x)), so it depends on the data only through
+    BetaSufficientStats. alpha/beta are the posterior mode; their Laplace
+    covariance is kept in param_cov. The point-mass probabilities are the
+    observed 0/1 shares, with the prior counted as nu0 interior observations.
     """
-    def __init__(self, prior_alpha=2.0, prior_beta=2.0):
+    def __init__(self, prior_alpha=2.0, prior_beta=2.0, prior_strength=2.0):
+        self.prior_alpha = prior_alpha
+        self.prior_beta = prior_beta
+        self.prior_strength = prior_strength
+        self.stats = BetaSufficientStats()
         self.alpha = prior_alpha
         self.beta = prior_beta
-        
+        self.param_cov = None
+
+    def _prior_stats(self):
+        """Pseudo-observations (nu0, s1_0, s2_0) encoding Beta(a0, b0)"""
+        nu0 = self.prior_strength
+        digamma_ab = special.digamma(self.prior_alpha + self.prior_beta)
+        s1 = nu0 * (special.digamma(self.prior_alpha) - digamma_ab)
+        s2 = nu0 * (special.digamma(self.prior_beta) - digamma_ab)
+        return nu0, s1, s2
+
     def update(self, observed_lgds: np.ndarray):
         """
-        Update posterior based on observed LGDs (0 to 1)
-        Using Method of Moments approximation for Beta update or simple count if binary
-        For continuous LGD [0,1], we can treat it as:
-        alpha_new = alpha_old + sum(lgd) * phi
-        beta_new = beta_old + sum(1-lgd) * phi
-        where phi is a precision parameter.
-        
-        Simplification: Treat observations as 'successes' and 'failures' weighted
+        Update posterior based on observed LGDs (0 to 1).
+        Cost is O(len(observed_lgds)) to accumulate statistics plus a
+        constant-size solve, independent of how much was observed before.
         """
-        # Simple update: mean matching
-        n = len(observed_lgds)
-        if n == 0:
+        if len(observed_lgds) == 0:
             return
-            
-        # Estimate alpha/beta from data using Method of Moments
-        mean = np.mean(observed_lgds)
-        var = np.var(observed_lgds)
-        
-        if var < 1e-6: var = 1e-6
-        
-        # Common estimation for Beta parameters
-        phi = (mean * (1 - mean) / var) - 1
-        if phi < 0: phi = 1.0 # Fallback
-        
-        alpha_data = mean * phi
-        beta_data = (1 - mean) * phi
-        
-        # Bayesian Update (weighted average of prior and data)
-        # This is a heuristic update for continuous data
-        weight = n / (n + 10.0) # Weight of data increases with n
-        
-        self.alpha = self.alpha * (1 - weight) + alpha_data * weight * n
-        self.beta = self.beta * (1 - weight) + beta_data * weight * n
+        self.update_stats(BetaSufficientStats.from_observations(observed_lgds))
+
+    def remove(self, observed_lgds: np.ndarray):
+        """Retract observations, e.g. the old LGD of a loan whose recoveries changed"""
+        if len(observed_lgds) == 0:
+            return
+        self.update_stats(BetaSufficientStats() - BetaSufficientStats.from_observations(observed_lgds))
+
+    def update_stats(self, delta: BetaSufficientStats):
+        """Apply additive statistics (a single recovery, or a shard merged in)"""
+        self.stats = self.stats + delta
+        self._solve()
+
+    def _solve(self, max_iter: int = 50, tol: float = 1e-10):
+        """Posterior mode of (alpha, beta) by Newton's method on the log parameters"""
+        nu0, s1_0, s2_0 = self._prior_stats()
+        nu = nu0 + self.stats.n
+        m1 = (s1_0 + self.stats.sum_log_x) / nu
+        m2 = (s2_0 + self.stats.sum_log_1mx) / nu
+
+        # Start from the method of moments when there is data, else the prior
+        a, b = self.prior_alpha, self.prior_beta
+        if self.stats.n > 1:
+            mean = self.stats.sum_x / self.stats.n
+            var = max(self.stats.sum_x2 / self.stats.n - mean**2, 1e-6)
+            phi = mean * (1 - mean) / var - 1
+            if phi > 0:
+                a, b = mean * phi, (1 - mean) * phi
+
+        # Stationarity: digamma(a) - digamma(a + b) = m1, digamma(b) - digamma(a + b) = m2
+        u = np.log([a, b])
+        for _ in range(max_iter):
+            a, b = np.exp(u)
+            dg_ab = special.digamma(a + b)
+            g = np.array([special.digamma(a) - dg_ab - m1, special.digamma(b) - dg_ab - m2])
+            tg_ab = special.polygamma(1, a + b)
+            J = np.array([
+                [special.polygamma(1, a) - tg_ab, -tg_ab],
+                [-tg_ab, special.polygamma(1, b) - tg_ab]
+            ]) * np.array([a, b])
+            step = np.clip(np.linalg.solve(J, g), -2.0, 2.0)
+            u = u - step
+            if np.max(np.abs(step)) < tol:
+                break
+
+        a, b = np.exp(u)
+        self.alpha, self.beta = float(a), float(b)
+
+        # Laplace covariance: inverse Hessian of the negative log posterior
+        tg_ab = special.polygamma(1, a + b)
+        H = nu * np.array([
+            [special.polygamma(1, a) - tg_ab, -tg_ab],
+            [-tg_ab, special.polygamma(1, b) - tg_ab]
+        ])
+        self.param_cov = np.linalg.inv(H)
+
+    def point_masses(self):
+        """(p_zero, p_one): probabilities of full recovery and total loss"""
+        total = self.prior_strength + self.stats.n + self.stats.n_zero + self.stats.n_one
+        return self.stats.n_zero / total, self.stats.n_one / total
+
+    def _quantile(self, q: float) -> float:
+        """Quantile of the inflated Beta: 0 and 1 absorb their point masses"""
+        p_zero, p_one = self.point_masses()
+        if q <= p_zero:
+            return 0.0
+        if q >= 1 - p_one:
+            return 1.0
+        return float(stats.beta.ppf((q - p_zero) / (1 - p_zero - p_one), self.alpha, self.beta))
 
     def predict(self) -> BayesianResult:
-        mean_lgd = self.alpha / (self.alpha + self.beta)
+        p_zero, p_one = self.point_masses()
+        mean_lgd = p_one + (1 - p_zero - p_one) * self.alpha / (self.alpha + self.beta)
         
-        # HDI for Beta distribution
-        lower_hdi = stats.beta.ppf(0.025, self.alpha, self.beta)
-        upper_hdi = stats.beta.ppf(0.975, self.alpha, self.beta)
+        # HDI for the inflated Beta distribution
+        lower_hdi = self._quantile(0.025)
+        upper_hdi = self._quantile(0.975)
         
         return BayesianResult(
             mean=float(mean_lgd),
             lower_hdi=float(lower_hdi),
             upper_hdi=float(upper_hdi),
             distribution="Beta",
-            params={"alpha": float(self.alpha), "beta": float(self.beta)}
+            params={
+                "alpha": float(self.alpha), "beta": float(self.beta),
+                "p_zero": float(p_zero), "p_one": float(p_one),
+                "n_observations": float(self.stats.n + self.stats.n_zero + self.stats.n_one)
+            }
         )
 
 class BayesianHazardModel:
     """
     Bayesian Survival Analysis (Weibull)
     Estimates Time-to-Default
+    Parameters are fitted on the log scale, theta = (log shape, log scale),
+    with a weak Gaussian prior on log scale and a weakly informative one on
+    log shape, so data without censoring or without spread in the durations
+    cannot push the shape off to infinity. The Laplace covariance of theta
+    drives the survival HDIs via the delta method on the log cumulative hazard.
     """
+    # Shapes beyond this mean every default lands at the same instant (tied
+    # durations, where the likelihood grows without bound); the fit stops there
+    MAX_LOG_SHAPE = np.log(100.0)
+
     def __init__(self):
         self.shape = 1.0 # k
         self.scale = 1.0 # lambda
+        # Laplace covariance of (log shape, log scale); None until fitted
+        self.param_cov = None
         
-    def fit(self, durations, events):
+    def fit(self, durations, events, prior_precision: float = 1e-2, shape_prior_precision: float = 1.0,
+            max_iter: int = 100, tol: float = 1e-10):
         """
-        Fit Weibull parameters using MLE (can be viewed as MAP with flat prior)
-        durations: time elapsed
+        Fit Weibull parameters by MAP on the full right-censored likelihood
+        durations: time elapsed (to default, or to censoring)
         events: 1 if default occurred, 0 if censored
+        prior_precision, shape_prior_precision: precisions of the zero-mean
+        Gaussian priors on log scale and log shape (shape 1 is exponential)
+
+        With z = log t, k = shape, r = z - log(scale), w = exp(k * r):
+            log L = sum(events * (log k + (k - 1) * z - k * log(scale))) - sum(w)
+        Gradient and Hessian are analytic, so each Newton step is a few
+        vectorized passes over the durations.
         """
-        # Use scipy.stats.weibull_min to fit
-        # Only use uncensored data for simple fit, or custom likelihood for censored
-        defaults = durations[events == 1]
-        if len(defaults) < 2:
+        t = np.asarray(durations, dtype=float)
+        d = np.asarray(events, dtype=float)
+        keep = t > 0
+        t, d = t[keep], d[keep]
+        n_events = d.sum()
+        if n_events < 1:
             return
-            
-        # Fit shape (c) and scale
-        params = stats.weibull_min.fit(defaults, floc=0)
-        self.shape = params[0]
-        self.scale = params[2]
+
+        z = np.log(t)
+        dz = np.dot(d, z)
+        precision = np.array([shape_prior_precision, prior_precision])
+
+        def neg_log_posterior(theta):
+            u, v = theta
+            k = np.exp(u)
+            ll = n_events * u + (k - 1) * dz - k * v * n_events - np.sum(np.exp(k * (z - v)))
+            return 0.5 * np.dot(precision, theta**2) - ll
+
+        def grad_hess(theta):
+            u, v = theta
+            k = np.exp(u)
+            r = z - v
+            w = np.exp(k * r)
+            sw, swr, swr2 = w.sum(), np.dot(w, r), np.dot(w, r * r)
+            sdr = dz - v * n_events
+            # Derivatives of log L
+            g = np.array([n_events + k * sdr - k * swr, -k * n_events + k * sw])
+            H = np.array([
+                [k * sdr - k * swr - k * k * swr2, -k * n_events + k * sw + k * k * swr],
+                [-k * n_events + k * sw + k * k * swr, -k * k * sw]
+            ])
+            # Negative log posterior
+            return precision * theta - g, np.diag(precision) - H
+
+        # Start from the exponential MLE (shape 1)
+        theta = np.array([0.0, np.log(t.sum() / n_events)])
+        nlp = neg_log_posterior(theta)
+        for _ in range(max_iter):
+            grad, H = grad_hess(theta)
+            try:
+                step = np.linalg.solve(H, grad)
+            except np.linalg.LinAlgError:
+                step = grad
+            if np.dot(step, grad) <= 0:
+                # Not a descent direction away from the mode; fall back to gradient
+                step = grad
+
+            s = 1.0
+            while s > 1e-8:
+                theta_new = theta - s * step
+                theta_new[0] = np.clip(theta_new[0], -self.MAX_LOG_SHAPE, self.MAX_LOG_SHAPE)
+                nlp_new = neg_log_posterior(theta_new)
+                if np.isfinite(nlp_new) and nlp_new <= nlp:
+                    break
+                s *= 0.5
+            else:
+                break
+
+            converged = abs(nlp - nlp_new) <= tol * (1 + abs(nlp))
+            theta, nlp = theta_new, nlp_new
+            if converged:
+                break
+
+        _, H = grad_hess(theta)
+        self.shape, self.scale = float(np.exp(theta[0])), float(np.exp(theta[1]))
+        # The Laplace approximation needs an interior mode with a positive definite Hessian
+        self.param_cov = None
+        if abs(theta[0]) < self.MAX_LOG_SHAPE:
+            try:
+                L_inv = np.linalg.inv(np.linalg.cholesky(H))
+                self.param_cov = L_inv.T @ L_inv
+            except np.linalg.LinAlgError:
+                pass
+
+    def _log_cum_hazard(self, t):
+        """log H(t) = shape * (log t - log scale) and its standard deviation"""
+        log_t = np.log(np.maximum(np.asarray(t, dtype=float), 1e-12))
+        g = self.shape * (log_t - np.log(self.scale))
+        if self.param_cov is None:
+            return g, None
+        # Gradient of g with respect to (log shape, log scale)
+        J = np.stack([g, np.full_like(g, -self.shape)], axis=-1)
+        var = np.einsum('...i,ij,...j->...', J, self.param_cov, J)
+        return g, np.sqrt(np.maximum(var, 0.0))
         
-    def predict_survival(self, t: float) -> BayesianResult:
+    def survival_batch(self, t: np.ndarray, hdi_prob: float = 0.95) -> BayesianBatchResult:
+        """Survival probability and HDI for an array of times (any shape)"""
+        g, sd = self._log_cum_hazard(t)
+        surv_prob = np.exp(-np.exp(g))
+        if sd is None:
+            std_dev = 0.05
+            lower_hdi = np.clip(surv_prob - 1.96 * std_dev, 0.0, 1.0)
+            upper_hdi = np.clip(surv_prob + 1.96 * std_dev, 0.0, 1.0)
+        else:
+            z = stats.norm.ppf(0.5 + hdi_prob / 2)
+            lower_hdi = np.exp(-np.exp(g + z * sd))
+            upper_hdi = np.exp(-np.exp(g - z * sd))
+        return BayesianBatchResult(
+            mean=surv_prob,
+            lower_hdi=lower_hdi,
+            upper_hdi=upper_hdi,
+            distribution="Weibull",
+            params={"shape": float(self.shape), "scale": float(self.scale)}
+        )
+
+    def hazard_rate(self, t: np.ndarray) -> np.ndarray:
+        """Instantaneous hazard h(t) = (shape/scale) * (t/scale)^(shape-1)"""
+        t = np.maximum(np.asarray(t, dtype=float), 1e-12)
+        return (self.shape / self.scale) * (t / self.scale) ** (self.shape - 1)
+
+    def conditional_survival(self, ages: np.ndarray, horizons: np.ndarray) -> np.ndarray:
+        """
+        Probability of surviving a further h given survival to age a,
+        S(a + h) / S(a), as an (n_ages, n_horizons) array.
+        """
+        ages = np.asarray(ages, dtype=float)[:, None]
+        horizons = np.asarray(horizons, dtype=float)[None, :]
+        cum_hazard = lambda t: (np.maximum(t, 0.0) / self.scale) ** self.shape
+        return np.exp(cum_hazard(ages) - cum_hazard(ages + horizons))
+
+    def conditional_survival_batch(self, ages: np.ndarray, horizons: np.ndarray,
+                                   hdi_prob: float = 0.95) -> BayesianBatchResult:
+        """
+        conditional_survival with HDIs, as (n_ages, n_horizons) arrays.
+        The delta method runs on log(H(a + h) - H(a)), the log cumulative
+        hazard accrued over the horizon, as survival_batch does for H(t).
+        """
+        surv_prob = self.conditional_survival(ages, horizons)
+        if self.param_cov is None:
+            std_dev = 0.05
+            lower_hdi = np.clip(surv_prob - 1.96 * std_dev, 0.0, 1.0)
+            upper_hdi = np.clip(surv_prob + 1.96 * std_dev, 0.0, 1.0)
+        else:
+            ages = np.asarray(ages, dtype=float)[:, None]
+            horizons = np.asarray(horizons, dtype=float)[None, :]
+            log_scale = np.log(self.scale)
+            # H(t) and its derivative in log shape, k * H(t) * (log t - log scale); both vanish at t = 0
+            start_g, _ = self._log_cum_hazard(ages)
+            end_g, _ = self._log_cum_hazard(ages + horizons)
+            start_h = np.where(ages > 0, np.exp(start_g), 0.0)
+            end_h = np.exp(end_g)
+            accrued = np.maximum(end_h - start_h, 1e-300)
+            d_shape = (end_h * end_g - np.where(ages > 0, start_h * start_g, 0.0)) / accrued
+            J = np.stack([d_shape, np.full_like(d_shape, -self.shape)], axis=-1)
+            sd = np.sqrt(np.maximum(np.einsum('...i,ij,...j->...', J, self.param_cov, J), 0.0))
+            z = stats.norm.ppf(0.5 + hdi_prob / 2)
+            lower_hdi = np.exp(-accrued * np.exp(z * sd))
+            upper_hdi = np.exp(-accrued * np.exp(-z * sd))
+        return BayesianBatchResult(
+            mean=surv_prob,
+            lower_hdi=lower_hdi,
+            upper_hdi=upper_hdi,
+            distribution="Weibull",
+            params={"shape": float(self.shape), "scale": float(self.scale)}
+        )
+
+    def hazard_rate_batch(self, t: np.ndarray, hdi_prob: float = 0.95) -> BayesianBatchResult:
+        """hazard_rate with HDIs from the delta method on log h(t); NaN HDIs without a Laplace covariance"""
+        rate = self.hazard_rate(t)
+        if self.param_cov is None:
+            unknown = np.full_like(rate, np.nan)
+            return BayesianBatchResult(mean=rate, lower_hdi=unknown, upper_hdi=unknown, distribution="Weibull",
+                                       params={"shape": float(self.shape), "scale": float(self.scale)})
+        # log h = log shape - log scale + (shape - 1) * (log t - log scale)
+        log_ratio = np.log(np.maximum(np.asarray(t, dtype=float), 1e-12)) - np.log(self.scale)
+        J = np.stack([1.0 + self.shape * log_ratio, np.full_like(log_ratio, -self.shape)], axis=-1)
+        sd = np.sqrt(np.maximum(np.einsum('...i,ij,...j->...', J, self.param_cov, J), 0.0))
+        z = stats.norm.ppf(0.5 + hdi_prob / 2)
+        return BayesianBatchResult(
+            mean=rate,
+            lower_hdi=rate * np.exp(-z * sd),
+            upper_hdi=rate * np.exp(z * sd),
+            distribution="Weibull",
+            params={"shape": float(self.shape), "scale": float(self.scale)}
+        )
+
+    def predict_survival(self, t: float, hdi_prob: float = 0.95) -> BayesianResult:
         """Predict survival probability at time t"""
         # Survival function S(t) = exp(-(t/scale)^shape)
-        surv_prob = np.exp(-(t / self.scale) ** self.shape)
-        
-        # Approximate uncertainty (heuristic)
-        std_dev = 0.05 # Placeholder for full Bayesian uncertainty
+        batch = self.survival_batch(np.array([t]), hdi_prob)
         
         return BayesianResult(
-            mean=float(surv_prob),
-            lower_hdi=max(0.0, float(surv_prob - 1.96 * std_dev)),
-            upper_hdi=min(1.0, float(surv_prob + 1.96 * std_dev)),
-            distribution="Weibull",
-            params={"shape": float(self.shape), "scale": float(self.scale)}
+            mean=float(batch.mean[0]),
+            lower_hdi=float(batch.lower_hdi[0]),
+            upper_hdi=float(batch.upper_hdi[0]),
+            distribution=batch.distribution,
+            params=batch.params
         )
@@ -0,0 +1,419 @@
+"""
+GroupRiskMetric cube
+Precomputes risk measures for every combination of branch, loan type and
+tenure: each dimension alone, every pair, the full cross and an overall row
+(a NULL dimension means "all"). The whole cube comes from one grouped pass,
+SQL GROUPING SETS where the database supports them and a pandas groupby over
+per-loan columns otherwise, and replaces the table in one transaction.
+
+Measures cover active loans, with outstanding principal as EAD; recovery
+rate covers defaulted and written-off loans.
+
+Between rebuilds, loan, repayment, recovery and risk metric writes keep the
+additive columns live by applying each loan's change to the cells that
+contain it (see apply_loan_change and core/signals.py).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import combinations
+
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import Case, When, F, Q, Sum, Value, IntegerField, DecimalField, FloatField, OuterRef, Subquery, ExpressionWrapper
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .models import Loan, Recovery, GroupRiskMetric
+from .analytics import outstanding_annotations, PAR_BUCKETS, MONEY
+from .features import DEFAULT_STATUSES
+
+DIMENSIONS = ('branch_id', 'loan_type', 'tenure_months')
+
+# Full cross, pairs, single dimensions and the overall row
+GROUPING_SETS = [combo for size in range(len(DIMENSIONS), -1, -1) for combo in combinations(DIMENSIONS, size)]
+
+# Backends whose SQL dialect has GROUP BY GROUPING SETS
+GROUPING_SETS_VENDORS = {'postgresql'}
+
+# Additive per-cell measures; rates and means are derived from them
+MEASURES = [
+    'loan_count', 'total_ead', *(f'at_risk_{days}' for days in PAR_BUCKETS),
+    'pd_sum', 'pd_count', 'lgd_sum', 'lgd_count', 'expected_loss',
+    'defaulted_ead', 'recovered',
+]
+
+CREATE_BATCH_SIZE = 1000
+
+RATE = DecimalField(max_digits=5, decimal_places=4)
+
+
+def _no_progress(progress, message):
+    pass
+
+
+def per_loan_queryset(as_of=None):
+    """
+    One row per active or defaulted loan with its dimensions and the per-loan
+    inputs of every cube measure.
+    """
+    recovered = Recovery.objects.filter(loan=OuterRef('pk')).order_by().values('loan').annotate(
+        total=Sum('recovery_amount')
+    ).values('total')
+    return Loan.objects.filter(status__in=['ACTIVE', *DEFAULT_STATUSES]).order_by().annotate(
+        **outstanding_annotations(as_of),
+        active=Case(When(status='ACTIVE', then=1), default=0, output_field=IntegerField()),
+        defaulted=Case(When(status__in=DEFAULT_STATUSES, then=1), default=0, output_field=IntegerField()),
+        pd_mean=F('risk_metric__pd_mean'),
+        lgd_mean=F('risk_metric__lgd_mean'),
+        recovered=Coalesce(Subquery(recovered, output_field=MONEY), Value(Decimal('0')), output_field=MONEY),
+    ).values(
+        *DIMENSIONS, 'active', 'defaulted', 'principal_amount', 'outstanding', 'oldest_due', 'pd_mean', 'lgd_mean', 'recovered'
+    )
+
+
+def _grouping_sets_cells(as_of):
+    """Every cube cell in one GROUP BY GROUPING SETS query over the per-loan rows"""
+    inner_sql, inner_params = per_loan_queryset(as_of).query.sql_with_params()
+    qn = connection.ops.quote_name
+    dims = ', '.join(qn(d) for d in DIMENSIONS)
+    sets = ', '.join('(' + ', '.join(qn(d) for d in combo) + ')' for combo in GROUPING_SETS)
+
+    at_risk = ',\n'.join(
+        f"SUM(CASE WHEN active = 1 AND oldest_due < %s THEN outstanding ELSE 0 END) AS at_risk_{days}"
+        for days in PAR_BUCKETS
+    )
+    sql = f"""
+        SELECT {dims},
+            SUM(active) AS loan_count,
+            SUM(CASE WHEN active = 1 THEN outstanding ELSE 0 END) AS total_ead,
+            {at_risk},
+            SUM(CASE WHEN active = 1 AND pd_mean IS NOT NULL THEN pd_mean ELSE 0 END) AS pd_sum,
+            SUM(CASE WHEN active = 1 AND pd_mean IS NOT NULL THEN 1 ELSE 0 END) AS pd_count,
+            SUM(CASE WHEN active = 1 AND lgd_mean IS NOT NULL THEN lgd_mean ELSE 0 END) AS lgd_sum,
+            SUM(CASE WHEN active = 1 AND lgd_mean IS NOT NULL THEN 1 ELSE 0 END) AS lgd_count,
+            SUM(CASE WHEN active = 1 THEN COALESCE(pd_mean, 0) * COALESCE(lgd_mean, 0) * outstanding ELSE 0 END) AS expected_loss,
+            SUM(CASE WHEN defaulted = 1 THEN principal_amount ELSE 0 END) AS defaulted_ead,
+            SUM(CASE WHEN defaulted = 1 THEN recovered ELSE 0 END) AS recovered
+        FROM ({inner_sql}) AS loans
+        GROUP BY GROUPING SETS ({sets})
+    """
+    cutoffs = [as_of - timedelta(days=days) for days in PAR_BUCKETS]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*cutoffs, *inner_params])
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _pandas_cells(as_of):
+    """Every cube cell from per-loan columns grouped in pandas"""
+    df = pd.DataFrame.from_records(list(per_loan_queryset(as_of)))
+    if df.empty:
+        return []
+
+    active = df['active'] == 1
+    defaulted = df['defaulted'] == 1
+    outstanding = df['outstanding'].astype(float)
+    oldest_due = pd.to_datetime(df['oldest_due'])
+    pd_value = df['pd_mean'].astype(float)
+    lgd_value = df['lgd_mean'].astype(float)
+
+    measures = pd.DataFrame({
+        'loan_count': active.astype(int),
+        'total_ead': outstanding.where(active, 0.0),
+        'pd_sum': pd_value.where(active, float('nan')).fillna(0.0),
+        'pd_count': (active & pd_value.notna()).astype(int),
+        'lgd_sum': lgd_value.where(active, float('nan')).fillna(0.0),
+        'lgd_count': (active & lgd_value.notna()).astype(int),
+        'expected_loss': (pd_value.fillna(0.0) * lgd_value.fillna(0.0) * outstanding).where(active, 0.0),
+        'defaulted_ead': df['principal_amount'].astype(float).where(defaulted, 0.0),
+        'recovered': df['recovered'].astype(float).where(defaulted, 0.0),
+    })
+    for days in PAR_BUCKETS:
+        late = active & (oldest_due < pd.Timestamp(as_of - timedelta(days=days)))
+        measures[f'at_risk_{days}'] = outstanding.where(late, 0.0)
+    measures[list(DIMENSIONS)] = df[list(DIMENSIONS)]
+
+    cells = []
+    for combo in GROUPING_SETS:
+        if combo:
+            grouped = measures.groupby(list(combo), sort=False)[MEASURES].sum().reset_index()
+        else:
+            grouped = measures[MEASURES].sum().to_frame().T
+        for dim in DIMENSIONS:
+            if dim not in combo:
+                grouped[dim] = None
+        cells.extend(grouped.to_dict('records'))
+    return cells
+
+
+def cube_cells(as_of=None):
+    """Additive measures for every cube cell, via GROUPING SETS or pandas"""
+    as_of = as_of or timezone.now().date()
+    if connection.vendor in GROUPING_SETS_VENDORS:
+        return _grouping_sets_cells(as_of)
+    return _pandas_cells(as_of)
+
+
+def _ratio(numerator, denominator):
+    numerator, denominator = float(numerator or 0), float(denominator or 0)
+    return min(max(numerator / denominator, 0.0), 1.0) if denominator > 0 else 0.0
+
+
+def _metric_from_cell(cell, now):
+    """Build an unsaved GroupRiskMetric from a cube cell's additive measures"""
+    rate = lambda value: Decimal(str(round(value, 4)))
+    money = lambda value: Decimal(str(round(float(value or 0), 2)))
+    branch_id, loan_type, tenure = (cell[d] for d in DIMENSIONS)
+    return GroupRiskMetric(
+        branch_id=None if branch_id is None else int(branch_id),
+        loan_type=loan_type,
+        tenure_months=None if tenure is None else int(tenure),
+        mean_pd=rate(_ratio(cell['pd_sum'], cell['pd_count'])),
+        mean_lgd=rate(_ratio(cell['lgd_sum'], cell['lgd_count'])),
+        pd_sum=Decimal(str(round(float(cell['pd_sum'] or 0), 4))),
+        pd_count=int(cell['pd_count'] or 0),
+        lgd_sum=Decimal(str(round(float(cell['lgd_sum'] or 0), 4))),
+        lgd_count=int(cell['lgd_count'] or 0),
+        total_ead=money(cell['total_ead']),
+        total_expected_loss=money(cell['expected_loss']),
+        **{f'par{days}_rate': rate(_ratio(cell[f'at_risk_{days}'], cell['total_ead'])) for days in PAR_BUCKETS},
+        **{f'total_at_risk_{days}': money(cell[f'at_risk_{days}']) for days in PAR_BUCKETS},
+        recovery_rate=rate(_ratio(cell['recovered'], cell['defaulted_ead'])),
+        defaulted_ead=money(cell['defaulted_ead']),
+        total_recovered=money(cell['recovered']),
+        loan_count=int(cell['loan_count'] or 0),
+        calculated_at=now,
+    )
+
+
+def refresh_group_metrics(as_of=None, report=_no_progress):
+    """
+    Rebuild the GroupRiskMetric table from the current loan book.
+    The delete and bulk insert run in one transaction, so readers see either
+    the old cube or the new one.
+    """
+    started = time.perf_counter()
+    report(0.1, "Aggregating cube cells")
+    cells = cube_cells(as_of)
+
+    report(0.7, f"Writing {len(cells)} cells")
+    now = timezone.now()
+    metrics = [_metric_from_cell(cell, now) for cell in cells]
+    with transaction.atomic():
+        GroupRiskMetric.objects.all().delete()
+        GroupRiskMetric.objects.bulk_create(metrics, batch_size=CREATE_BATCH_SIZE)
+
+    return {
+        "cells": len(metrics),
+        "method": "grouping_sets" if connection.vendor in GROUPING_SETS_VENDORS else "pandas",
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def refresh_job(report):
+    """Background job entry point for a cube refresh"""
+    return refresh_group_metrics(report=report)
+
+
+# Incremental maintenance
+
+# GroupRiskMetric columns kept current by deltas, in contribution order
+DELTA_FIELDS = [
+    'loan_count', 'total_ead', *(f'total_at_risk_{days}' for days in PAR_BUCKETS),
+    'pd_sum', 'pd_count', 'lgd_sum', 'lgd_count',
+    'total_expected_loss', 'defaulted_ead', 'total_recovered',
+]
+
+_state = threading.local()
+
+
+def loan_contribution(loan_id, as_of=None):
+    """
+    (dimensions, additive measures) a loan currently adds to every cell that
+    contains it, or None if it is not in the cube population.
+    """
+    as_of = as_of or timezone.now().date()
+    row = per_loan_queryset(as_of).filter(pk=loan_id).first()
+    if row is None:
+        return None
+    active, defaulted = row['active'] == 1, row['defaulted'] == 1
+    outstanding = row['outstanding'] or Decimal('0')
+    zero = Decimal('0')
+
+    values = [int(active), outstanding if active else zero]
+    for days in PAR_BUCKETS:
+        late = active and row['oldest_due'] is not None and row['oldest_due'] < as_of - timedelta(days=days)
+        values.append(outstanding if late else zero)
+    for mean in (row['pd_mean'], row['lgd_mean']):
+        scored = active and mean is not None
+        values.extend([mean if scored else zero, int(scored)])
+    values.append((row['pd_mean'] or zero) * (row['lgd_mean'] or zero) * outstanding if active else zero)
+    values.append(row['principal_amount'] if defaulted else zero)
+    values.append(row['recovered'] if defaulted else zero)
+    return tuple(row[d] for d in DIMENSIONS), values
+
+
+def _cell_filter(dims):
+    """Q matching the 2^len(DIMENSIONS) cells (roll-ups included) that contain dims"""
+    q = Q()
+    for name, value in zip(DIMENSIONS, dims):
+        q &= Q(**{name: value}) | Q(**{f'{name}__isnull': True})
+    return q
+
+
+def _cells_containing(dims):
+    """Dimension tuples of the 2^len(DIMENSIONS) cells that contain dims"""
+    return {
+        tuple(value if name in combo else None for name, value in zip(DIMENSIONS, dims))
+        for combo in GROUPING_SETS
+    }
+
+
+def _ensure_cells(dims):
+    """
+    Create zero rows for cells containing dims that the cube lacks, e.g. the
+    first loan of a branch, type or tenure combination.
+    """
+    if not _cells_containing(dims) - set(GroupRiskMetric.objects.filter(_cell_filter(dims)).values_list(*DIMENSIONS)):
+        return
+    with transaction.atomic():
+        # Creation locks the overall row, so concurrent writers cannot insert the same cell twice
+        list(GroupRiskMetric.objects.select_for_update().filter(
+            branch__isnull=True, loan_type__isnull=True, tenure_months__isnull=True
+        ))
+        existing = set(GroupRiskMetric.objects.filter(_cell_filter(dims)).values_list(*DIMENSIONS))
+        now = timezone.now()
+        GroupRiskMetric.objects.bulk_create([
+            _metric_from_cell({**dict(zip(DIMENSIONS, cell)), **dict.fromkeys(MEASURES, 0)}, now)
+            for cell in _cells_containing(dims) - existing
+        ])
+
+
+def _apply(dims, deltas):
+    """
+    Add deltas to every cell containing dims in one UPDATE. Cells are created
+    when a loan enters them and dropped once no loan is left in them, matching
+    what a rebuild would produce.
+    """
+    delta = dict(zip(DELTA_FIELDS, deltas))
+    entering = delta['loan_count'] > 0 or delta['defaulted_ead'] > 0
+    leaving = delta['loan_count'] < 0 or delta['defaulted_ead'] < 0
+    if entering:
+        _ensure_cells(dims)
+    updated = {field: F(field) + value for field, value in delta.items()}
+
+    def ratio(numerator, denominator):
+        # Right-hand sides of an UPDATE see the old row, so divide the updated values
+        return Case(
+            When(**{f'{denominator}__gt': -delta[denominator]},
+                 then=ExpressionWrapper(
+                     Cast(updated[numerator], FloatField()) / Cast(updated[denominator], FloatField()),
+                     output_field=RATE
+                 )),
+            default=Value(Decimal('0')),
+            output_field=RATE
+        )
+
+    changes = dict(updated)
+    for days in PAR_BUCKETS:
+        changes[f'par{days}_rate'] = ratio(f'total_at_risk_{days}', 'total_ead')
+    changes['recovery_rate'] = ratio('total_recovered', 'defaulted_ead')
+    changes['mean_pd'] = ratio('pd_sum', 'pd_count')
+    changes['mean_lgd'] = ratio('lgd_sum', 'lgd_count')
+    changes['calculated_at'] = timezone.now()
+    updated_rows = GroupRiskMetric.objects.filter(_cell_filter(dims)).update(**changes)
+    if leaving:
+        # Only active and defaulted loans are in the cube, so both at zero means an empty cell
+        GroupRiskMetric.objects.filter(_cell_filter(dims), loan_count=0, defaulted_ead=0).delete()
+    return updated_rows
+
+
+def _flush(pending):
+    for dims, deltas in pending.items():
+        if any(deltas):
+            _apply(dims, deltas)
+
+
+@contextmanager
+def batch_deltas():
+    """
+    Merge the cube deltas of every write inside the block and apply them per
+    cell when it exits. Use inside transaction.atomic() around bulk postings.
+    """
+    if getattr(_state, 'pending', None) is not None:
+        yield
+        return
+    _state.pending = {}
+    try:
+        yield
+        pending = _state.pending
+    finally:
+        _state.pending = None
+    _flush(pending)
+
+
+def _record(dims, deltas):
+    pending = getattr(_state, 'pending', None)
+    if pending is None:
+        if any(deltas):
+            _apply(dims, deltas)
+        return
+    current = pending.get(dims)
+    pending[dims] = deltas if current is None else [a + b for a, b in zip(current, deltas)]
+
+
+def stash_loan_state(loan_id, deleting=False):
+    """
+    Remember a loan's contribution before a write (see apply_loan_change).
+    deleting=True marks the loan itself as being deleted, so the cascade of
+    repayment and recovery deletes that follows is folded into its removal.
+    """
+    if loan_id is None or loan_id in _deleting() or not _cube_built():
+        return
+    _stash()[loan_id] = loan_contribution(loan_id)
+    if deleting:
+        _deleting().add(loan_id)
+
+
+def apply_loan_change(loan_id, deleted=False, created=False):
+    """
+    Apply the difference between a loan's stashed and current contribution.
+    If the loan moved cells (status, branch, type or tenure changed), its old
+    contribution leaves the old cells and the new one enters the new cells.
+    created=True marks a newly inserted loan, which had no contribution before.
+    """
+    if created and _cube_built():
+        _stash()[loan_id] = None
+    if loan_id in _deleting():
+        if not deleted:
+            return
+        _deleting().discard(loan_id)
+    if loan_id not in _stash():
+        return
+    before = _stash().pop(loan_id)
+    after = loan_contribution(loan_id)
+    if before is not None and after is not None and before[0] == after[0]:
+        _record(after[0], [a - b for a, b in zip(after[1], before[1])])
+        return
+    if before is not None:
+        _record(before[0], [-b for b in before[1]])
+    if after is not None:
+        _record(after[0], after[1])
+
+
+def _stash():
+    return _state.__dict__.setdefault('stash', {})
+
+
+def _deleting():
+    return _state.__dict__.setdefault('deleting', set())
+
+
+def _cube_built():
+    """Deltas only make sense on top of a materialized cube"""
+    return GroupRiskMetric.objects.filter(
+        branch__isnull=True, loan_type__isnull=True, tenure_months__isnull=True
+    ).exists()
@@ -0,0 +1,163 @@
+"""
+Columnar feature extraction for the Bayesian models
+Reads only the needed columns with values_list() and streams them with
+iterator(chunk_size=...) into NumPy arrays, so building a large training or
+scoring matrix never materializes model instances.
+"""
+from decimal import Decimal
+from itertools import islice
+
+import numpy as np
+from django.db.models import Case, When, IntegerField, DecimalField, CharField, OuterRef, Subquery, Sum, Min, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Loan, Collateral
+
+# Loan columns used as PD features, in model order
+FEATURE_FIELDS = ['principal_amount', 'monthly_interest_rate', 'tenure_months', 'borrower__monthly_income']
+
+# Loan statuses counted as a default event
+DEFAULT_STATUSES = ['DEFAULTED', 'WRITTEN_OFF']
+
+DEFAULT_CHUNK_SIZE = 20000
+
+# Average month length used to express durations in months
+DAYS_PER_MONTH = 30.4375
+
+
+def iter_column_chunks(queryset, fields, chunk_size=DEFAULT_CHUNK_SIZE, dtype=float):
+    """
+    Yield 2-D arrays of at most chunk_size rows for the given columns.
+    NULLs become NaN for float dtypes. Use this for out-of-core processing.
+    """
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield np.array(chunk, dtype=dtype)
+
+
+def column_matrix(queryset, fields, chunk_size=DEFAULT_CHUNK_SIZE, dtype=float):
+    """Return an (n_rows, len(fields)) array filled chunk by chunk into a preallocated buffer"""
+    out = np.empty((queryset.count(), len(fields)), dtype=dtype)
+    filled = 0
+    for chunk in iter_column_chunks(queryset, fields, chunk_size, dtype):
+        end = filled + len(chunk)
+        if end > out.shape[0]:
+            # Rows inserted since count(); grow rather than fail
+            out = np.concatenate([out[:filled], np.empty((end - filled, len(fields)), dtype=dtype)])
+        out[filled:end] = chunk
+        filled = end
+    return out[:filled]
+
+
+def loan_feature_matrix(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return (loan_ids, X) for a Loan queryset, reading only the feature columns"""
+    data = column_matrix(queryset, ['id', *FEATURE_FIELDS], chunk_size)
+    return data[:, 0].astype(np.int64), data[:, 1:]
+
+
+def loan_training_matrix(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Return (loan_ids, X, y) for a Loan queryset.
+    The default flag is computed in SQL so only numeric columns cross the wire.
+    """
+    queryset = queryset.annotate(
+        is_default=Case(When(status__in=DEFAULT_STATUSES, then=1), default=0, output_field=IntegerField())
+    )
+    data = column_matrix(queryset, ['id', *FEATURE_FIELDS, 'is_default'], chunk_size)
+    return data[:, 0].astype(np.int64), data[:, 1:-1], data[:, -1]
+
+
+def lgd_observations(queryset=None, segments=False):
+    """
+    Realized LGD for every defaulted or written-off loan in one aggregate query.
+    Returns a dict of column arrays: loan_id, ead, recoveries, lgd and, with
+    segments=True, branch_id and collateral_type (type of the highest-value
+    collateral item, "NONE" if there is none) for segmented LGD models.
+    """
+    if queryset is None:
+        queryset = Loan.objects.all()
+    queryset = queryset.filter(status__in=DEFAULT_STATUSES).annotate(
+        recovered=Coalesce(
+            Sum('recoveries__recovery_amount'),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=15, decimal_places=2)
+        )
+    )
+    fields = ['id', 'principal_amount', 'recovered']
+    if segments:
+        main_collateral = Collateral.objects.filter(loan=OuterRef('pk')).order_by('-appraised_value_mwk')
+        queryset = queryset.annotate(
+            collateral_type=Coalesce(
+                Subquery(main_collateral.values('collateral_type')[:1]),
+                Value('NONE'),
+                output_field=CharField()
+            )
+        )
+        fields += ['branch_id', 'collateral_type']
+
+    rows = list(queryset.order_by().values_list(*fields))
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+
+    # LGD = 1 - (Recoveries / EAD), with principal as a simplified EAD
+    ead = np.array(columns[1], dtype=float)
+    recoveries = np.array(columns[2], dtype=float)
+    recovery_rate = np.divide(recoveries, ead, out=np.zeros_like(ead), where=ead > 0)
+
+    result = {
+        'loan_id': np.array(columns[0], dtype=np.int64),
+        'ead': ead,
+        'recoveries': recoveries,
+        'lgd': np.clip(1.0 - recovery_rate, 0.0, 1.0),
+    }
+    if segments:
+        result['branch_id'] = np.array(columns[3], dtype=np.int64)
+        result['collateral_type'] = np.array(columns[4], dtype=object)
+    return result
+
+
+def hazard_observations(queryset=None, as_of=None):
+    """
+    Time-to-default data for every disbursed loan, in one aggregate query.
+    Defaulted and written-off loans are events at their first missed
+    installment (falling back to maturity). Other loans are right-censored:
+    closed loans at maturity, active ones at as_of (today by default).
+    Returns a dict of column arrays: loan_id, durations (months), events.
+    """
+    if queryset is None:
+        queryset = Loan.objects.all()
+    as_of = np.datetime64(as_of or timezone.now().date(), 'D')
+
+    queryset = queryset.filter(disbursement_date__isnull=False).annotate(
+        first_missed=Min('repayments__scheduled_date', filter=Q(repayments__payment_status='MISSED_PAYMENT')),
+        is_default=Case(When(status__in=DEFAULT_STATUSES, then=1), default=0, output_field=IntegerField())
+    )
+    rows = list(queryset.order_by().values_list(
+        'id', 'disbursement_date', 'maturity_date', 'first_missed', 'is_default', 'status'
+    ))
+    columns = list(zip(*rows)) if rows else [()] * 6
+
+    start = np.array(columns[1], dtype='datetime64[D]')
+    maturity = np.array(columns[2], dtype='datetime64[D]')
+    first_missed = np.array(columns[3], dtype='datetime64[D]')
+    events = np.array(columns[4], dtype=float)
+    closed = np.array(columns[5], dtype=object) == 'CLOSED'
+
+    # Censoring point: maturity for closed loans, as_of for loans still running
+    end = np.where(closed & ~np.isnat(maturity), maturity, as_of)
+    # Event time: first missed installment, else maturity, else as_of
+    default_end = np.where(~np.isnat(first_missed), first_missed, np.where(~np.isnat(maturity), maturity, as_of))
+    end = np.where(events == 1, default_end, np.minimum(end, as_of))
+
+    durations = (end - start).astype(float) / DAYS_PER_MONTH
+    # Same-day events still carry a little exposure
+    durations = np.maximum(durations, 1.0 / DAYS_PER_MONTH)
+
+    return {
+        'loan_id': np.array(columns[0], dtype=np.int64),
+        'durations': durations,
+        'events': events,
+    }
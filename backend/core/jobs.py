@@ -0,0 +1,210 @@
+"""
+Minimal background job runner
+Jobs run on a small in-process thread pool. Their status is written as JSON
+files under MODEL_DIR/jobs, so any worker on the box can answer a status poll.
+Submitting a job of a kind that is already queued or running returns the
+existing job instead of starting another one. Status files of finished jobs
+are removed JOB_TTL seconds after their last write, on the next submit.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .model_store import MODEL_DIR
+
+JOB_DIR = os.path.join(MODEL_DIR, 'jobs')
+JOB_TTL = getattr(settings, 'JOB_TTL', 7 * 24 * 3600)
+
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    status: str = QUEUED
+    progress: float = 0.0
+    message: str = ''
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    pid: int = field(default_factory=os.getpid)
+    created_at: str = field(default_factory=lambda: timezone.now().isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobRunner:
+    def __init__(self, job_dir: str = JOB_DIR, max_workers: int = 1, ttl: float = JOB_TTL):
+        self.job_dir = job_dir
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.job_dir, name)
+
+    def _write(self, job: Job) -> None:
+        path = self._path(f"{job.id}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(asdict(job), f)
+        os.replace(tmp_path, path)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        try:
+            with open(self._path(f"{os.path.basename(job_id)}.json")) as f:
+                return Job(**json.load(f))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+
+    def prune(self) -> int:
+        """
+        Remove status files not written for ttl seconds, unless their job is
+        still live. Returns the number of files removed.
+        """
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for name in os.listdir(self.job_dir):
+            if not name.endswith('.json'):
+                continue
+            path = self._path(name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            job = self.get(name[:-5])
+            if job is not None and job.is_active and _pid_alive(job.pid):
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def _claim(self, kind: str, job: Job) -> Optional[Job]:
+        """
+        Take the per-kind lock for job. Returns the job already holding it if
+        that one is still live, otherwise None once job owns the lock.
+        The lock is written in full and then linked into place, so readers
+        never see an empty lock file.
+        """
+        lock_path = self._path(f"{kind}.lock")
+        tmp_path = self._path(f"{kind}.{job.id}.lock.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(job.id)
+        try:
+            while True:
+                try:
+                    os.link(tmp_path, lock_path)
+                    return None
+                except FileExistsError:
+                    pass
+                try:
+                    with open(lock_path) as f:
+                        holder_id = f.read().strip()
+                except FileNotFoundError:
+                    continue
+                holder = self.get(holder_id)
+                if holder is not None and holder.is_active and _pid_alive(holder.pid):
+                    return holder
+                # Stale lock left by a finished or crashed job
+                self._remove_lock(lock_path, holder_id, job)
+        finally:
+            os.remove(tmp_path)
+
+    def _remove_lock(self, lock_path: str, holder_id: str, job: Job) -> None:
+        """
+        Remove the lock if holder_id still holds it. The lock is renamed
+        aside atomically, so of several processes removing the same lock only
+        one moves it. A process that instead moved a lock freshly taken by
+        someone else links it back.
+        """
+        moved = f"{lock_path}.{job.id}.removed"
+        try:
+            os.rename(lock_path, moved)
+        except FileNotFoundError:
+            return
+        try:
+            with open(moved) as f:
+                if f.read().strip() != holder_id:
+                    with contextlib.suppress(FileExistsError):
+                        os.link(moved, lock_path)
+        finally:
+            os.remove(moved)
+
+    def _release(self, kind: str, job: Job) -> None:
+        self._remove_lock(self._path(f"{kind}.lock"), job.id, job)
+
+    def submit(self, kind: str, func: Callable, *args) -> Tuple[Job, bool]:
+        """
+        Queue func(report, *args) as a job of the given kind.
+        Returns (job, created); created is False when an existing job was reused.
+        """
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.prune()
+        job = Job(id=uuid.uuid4().hex, kind=kind)
+        with self._lock:
+            self._write(job)
+            holder = self._claim(kind, job)
+            if holder is not None:
+                os.remove(self._path(f"{job.id}.json"))
+                return holder, False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+            self._executor.submit(self._run, job, func, args)
+        return job, True
+
+    def _run(self, job: Job, func: Callable, args) -> None:
+        def report(progress, message=''):
+            job.progress = round(float(progress), 3)
+            job.message = message
+            self._write(job)
+
+        job.status = RUNNING
+        job.started_at = timezone.now().isoformat()
+        self._write(job)
+        try:
+            job.result = func(report, *args)
+            job.status = SUCCEEDED
+            job.progress = 1.0
+            job.message = ''
+        except Exception as exc:
+            job.status = FAILED
+            job.error = str(exc) or exc.__class__.__name__
+        finally:
+            job.finished_at = timezone.now().isoformat()
+            self._write(job)
+            self._release(job.kind, job)
+            # Job threads hold their own DB connections
+            connections.close_all()
+
+
+runner = JobRunner()
@@ -0,0 +1,137 @@
+"""
+Portfolio credit loss simulation
+One-factor (Vasicek) model: loan i defaults in a scenario when
+    sqrt(rho) * Z + sqrt(1 - rho) * eps_i < Phi^-1(PD_i)
+with a systematic factor Z shared by all loans. Loss given default is drawn
+from each loan's Beta posterior. Scenarios are simulated in blocks so memory
+stays bounded, and blocks run on a thread pool (NumPy releases the GIL in the
+heavy kernels) with independent random streams.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+from scipy import special
+
+# Asset correlation for unsecured microfinance retail exposures
+DEFAULT_RHO = 0.15
+DEFAULT_CONFIDENCE = (0.95, 0.99, 0.999)
+
+# Upper bound on (scenarios x loans) cells held in memory per block
+MAX_BLOCK_CELLS = 1_000_000
+
+
+def _beta_params(lgd_mean, concentration):
+    """Beta(alpha, beta) with the given means and a shared alpha + beta"""
+    mean = np.clip(lgd_mean, 1e-4, 1 - 1e-4)
+    return mean * concentration, (1 - mean) * concentration
+
+
+def asrf_var(pd, lgd_mean, ead, rho=DEFAULT_RHO, confidence=0.999):
+    """
+    Closed-form Vasicek / ASRF loss quantile: sum of EAD * LGD * PD conditional
+    on the systematic factor at its adverse quantile. Cheap enough for dashboards.
+    """
+    pd = np.clip(np.asarray(pd, dtype=float), 1e-10, 1 - 1e-10)
+    conditional_pd = special.ndtr(
+        (special.ndtri(pd) + np.sqrt(rho) * special.ndtri(confidence)) / np.sqrt(1 - rho)
+    )
+    return float(np.sum(np.asarray(ead, dtype=float) * np.asarray(lgd_mean, dtype=float) * conditional_pd))
+
+
+def _simulate_block(rng, threshold, alpha, beta, ead, group_codes, n_groups, n_scenarios, rho, loan_chunk):
+    """Losses (n_scenarios,) and per-group losses (n_scenarios, n_groups) for one block"""
+    z = rng.standard_normal(n_scenarios)
+    losses = np.zeros(n_scenarios)
+    group_losses = np.zeros(n_scenarios * n_groups)
+    shift = (np.sqrt(rho) * z)[:, None]
+    scale = np.sqrt(1 - rho)
+
+    for start in range(0, threshold.shape[0], loan_chunk):
+        stop = start + loan_chunk
+        # Default probability conditional on the systematic factor
+        p = special.ndtr((threshold[start:stop][None, :] - shift) / scale)
+        scen, loan = np.nonzero(rng.random(p.shape) < p)
+        if scen.size == 0:
+            continue
+        loan += start
+        loss = ead[loan] * rng.beta(alpha[loan], beta[loan])
+        losses += np.bincount(scen, weights=loss, minlength=n_scenarios)
+        group_losses += np.bincount(scen * n_groups + group_codes[loan], weights=loss, minlength=n_scenarios * n_groups)
+
+    return losses, group_losses.reshape(n_scenarios, n_groups)
+
+
+def simulate_portfolio_loss(pd, lgd_mean, ead, lgd_concentration: float,
+                            groups: Optional[Sequence] = None,
+                            rho: float = DEFAULT_RHO,
+                            n_scenarios: int = 10000,
+                            confidence: Sequence[float] = DEFAULT_CONFIDENCE,
+                            seed: Optional[int] = None,
+                            n_workers: Optional[int] = None,
+                            n_bins: int = 50) -> Dict:
+    """
+    Simulate the portfolio loss distribution.
+    pd, lgd_mean, ead: per-loan arrays. lgd_concentration: alpha + beta of the
+    LGD Beta posterior, shared across loans. groups: optional per-loan labels
+    (e.g. branch) for VaR/ES contributions.
+    Returns expected loss, VaR and ES per confidence level, a histogram of the
+    loss distribution and per-group expected loss and ES contributions
+    (Euler allocation: mean group loss in tail scenarios).
+    """
+    pd = np.clip(np.asarray(pd, dtype=float), 1e-10, 1 - 1e-10)
+    ead = np.asarray(ead, dtype=float)
+    alpha, beta = _beta_params(np.asarray(lgd_mean, dtype=float), lgd_concentration)
+    threshold = special.ndtri(pd)
+
+    if groups is None:
+        groups = np.zeros(pd.shape[0], dtype=np.int64)
+    labels, group_codes = np.unique(np.asarray(groups), return_inverse=True)
+    n_groups = max(len(labels), 1)
+
+    n_loans = max(pd.shape[0], 1)
+    loan_chunk = max(1, min(n_loans, MAX_BLOCK_CELLS // 256))
+    scenario_block = max(1, min(n_scenarios, MAX_BLOCK_CELLS // loan_chunk))
+    block_sizes = [min(scenario_block, n_scenarios - s) for s in range(0, n_scenarios, scenario_block)]
+
+    streams = np.random.SeedSequence(seed).spawn(len(block_sizes))
+    n_workers = n_workers or min(len(block_sizes), os.cpu_count() or 1)
+
+    def run(args):
+        stream, size = args
+        return _simulate_block(
+            np.random.default_rng(stream), threshold, alpha, beta, ead,
+            group_codes, n_groups, size, rho, loan_chunk
+        )
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        results = list(pool.map(run, zip(streams, block_sizes)))
+
+    losses = np.concatenate([r[0] for r in results]) if results else np.zeros(0)
+    group_losses = np.concatenate([r[1] for r in results]) if results else np.zeros((0, n_groups))
+
+    risk = []
+    for level in confidence:
+        var = float(np.quantile(losses, level)) if losses.size else 0.0
+        tail = losses >= var
+        es = float(losses[tail].mean()) if tail.any() else var
+        contributions = group_losses[tail].mean(axis=0) if tail.any() else np.zeros(n_groups)
+        risk.append({
+            "confidence": level,
+            "var": var,
+            "es": es,
+            "contributions": dict(zip(labels.tolist(), contributions.tolist())),
+        })
+
+    counts, edges = np.histogram(losses, bins=n_bins) if losses.size else (np.zeros(0), np.zeros(0))
+    return {
+        "n_loans": int(pd.shape[0]),
+        "n_scenarios": int(n_scenarios),
+        "rho": rho,
+        "expected_loss": float(losses.mean()) if losses.size else 0.0,
+        "analytic_expected_loss": float(np.sum(pd * ead * alpha / (alpha + beta))),
+        "risk": risk,
+        "group_expected_loss": dict(zip(labels.tolist(), group_losses.mean(axis=0).tolist())) if losses.size else {},
+        "histogram": {"counts": counts.tolist(), "edges": edges.tolist()},
+    }
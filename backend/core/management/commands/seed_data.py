@@ -8,6 +8,7 @@ from core.models import (
     Branch, LoanOfficer, Borrower, Spouse, Guarantor,
     Loan, Collateral, Repayment
 )
+from core import analytics_cache
 from core.simulator import (
     generate_borrower_data,
     generate_spouse_data,
@@ -64,6 +65,9 @@ class Command(BaseCommand):
         self.stdout.write('Creating borrowers, loans, and related data...')
         self.create_all_data(borrower_data_list, branches, loan_officers, count)
 
+        # Bulk inserts skip the save signals that invalidate cached analytics
+        analytics_cache.bump(analytics_cache.LOAN, analytics_cache.REPAYMENT)
+
         self.stdout.write(self.style.SUCCESS(f'Successfully seeded database with {count} loans!'))
         self.print_summary()
 
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_remove_businessassessment_stock_value_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupriskmetric',
+            name='defaulted_ead',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='groupriskmetric',
+            name='total_at_risk_30',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='groupriskmetric',
+            name='total_at_risk_60',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='groupriskmetric',
+            name='total_at_risk_90',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='groupriskmetric',
+            name='total_recovered',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_grouprisk_additive_measures'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['application_date', 'id'], name='loan_application_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repayment',
+            index=models.Index(fields=['scheduled_date', 'id'], name='repayment_schedule_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:13
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_sums(apps, schema_editor):
+    # Approximate until the next rebuild: every active loan in a cell counts as scored
+    GroupRiskMetric = apps.get_model('core', 'GroupRiskMetric')
+    GroupRiskMetric.objects.update(
+        pd_count=F('loan_count'), pd_sum=F('mean_pd') * F('loan_count'),
+        lgd_count=F('loan_count'), lgd_sum=F('mean_lgd') * F('loan_count'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupriskmetric',
+            name='lgd_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='groupriskmetric',
+            name='lgd_sum',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='groupriskmetric',
+            name='pd_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='groupriskmetric',
+            name='pd_sum',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=15),
+        ),
+        migrations.RunPython(backfill_sums, migrations.RunPython.noop),
+    ]
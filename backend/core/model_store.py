@@ -0,0 +1,287 @@
+"""
+Persistence for fitted Bayesian risk models.
+A bundle holds everything needed to score a loan: the feature scaler, the PD
+posterior, LGD Beta parameters, hazard parameters and version metadata.
+
+Bundles are kept in a small versioned registry under MODEL_DIR:
+
+    MODEL_DIR/
+        ACTIVE                  number of the active version
+        versions/0001/
+            metadata.json
+            pd_coef_mean.npy
+            pd_coef_cov.npy
+            pd_coef_chol.npy    precomputed Cholesky factor for sampling
+            ...
+
+Arrays are stored as plain .npy files and opened memory-mapped, so every
+worker on a box shares one page-cached copy. Activating a version (including
+rolling back) only rewrites the ACTIVE pointer. Workers poll the pointer at
+most once every MODEL_RELOAD_INTERVAL seconds and swap in a new version by
+replacing a single reference, so a request that already holds a bundle keeps
+scoring with it until it finishes.
+
+The LGD statistics of the active version are the one part that changes in
+place: recovery writes post their deltas (see update_lgd_stats), and workers
+pick the new posterior up on the same poll.
+"""
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from .bayesian_models import BayesianPDModel, BayesianLGDModel, BayesianHazardModel, BetaSufficientStats
+
+MODEL_DIR = os.path.join(settings.BASE_DIR, 'models')
+MODEL_RELOAD_INTERVAL = getattr(settings, 'MODEL_RELOAD_INTERVAL', 5.0)
+
+
+@dataclass
+class ModelBundle:
+    pd_model: BayesianPDModel = field(default_factory=BayesianPDModel)
+    lgd_model: BayesianLGDModel = field(default_factory=BayesianLGDModel)
+    hazard_model: BayesianHazardModel = field(default_factory=BayesianHazardModel)
+    feature_mean: Optional[np.ndarray] = None
+    feature_std: Optional[np.ndarray] = None
+    metadata: Dict = field(default_factory=dict)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.pd_model.coef_mean is not None
+
+    @property
+    def version(self) -> Optional[int]:
+        return self.metadata.get('version')
+
+    def design_matrix(self, X: np.ndarray) -> np.ndarray:
+        """Scale raw feature rows and prepend the intercept column"""
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        if self.feature_mean is not None:
+            X = (X - self.feature_mean) / self.feature_std
+        return np.c_[np.ones(X.shape[0]), X]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {
+            'lgd_params': np.array([self.lgd_model.alpha, self.lgd_model.beta]),
+            'lgd_stats': self.lgd_model.stats.to_array(),
+            'hazard_params': np.array([self.hazard_model.shape, self.hazard_model.scale]),
+        }
+        if self.hazard_model.param_cov is not None:
+            arrays['hazard_cov'] = self.hazard_model.param_cov
+        if self.pd_model.coef_mean is not None:
+            arrays['pd_coef_mean'] = self.pd_model.coef_mean
+            arrays['pd_coef_cov'] = self.pd_model.coef_cov
+            arrays['pd_coef_chol'] = self.pd_model.cholesky()
+        if self.feature_mean is not None:
+            arrays['feature_mean'] = self.feature_mean
+            arrays['feature_std'] = self.feature_std
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, metadata: Optional[Dict] = None) -> 'ModelBundle':
+        bundle = cls()
+        if 'pd_coef_mean' in arrays:
+            bundle.pd_model.coef_mean = arrays['pd_coef_mean']
+            bundle.pd_model.coef_cov = arrays['pd_coef_cov']
+            bundle.pd_model.coef_chol = arrays.get('pd_coef_chol')
+        if 'lgd_stats' in arrays:
+            # Solved from the statistics, which may have moved since lgd_params was read
+            bundle.lgd_model.update_stats(BetaSufficientStats.from_array(arrays['lgd_stats']))
+        else:
+            bundle.lgd_model.alpha, bundle.lgd_model.beta = (float(v) for v in arrays['lgd_params'])
+        bundle.hazard_model.shape, bundle.hazard_model.scale = (float(v) for v in arrays['hazard_params'])
+        bundle.hazard_model.param_cov = arrays.get('hazard_cov')
+        if 'feature_mean' in arrays:
+            bundle.feature_mean = arrays['feature_mean']
+            bundle.feature_std = arrays['feature_std']
+        bundle.metadata = dict(metadata or {})
+        return bundle
+
+
+class ModelRegistry:
+    """Numbered model versions on disk with an atomically updated ACTIVE pointer"""
+
+    def __init__(self, root: str = MODEL_DIR):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        self.active_path = os.path.join(root, 'ACTIVE')
+
+    def _version_dir(self, version: int) -> str:
+        return os.path.join(self.versions_dir, f"{version:04d}")
+
+    def versions(self) -> List[int]:
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(int(name) for name in os.listdir(self.versions_dir) if name.isdigit())
+
+    def active_version(self) -> Optional[int]:
+        try:
+            with open(self.active_path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def metadata(self, version: int) -> Dict:
+        with open(os.path.join(self._version_dir(version), 'metadata.json')) as f:
+            return json.load(f)
+
+    def save(self, bundle: ModelBundle, activate: bool = True) -> int:
+        """Write the bundle as the next version; the directory appears atomically"""
+        os.makedirs(self.versions_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=self.versions_dir)
+        try:
+            for name, array in bundle.to_arrays().items():
+                np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(array))
+
+            # Claim the next free number; rename fails if another writer got it first
+            version = (self.versions()[-1] if self.versions() else 0) + 1
+            while True:
+                metadata = {**bundle.metadata, 'version': version}
+                with open(os.path.join(staging, 'metadata.json'), 'w') as f:
+                    json.dump(metadata, f)
+                try:
+                    os.rename(staging, self._version_dir(version))
+                    break
+                except OSError:
+                    if not os.path.isdir(self._version_dir(version)):
+                        raise
+                    version += 1
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        bundle.metadata = metadata
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version: int) -> None:
+        if not os.path.isdir(self._version_dir(version)):
+            raise ValueError(f"Model version {version} does not exist")
+        tmp_path = f"{self.active_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(version))
+        os.replace(tmp_path, self.active_path)
+
+    def lgd_stats(self, version: int) -> np.ndarray:
+        """The version's LGD sufficient statistics as currently on disk"""
+        return np.load(os.path.join(self._version_dir(version), 'lgd_stats.npy'), allow_pickle=False)
+
+    def load_lgd_model(self, version: int) -> BayesianLGDModel:
+        """The version's LGD model alone, solved from its statistics on disk"""
+        model = BayesianLGDModel()
+        model.update_stats(BetaSufficientStats.from_array(self.lgd_stats(version)))
+        return model
+
+    def update_lgd_stats(self, version: int, delta: BetaSufficientStats) -> BayesianLGDModel:
+        """
+        Add delta to a version's LGD statistics and store the re-solved
+        posterior. Writers serialize on a lock file; each array is replaced
+        atomically, so readers see either the old or the new file.
+        """
+        path = self._version_dir(version)
+        with open(os.path.join(path, '.lgd.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            model = BayesianLGDModel()
+            model.stats = BetaSufficientStats.from_array(self.lgd_stats(version))
+            model.update_stats(delta)
+            arrays = {'lgd_params': np.array([model.alpha, model.beta]), 'lgd_stats': model.stats.to_array()}
+            for name, array in arrays.items():
+                tmp_path = os.path.join(path, f".{name}.{os.getpid()}.tmp")
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, array)
+                os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+        return model
+
+    def load(self, version: Optional[int] = None, mmap: bool = True) -> Optional[ModelBundle]:
+        """Open a version (the active one by default) with memory-mapped arrays"""
+        if version is None:
+            version = self.active_version()
+            if version is None:
+                return None
+        path = self._version_dir(version)
+        arrays = {
+            name[:-4]: np.load(os.path.join(path, name), mmap_mode='r' if mmap else None, allow_pickle=False)
+            for name in os.listdir(path) if name.endswith('.npy')
+        }
+        return ModelBundle.from_arrays(arrays, self.metadata(version))
+
+
+registry = ModelRegistry()
+
+# Per-process bundle, loaded lazily and refreshed when ACTIVE changes
+_bundle: Optional[ModelBundle] = None
+_bundle_checked_at = 0.0
+_bundle_lock = threading.Lock()
+
+
+def _set_bundle(bundle: ModelBundle) -> None:
+    global _bundle, _bundle_checked_at
+    with _bundle_lock:
+        _bundle = bundle
+        _bundle_checked_at = time.monotonic()
+
+
+def get_bundle() -> ModelBundle:
+    """
+    Return the bundle for this worker.
+    The ACTIVE pointer is re-read at most once per MODEL_RELOAD_INTERVAL; a new
+    version is fully loaded before it replaces the current reference.
+    """
+    global _bundle, _bundle_checked_at
+    bundle = _bundle
+    if bundle is not None and time.monotonic() - _bundle_checked_at < MODEL_RELOAD_INTERVAL:
+        return bundle
+
+    with _bundle_lock:
+        if _bundle is None or time.monotonic() - _bundle_checked_at >= MODEL_RELOAD_INTERVAL:
+            active = registry.active_version()
+            try:
+                if active is not None and (_bundle is None or active != _bundle.version):
+                    _bundle = registry.load(active)
+                elif active is not None and not np.array_equal(
+                    registry.lgd_stats(active), _bundle.lgd_model.stats.to_array()
+                ):
+                    # Recovery deltas moved the LGD posterior; swap in a copy with the new one
+                    _bundle = replace(_bundle, lgd_model=registry.load_lgd_model(active))
+            except (OSError, ValueError):
+                # Version vanished or is mid-cleanup; keep serving the current one
+                pass
+            if _bundle is None:
+                _bundle = ModelBundle()
+            _bundle_checked_at = time.monotonic()
+        return _bundle
+
+
+def publish_bundle(bundle: ModelBundle) -> int:
+    """Register a newly trained bundle as the active version for this worker"""
+    version = registry.save(bundle)
+    _set_bundle(bundle)
+    return version
+
+
+def apply_lgd_delta(delta: BetaSufficientStats) -> None:
+    """Post an LGD statistics delta to the active version, if there is one"""
+    version = registry.active_version()
+    if version is None:
+        return
+    lgd_model = registry.update_lgd_stats(version, delta)
+    bundle = get_bundle()
+    if bundle.version == version:
+        _set_bundle(replace(bundle, lgd_model=lgd_model))
+
+
+def activate_version(version: int) -> ModelBundle:
+    """Point ACTIVE at an existing version (e.g. rollback) and switch this worker to it"""
+    registry.activate(version)
+    bundle = registry.load(version)
+    _set_bundle(bundle)
+    return bundle
@@ -8,21 +8,48 @@ from rest_framework.views import APIView
 import numpy as np
 import pandas as pd
 from django.db.models import F
-import pickle
-import os
-from django.conf import settings
+from dataclasses import asdict
 
 from .models import Loan, LoanRiskMetric
 from .serializers import LoanRiskMetricSerializer
-from .bayesian_models import BayesianPDModel, BayesianLGDModel, BayesianHazardModel
+from .model_store import registry, get_bundle, activate_version
+from .training import train_models
+from .features import FEATURE_FIELDS, loan_feature_matrix
+from .jobs import runner
+from .scoring import loan_ages, hazard_term_structure, write_hazard_rates, parse_since, rescore_job
+from .loss_simulation import simulate_portfolio_loss, DEFAULT_RHO, DEFAULT_CONFIDENCE
 
-# Global model instances (in a real app, these would be loaded from storage)
-pd_model = BayesianPDModel()
-lgd_model = BayesianLGDModel()
-hazard_model = BayesianHazardModel()
+# Upper bound on rows scored by a single batch request
+MAX_BATCH_ROWS = 100000
+
+# Posterior predictive modes accepted by the predict endpoints
+PREDICT_METHODS = ('sampling', 'probit')
+
+# Upper bound on scenarios in a single loss simulation request
+MAX_SCENARIOS = 100000
+
+# Loan fields accepted in a request's filters
+LOAN_FILTERS = ('branch', 'loan_type', 'status')
+
+
+def _select_loans(loans, loan_ids=None, filters=None):
+    """
+    Narrow a loan queryset by a request's loan_ids and filters.
+    Returns (queryset, error); error is a message for a 400 when the input is invalid.
+    """
+    if loan_ids is not None:
+        if not isinstance(loan_ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in loan_ids):
+            return None, "loan_ids must be a list of integers"
+        loans = loans.filter(id__in=loan_ids)
+    if filters is not None:
+        if not isinstance(filters, dict):
+            return None, f"filters must be an object with any of {list(LOAN_FILTERS)}"
+        try:
+            loans = loans.filter(**{k: v for k, v in filters.items() if k in LOAN_FILTERS})
+        except (TypeError, ValueError):
+            return None, "Invalid filter value"
+    return loans, None
 
-MODEL_DIR = os.path.join(settings.BASE_DIR, 'models')
-os.makedirs(MODEL_DIR, exist_ok=True)
 
 class RiskModelView(viewsets.ViewSet):
     """
@@ -32,72 +59,28 @@ class RiskModelView(viewsets.ViewSet):
     @action(detail=False, methods=['post'])
     def train(self, request):
         """
-        Train models on current historical data
+        Queue a training run on current historical data.
+        Returns 202 with the job; if a run is already queued or running,
+        that job is returned instead of starting another.
         """
-        # 1. Prepare Data for PD Model
-        # Target: Defaulted (1) vs Paid Off/Active (0)
-        # Features: Loan Amount, Interest Rate, Tenure, Borrower Income
-        
-        loans = Loan.objects.exclude(status='PENDING').select_related('borrower')
-        
-        if not loans.exists():
+        if not Loan.objects.exclude(status='PENDING').exists():
             return Response({"error": "No data to train on"}, status=status.HTTP_400_BAD_REQUEST)
-            
-        data = []
-        targets = []
-        
-        for loan in loans:
-            # Define Default: Status is DEFAULTED or WRITTEN_OFF
-            is_default = 1 if loan.status in ['DEFAULTED', 'WRITTEN_OFF'] else 0
-            
-            # Features
-            features = [
-                float(loan.principal_amount),
-                float(loan.monthly_interest_rate),
-                float(loan.tenure_months),
-                float(loan.borrower.monthly_income)
-            ]
-            
-            data.append(features)
-            targets.append(is_default)
-            
-        X = np.array(data)
-        y = np.array(targets)
-        
-        # Normalize features (simple scaling)
-        self.mean = np.mean(X, axis=0)
-        self.std = np.std(X, axis=0) + 1e-8
-        X_scaled = (X - self.mean) / self.std
-        
-        # Add intercept
-        X_final = np.c_[np.ones(X_scaled.shape[0]), X_scaled]
-        
-        # Train PD Model
-        pd_model.fit(X_final, y)
-        
-        # Train LGD Model (simplified)
-        # Get recovery rates for defaulted loans
-        defaulted_loans = Loan.objects.filter(status__in=['DEFAULTED', 'WRITTEN_OFF'])
-        observed_lgds = []
-        for loan in defaulted_loans:
-            # LGD = 1 - (Recoveries / EAD)
-            recoveries = sum(r.recovery_amount for r in loan.recoveries.all())
-            ead = loan.principal_amount # Simplified EAD
-            recovery_rate = float(recoveries / ead) if ead > 0 else 0
-            lgd = max(0.0, min(1.0, 1.0 - recovery_rate))
-            observed_lgds.append(lgd)
-            
-        lgd_model.update(np.array(observed_lgds))
-        
-        # Save models (simplified)
-        self._save_models()
-        
-        return Response({
-            "message": "Models trained successfully",
-            "pd_coef_mean": pd_model.coef_mean.tolist() if pd_model.coef_mean is not None else [],
-            "lgd_params": {"alpha": lgd_model.alpha, "beta": lgd_model.beta},
-            "training_samples": len(data)
-        })
+
+        job, created = runner.submit('train', train_models)
+        return Response(
+            {**asdict(job), "deduplicated": not created},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=False, methods=['get'], url_path=r'jobs/(?P<job_id>[0-9a-f]+)')
+    def job(self, request, job_id=None):
+        """
+        Poll the status and progress of a background training job
+        """
+        job = runner.get(job_id)
+        if job is None:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(asdict(job))
 
     @action(detail=False, methods=['post'])
     def predict(self, request):
@@ -105,6 +88,9 @@ class RiskModelView(viewsets.ViewSet):
         Predict risk metrics for a specific loan (or hypothetical)
         """
         loan_id = request.data.get('loan_id')
+        method = request.data.get('method', 'sampling')
+        if method not in PREDICT_METHODS:
+            return Response({"error": f"method must be one of {list(PREDICT_METHODS)}"}, status=status.HTTP_400_BAD_REQUEST)
         
         if loan_id:
             try:
@@ -123,21 +109,16 @@ class RiskModelView(viewsets.ViewSet):
             if not features or len(features) != 4:
                 return Response({"error": "Provide loan_id or features [amount, rate, tenure, income]"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Preprocess
-        # Note: In production, load saved scalers
-        if not hasattr(self, 'mean'):
-            # Fallback if not trained
-            X_scaled = np.array(features).reshape(1, -1)
-            X_final = np.c_[np.ones(1), X_scaled]
-        else:
-            X_scaled = (np.array(features) - self.mean) / self.std
-            X_final = np.c_[np.ones(1), X_scaled.reshape(1, -1)]
+        bundle = get_bundle()
+        
+        # Preprocess with the persisted scaler
+        X_final = bundle.design_matrix(features)
             
         # Predict PD
-        pd_result = pd_model.predict_proba(X_final)
+        pd_result = bundle.pd_model.predict_proba(X_final, method=method)
         
         # Predict LGD (Global model for now, could be conditional)
-        lgd_result = lgd_model.predict()
+        lgd_result = bundle.lgd_model.predict()
         
         # Calculate Expected Loss
         # EL = PD * LGD * EAD
@@ -159,10 +140,208 @@ class RiskModelView(viewsets.ViewSet):
             "ead": ead
         })
 
-    def _save_models(self):
-        # Save to pickle
-        with open(os.path.join(MODEL_DIR, 'pd_model.pkl'), 'wb') as f:
-            pickle.dump(pd_model, f)
-        with open(os.path.join(MODEL_DIR, 'lgd_model.pkl'), 'wb') as f:
-            pickle.dump(lgd_model, f)
-        # Save scalers too in real app
+    @action(detail=False, methods=['post'])
+    def predict_batch(self, request):
+        """
+        Score many loans in one vectorized pass.
+        Accepts one of:
+          - features: [[amount, rate, tenure, income], ...]
+          - loan_ids: [1, 2, ...]
+          - filters: {"branch": 1, "loan_type": "BUSINESS", "status": "ACTIVE"}
+        Optional method: "sampling" (default) or "probit" for the closed form.
+        """
+        features = request.data.get('features')
+        loan_ids = request.data.get('loan_ids')
+        filters = request.data.get('filters')
+        method = request.data.get('method', 'sampling')
+        if method not in PREDICT_METHODS:
+            return Response({"error": f"method must be one of {list(PREDICT_METHODS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if features is not None:
+            try:
+                X = np.array(features, dtype=float)
+            except (TypeError, ValueError):
+                X = None
+            if X is None or X.ndim != 2 or X.shape[1] != len(FEATURE_FIELDS) or not np.isfinite(X).all():
+                return Response({"error": "features must be a list of [amount, rate, tenure, income] rows"}, status=status.HTTP_400_BAD_REQUEST)
+            ids = None
+        elif loan_ids is not None or filters is not None:
+            loans, error = _select_loans(Loan.objects.all(), loan_ids, filters)
+            if error:
+                return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+            ids, X = loan_feature_matrix(loans.order_by('id'))
+        else:
+            return Response({"error": "Provide features, loan_ids or filters"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if X.shape[0] > MAX_BATCH_ROWS:
+            return Response({"error": f"Batch limited to {MAX_BATCH_ROWS} rows"}, status=status.HTTP_400_BAD_REQUEST)
+
+        bundle = get_bundle()
+        pd_result = bundle.pd_model.predict_proba_batch(bundle.design_matrix(X), method=method)
+        lgd_result = bundle.lgd_model.predict()
+
+        ead = X[:, 0]
+        el = pd_result.mean * lgd_result.mean * ead
+
+        return Response({
+            "count": int(X.shape[0]),
+            "loan_ids": ids.tolist() if ids is not None else None,
+            "pd": {
+                "mean": pd_result.mean.tolist(),
+                "lower_hdi": pd_result.lower_hdi.tolist(),
+                "upper_hdi": pd_result.upper_hdi.tolist()
+            },
+            "lgd": {
+                "mean": lgd_result.mean,
+                "lower_hdi": lgd_result.lower_hdi,
+                "upper_hdi": lgd_result.upper_hdi
+            },
+            "expected_loss": el.tolist(),
+            "ead": ead.tolist()
+        })
+
+    @action(detail=False, methods=['post'])
+    def survival_curves(self, request):
+        """
+        Survival and cumulative default curves for many loans, month by month to maturity,
+        with 95% HDIs. Accepts loan_ids or filters like predict_batch, optional
+        horizons (months from today) and persist=true to store each loan's
+        current hazard rate on its LoanRiskMetric. The curves themselves are
+        recomputed per request (one array operation) rather than stored.
+        """
+        loan_ids = request.data.get('loan_ids')
+        filters = request.data.get('filters')
+        horizons = request.data.get('horizons')
+        if horizons is not None:
+            try:
+                horizons = np.array(horizons, dtype=float)
+            except (TypeError, ValueError):
+                horizons = None
+            if horizons is None or horizons.ndim != 1 or not np.isfinite(horizons).all() or (horizons <= 0).any():
+                return Response({"error": "horizons must be a list of positive month counts"}, status=status.HTTP_400_BAD_REQUEST)
+
+        loans = Loan.objects.filter(status='ACTIVE') if loan_ids is None and not filters else Loan.objects.all()
+        loans, error = _select_loans(loans, loan_ids, filters)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids, ages, remaining = loan_ages(loans)
+        if ids.shape[0] > MAX_BATCH_ROWS:
+            return Response({"error": f"Batch limited to {MAX_BATCH_ROWS} rows"}, status=status.HTTP_400_BAD_REQUEST)
+
+        bundle = get_bundle()
+        curves = hazard_term_structure(bundle.hazard_model, ages, remaining, horizons)
+
+        updated = None
+        if request.data.get('persist'):
+            updated = write_hazard_rates(ids, curves['hazard_rate'])
+
+        # NaN marks horizons past a loan's maturity (and HDIs the model cannot give)
+        as_list = lambda a: np.where(np.isnan(a), None, np.round(a, 6)).tolist()
+        return Response({
+            "count": int(ids.shape[0]),
+            "loan_ids": ids.tolist(),
+            "horizons": curves['horizons'].tolist(),
+            "survival": as_list(curves['survival']),
+            "survival_lower_hdi": as_list(curves['survival_lower_hdi']),
+            "survival_upper_hdi": as_list(curves['survival_upper_hdi']),
+            "cumulative_pd": as_list(curves['cumulative_pd']),
+            "cumulative_pd_lower_hdi": as_list(curves['cumulative_pd_lower_hdi']),
+            "cumulative_pd_upper_hdi": as_list(curves['cumulative_pd_upper_hdi']),
+            "hazard_rate": np.round(curves['hazard_rate'], 6).tolist(),
+            "hazard_rate_lower_hdi": as_list(curves['hazard_rate_lower_hdi']),
+            "hazard_rate_upper_hdi": as_list(curves['hazard_rate_upper_hdi']),
+            "metrics_updated": updated
+        })
+
+    @action(detail=False, methods=['post'])
+    def rescore(self, request):
+        """
+        Queue a portfolio rescore that upserts LoanRiskMetric for active loans.
+        Optional since ("last" or an ISO date/datetime) and method.
+        Poll progress at /models/jobs/<id>/.
+        """
+        since = request.data.get('since')
+        method = request.data.get('method', 'probit')
+        if method not in PREDICT_METHODS:
+            return Response({"error": f"method must be one of {list(PREDICT_METHODS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            parse_since(since)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        job, created = runner.submit('rescore', rescore_job, since, method)
+        return Response(
+            {**asdict(job), "deduplicated": not created},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=False, methods=['post'])
+    def loss_distribution(self, request):
+        """
+        Simulate the portfolio loss distribution from stored LoanRiskMetric values
+        with a one-factor correlated default model.
+        Accepts filters like predict_batch (active loans by default), n_scenarios,
+        rho (asset correlation), confidence (list of levels) and seed.
+        Returns VaR/ES per confidence level with per-branch contributions.
+        """
+        filters = request.data.get('filters')
+        try:
+            n_scenarios = int(request.data.get('n_scenarios', 10000))
+            rho = float(request.data.get('rho', DEFAULT_RHO))
+            confidence = [float(c) for c in request.data.get('confidence', DEFAULT_CONFIDENCE)]
+            seed = request.data.get('seed')
+            seed = int(seed) if seed is not None else None
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid simulation parameters"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < n_scenarios <= MAX_SCENARIOS:
+            return Response({"error": f"n_scenarios must be between 1 and {MAX_SCENARIOS}"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= rho < 1 or not all(0 < c < 1 for c in confidence):
+            return Response({"error": "rho must be in [0, 1) and confidence levels in (0, 1)"}, status=status.HTTP_400_BAD_REQUEST)
+
+        loans = Loan.objects.filter(status='ACTIVE') if not filters else Loan.objects.all()
+        loans, error = _select_loans(loans, filters=filters)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = list(LoanRiskMetric.objects.filter(loan__in=loans).values_list(
+            'pd_mean', 'lgd_mean', 'ead', 'loan__branch__name'
+        ))
+        columns = list(zip(*rows)) if rows else [()] * 4
+
+        bundle = get_bundle()
+        result = simulate_portfolio_loss(
+            np.array(columns[0], dtype=float),
+            np.array(columns[1], dtype=float),
+            np.array(columns[2], dtype=float),
+            lgd_concentration=bundle.lgd_model.alpha + bundle.lgd_model.beta,
+            groups=np.array(columns[3], dtype=object),
+            rho=rho,
+            n_scenarios=n_scenarios,
+            confidence=confidence,
+            seed=seed
+        )
+        return Response(result)
+
+    @action(detail=False, methods=['get'])
+    def versions(self, request):
+        """
+        List registered model versions and the active one
+        """
+        return Response({
+            "active": registry.active_version(),
+            "loaded": get_bundle().version,
+            "versions": [registry.metadata(version) for version in registry.versions()]
+        })
+
+    @action(detail=False, methods=['post'])
+    def activate(self, request):
+        """
+        Make an existing model version active (e.g. rollback)
+        """
+        try:
+            version = int(request.data.get('version'))
+            bundle = activate_version(version)
+        except (TypeError, ValueError):
+            return Response({"error": "Provide an existing model version"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"active": version, "metadata": bundle.metadata})
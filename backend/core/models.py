@@ -217,6 +217,10 @@ class Loan(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        # Keyset pagination key (see core/pagination.py)
+        indexes = [models.Index(fields=['application_date', 'id'], name='loan_application_keyset_idx')]
+    
     def save(self, *args, **kwargs):
         # Auto-set interest rate based on loan type
         if not self.monthly_interest_rate or self.monthly_interest_rate == 0:
@@ -321,6 +325,8 @@ class Repayment(models.Model):
     class Meta:
         ordering = ['loan', 'installment_number']
         unique_together = ['loan', 'installment_number']
+        # Keyset pagination key (see core/pagination.py)
+        indexes = [models.Index(fields=['scheduled_date', 'id'], name='repayment_schedule_keyset_idx')]
     
     def __str__(self):
         return f"{self.loan.loan_number} - Installment {self.installment_number}"
@@ -379,9 +385,13 @@ class GroupRiskMetric(models.Model):
     
     # Aggregated PD
     mean_pd = models.DecimalField(max_digits=5, decimal_places=4, validators=[MinValueValidator(Decimal('0')), MaxValueValidator(Decimal('1'))])
+    pd_sum = models.DecimalField(max_digits=15, decimal_places=4, default=0)
+    pd_count = models.IntegerField(default=0)
     
     # Aggregated LGD
     mean_lgd = models.DecimalField(max_digits=5, decimal_places=4, validators=[MinValueValidator(Decimal('0')), MaxValueValidator(Decimal('1'))])
+    lgd_sum = models.DecimalField(max_digits=15, decimal_places=4, default=0)
+    lgd_count = models.IntegerField(default=0)
     
     # Aggregated EAD
     total_ead = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(Decimal('0'))])
@@ -394,8 +404,15 @@ class GroupRiskMetric(models.Model):
     par60_rate = models.DecimalField(max_digits=5, decimal_places=4, default=0)
     par90_rate = models.DecimalField(max_digits=5, decimal_places=4, default=0)
     
+    # Outstanding principal behind each PAR rate
+    total_at_risk_30 = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    total_at_risk_60 = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    total_at_risk_90 = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    
     # Recovery Rate
     recovery_rate = models.DecimalField(max_digits=5, decimal_places=4, default=0)
+    defaulted_ead = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    total_recovered = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     
     # Sample size
     loan_count = models.IntegerField(default=0)
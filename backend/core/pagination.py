@@ -0,0 +1,173 @@
+"""
+Pagination for high-volume tables
+Page-number pagination runs a COUNT(*) and an OFFSET scan per page, so deep
+pages get linearly slower. KeysetPagination keeps the page-number interface
+and adds:
+- ?cursor= switches to keyset pagination: each page is a range scan starting
+  after the last key of the previous page (WHERE key > last ORDER BY key
+  LIMIT n), so page 10,000 costs the same as page 1. Start with an empty
+  cursor and follow the next/previous links.
+- ?count=false skips the COUNT(*) in either mode ("count" is then null).
+Views declare their keyset orderings as keyset_orderings; ?ordering= picks
+one by name, with a leading "-" for descending. Every ordering must end in a
+unique, non-null key so positions are unambiguous.
+"""
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+FALSE_VALUES = ('false', '0', 'no', 'off')
+
+
+def keyset_filter(ordering, values):
+    """
+    Rows strictly after values in ordering (lexicographic on the key tuple).
+    The leading >= on the first field lets the database seek on its index.
+    """
+    clauses = []
+    for i, field in enumerate(ordering):
+        equal = {name.lstrip('-'): value for name, value in zip(ordering[:i], values[:i])}
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clauses.append(Q(**equal, **{f"{field.lstrip('-')}__{lookup}": values[i]}))
+    first = ordering[0]
+    seek = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+    return seek & reduce(or_, clauses)
+
+
+def _flip(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+class KeysetPagination(PageNumberPagination):
+    """Page-number pagination with keyset (?cursor=) and uncounted (?count=false) modes"""
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering_query_param = api_settings.ORDERING_PARAM
+    invalid_cursor_message = 'Invalid cursor.'
+
+    # Used when the view declares no keyset_orderings
+    default_keyset_orderings = {'id': ('id',)}
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.with_count = request.query_params.get(self.count_query_param, 'true').lower() not in FALSE_VALUES
+        self.keyset = self.cursor_query_param in request.query_params
+        if self.keyset:
+            return self.paginate_keyset(queryset, request, view)
+        if self.with_count:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_uncounted(queryset, request)
+
+    def get_paginated_response(self, data):
+        if not self.keyset and self.with_count:
+            return super().get_paginated_response(data)
+        return Response({
+            'count': self.count,
+            'next': self.next_link,
+            'previous': self.previous_link,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response = super().get_paginated_response_schema(schema)
+        response['required'] = ['results']
+        response['properties']['count']['nullable'] = True
+        return response
+
+    def paginate_uncounted(self, queryset, request):
+        """Page-number mode without COUNT(*): one extra row tells whether a next page exists"""
+        page_size = self.get_page_size(request)
+        try:
+            number = int(request.query_params.get(self.page_query_param) or 1)
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if number < 1:
+            raise NotFound(self.invalid_page_message)
+
+        offset = (number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        if number > 1 and not rows:
+            raise NotFound(self.invalid_page_message)
+
+        url = request.build_absolute_uri()
+        self.count = None
+        self.next_link = replace_query_param(url, self.page_query_param, number + 1) if len(rows) > page_size else None
+        if number == 1:
+            self.previous_link = None
+        elif number == 2:
+            self.previous_link = remove_query_param(url, self.page_query_param)
+        else:
+            self.previous_link = replace_query_param(url, self.page_query_param, number - 1)
+        return rows[:page_size]
+
+    def paginate_keyset(self, queryset, request, view):
+        """Keyset mode: seek past the cursor's key and read one page plus one row"""
+        page_size = self.get_page_size(request)
+        ordering = self.get_keyset_ordering(request, view)
+        token = request.query_params.get(self.cursor_query_param)
+        values, reverse = self.decode_cursor(token, queryset.model, ordering) if token else (None, False)
+
+        self.count = queryset.count() if self.with_count else None
+
+        order = _flip(ordering) if reverse else ordering
+        queryset = queryset.order_by(*order)
+        if values is not None:
+            queryset = queryset.filter(keyset_filter(order, values))
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        # Coming from a cursor means there is a page on the side we came from
+        has_next = True if reverse else has_more
+        has_previous = has_more if reverse else values is not None
+        self.next_link = self.cursor_link(rows[-1], ordering, reverse=False) if has_next and rows else None
+        self.previous_link = self.cursor_link(rows[0], ordering, reverse=True) if has_previous and rows else None
+        return rows
+
+    def get_keyset_ordering(self, request, view):
+        orderings = getattr(view, 'keyset_orderings', None) or self.default_keyset_orderings
+        param = request.query_params.get(self.ordering_query_param)
+        if not param:
+            return next(iter(orderings.values()))
+        name = param.lstrip('-')
+        if name not in orderings:
+            raise ValidationError({
+                "error": f"With cursor pagination, {self.ordering_query_param} must be one of "
+                         f"{sorted(orderings)}, optionally prefixed with '-'"
+            })
+        return _flip(orderings[name]) if param.startswith('-') else orderings[name]
+
+    def cursor_link(self, row, ordering, reverse):
+        values = [getattr(row, field.lstrip('-')) for field in ordering]
+        payload = json.dumps({'k': values, 'r': reverse}, default=str, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, token, model, ordering):
+        """Return (key values, reverse) from a cursor token, converted by each model field"""
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            raw, reverse = payload['k'], bool(payload['r'])
+            if len(raw) != len(ordering):
+                raise ValueError
+            values = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(ordering, raw)
+            ]
+        except (binascii.Error, ValueError, TypeError, KeyError, DjangoValidationError) as exc:
+            raise NotFound(self.invalid_cursor_message) from exc
+        return values, reverse
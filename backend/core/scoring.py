@@ -0,0 +1,213 @@
+"""
+Portfolio scoring with the active model bundle
+Evaluates whole loan books as array operations and writes the results to
+LoanRiskMetric in bulk.
+"""
+import time
+from itertools import islice
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import analytics_cache
+from .analytics import outstanding_subqueries
+from .models import Loan, LoanRiskMetric
+from .features import FEATURE_FIELDS, DAYS_PER_MONTH
+
+WRITE_BATCH_SIZE = 1000
+RESCORE_CHUNK_SIZE = 5000
+
+# LoanRiskMetric columns rewritten on every rescore
+METRIC_FIELDS = [
+    'pd_mean', 'pd_lower_hdi', 'pd_upper_hdi',
+    'lgd_mean', 'lgd_lower_hdi', 'lgd_upper_hdi',
+    'ead', 'expected_loss', 'hazard_rate', 'calculated_at',
+]
+
+
+def loan_ages(queryset, as_of=None):
+    """
+    Return (loan_ids, age_months, remaining_months) for disbursed loans.
+    Age is time on book at as_of; remaining is tenure minus age, floored at 0.
+    """
+    as_of = np.datetime64(as_of or timezone.now().date(), 'D')
+    rows = list(queryset.filter(disbursement_date__isnull=False).order_by('id').values_list(
+        'id', 'disbursement_date', 'tenure_months'
+    ))
+    columns = list(zip(*rows)) if rows else [()] * 3
+    start = np.array(columns[1], dtype='datetime64[D]')
+    ages = np.maximum((as_of - start).astype(float) / DAYS_PER_MONTH, 0.0)
+    remaining = np.maximum(np.array(columns[2], dtype=float) - ages, 0.0)
+    return np.array(columns[0], dtype=np.int64), ages, remaining
+
+
+def hazard_term_structure(hazard_model, ages, remaining, horizons=None, hdi_prob=0.95):
+    """
+    Survival and default term structure for many loans in one array operation.
+    horizons defaults to each month up to the longest remaining term; cells
+    beyond a loan's own maturity are NaN.
+    Returns a dict with horizons, survival and cumulative_pd (n_loans x n_horizons),
+    hazard_rate at each loan's current age, and the lower/upper HDI bounds of
+    each as <name>_lower_hdi / <name>_upper_hdi.
+    """
+    if horizons is None:
+        max_remaining = int(np.ceil(remaining.max())) if remaining.size else 0
+        horizons = np.arange(1, max(max_remaining, 1) + 1)
+    horizons = np.asarray(horizons, dtype=float)
+
+    survival = hazard_model.conditional_survival_batch(ages, horizons, hdi_prob)
+    within_term = horizons[None, :] <= np.ceil(remaining)[:, None]
+    mean, lower, upper = (np.where(within_term, a, np.nan) for a in (survival.mean, survival.lower_hdi, survival.upper_hdi))
+    hazard = hazard_model.hazard_rate_batch(ages, hdi_prob)
+
+    return {
+        'horizons': horizons,
+        'survival': mean,
+        'survival_lower_hdi': lower,
+        'survival_upper_hdi': upper,
+        'cumulative_pd': 1.0 - mean,
+        'cumulative_pd_lower_hdi': 1.0 - upper,
+        'cumulative_pd_upper_hdi': 1.0 - lower,
+        'hazard_rate': hazard.mean,
+        'hazard_rate_lower_hdi': hazard.lower_hdi,
+        'hazard_rate_upper_hdi': hazard.upper_hdi,
+    }
+
+
+def write_hazard_rates(loan_ids, hazard_rates, batch_size=WRITE_BATCH_SIZE):
+    """
+    Bulk-update LoanRiskMetric.hazard_rate for loans that already have a metric row.
+    Returns the number of rows updated.
+    """
+    # hazard_rate is DecimalField(max_digits=8, decimal_places=6)
+    rates = dict(zip(loan_ids.tolist(), np.round(np.clip(hazard_rates, 0.0, 99.999999), 6).tolist()))
+    updated = 0
+    with transaction.atomic():
+        for start in range(0, len(loan_ids), batch_size):
+            chunk = loan_ids[start:start + batch_size].tolist()
+            metrics = list(LoanRiskMetric.objects.filter(loan_id__in=chunk).only('id', 'loan_id'))
+            for metric in metrics:
+                metric.hazard_rate = rates[metric.loan_id]
+            updated += LoanRiskMetric.objects.bulk_update(metrics, ['hazard_rate'])
+    analytics_cache.bump(analytics_cache.RISK_METRIC)
+    return updated
+
+
+def last_rescore_time():
+    """Timestamp of the most recently written LoanRiskMetric, or None"""
+    return LoanRiskMetric.objects.aggregate(Max('calculated_at'))['calculated_at__max']
+
+
+def parse_since(value):
+    """
+    Parse a --since / since value: "last" (the previous rescore), an ISO
+    datetime or an ISO date (midnight). Returns an aware datetime or None.
+    """
+    if value in (None, ''):
+        return None
+    if value == 'last':
+        return last_rescore_time()
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid since value: {value!r}")
+        parsed = timezone.datetime.combine(day, timezone.datetime.min.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _no_progress(progress, message):
+    pass
+
+
+def rescore_portfolio(bundle, queryset=None, since=None, chunk_size=RESCORE_CHUNK_SIZE,
+                      method='probit', report=_no_progress):
+    """
+    Score loans (active ones by default) chunk by chunk and upsert LoanRiskMetric.
+    Each chunk is one values_list fetch, one vectorized PD/LGD/hazard pass and
+    one bulk upsert. since limits the run to loans updated after that time.
+    EAD is the loan's outstanding principal.
+    Returns a summary with the row count and throughput.
+    """
+    if queryset is None:
+        queryset = Loan.objects.filter(status='ACTIVE')
+    if since is not None:
+        queryset = queryset.filter(updated_at__gt=since)
+    queryset = queryset.order_by('id')
+
+    started = time.perf_counter()
+    total = queryset.count()
+    as_of = np.datetime64(timezone.now().date(), 'D')
+
+    # LGD is a single portfolio-level Beta posterior for now
+    lgd = bundle.lgd_model.predict()
+
+    rows = queryset.annotate(**outstanding_subqueries()).values_list(
+        'id', *FEATURE_FIELDS, 'loan_outstanding', 'disbursement_date'
+    ).iterator(chunk_size=chunk_size)
+    scored = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        columns = list(zip(*chunk))
+        loan_ids = np.array(columns[0], dtype=np.int64)
+        X = np.array(columns[1:1 + len(FEATURE_FIELDS)], dtype=float).T
+
+        pd_result = bundle.pd_model.predict_proba_batch(bundle.design_matrix(X), method=method)
+        ead = np.array(columns[-2], dtype=float)
+        expected_loss = pd_result.mean * lgd.mean * ead
+
+        start = np.array(columns[-1], dtype='datetime64[D]')
+        ages = np.maximum((as_of - start).astype(float) / DAYS_PER_MONTH, 0.0)
+        hazard = np.where(np.isnat(start), np.nan, bundle.hazard_model.hazard_rate(ages))
+        hazard = np.round(np.clip(hazard, 0.0, 99.999999), 6)
+
+        pd_cols = [np.round(np.clip(a, 0.0, 1.0), 4) for a in (pd_result.mean, pd_result.lower_hdi, pd_result.upper_hdi)]
+        lgd_cols = [round(min(max(v, 0.0), 1.0), 4) for v in (lgd.mean, lgd.lower_hdi, lgd.upper_hdi)]
+        metrics = [
+            LoanRiskMetric(
+                loan_id=loan_id,
+                pd_mean=pd_mean, pd_lower_hdi=pd_lower, pd_upper_hdi=pd_upper,
+                lgd_mean=lgd_cols[0], lgd_lower_hdi=lgd_cols[1], lgd_upper_hdi=lgd_cols[2],
+                ead=round(ead_i, 2),
+                expected_loss=round(el, 2),
+                hazard_rate=None if np.isnan(h) else h
+            )
+            for loan_id, pd_mean, pd_lower, pd_upper, ead_i, el, h in zip(
+                loan_ids.tolist(), *(c.tolist() for c in pd_cols), ead.tolist(), expected_loss.tolist(), hazard.tolist()
+            )
+        ]
+        with transaction.atomic():
+            LoanRiskMetric.objects.bulk_create(
+                metrics,
+                batch_size=WRITE_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['loan'],
+                update_fields=METRIC_FIELDS
+            )
+
+        analytics_cache.bump(analytics_cache.RISK_METRIC)
+
+        scored += len(metrics)
+        report(scored / total if total else 1.0, f"Scored {scored} of {total} loans")
+
+    seconds = time.perf_counter() - started
+    return {
+        "rows": scored,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(scored / seconds, 1) if seconds > 0 else None,
+        "model_version": bundle.version,
+        "method": method,
+    }
+
+
+def rescore_job(report, since=None, method='probit'):
+    """Background job entry point: rescore with this worker's active bundle"""
+    from .model_store import get_bundle
+    return rescore_portfolio(get_bundle(), since=parse_since(since), method=method, report=report)
@@ -41,28 +41,28 @@ class GuarantorSerializer(serializers.ModelSerializer):
 class BorrowerSerializer(serializers.ModelSerializer):
     spouse = SpouseSerializer(read_only=True)
     guarantors = GuarantorSerializer(many=True, read_only=True)
-    loan_count = serializers.SerializerMethodField()
+    # Annotated by BorrowerViewSet (see analytics.borrower_annotations)
+    loan_count = serializers.IntegerField(read_only=True)
+    outstanding_exposure = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    last_loan_status = serializers.CharField(read_only=True, allow_null=True)
     
     class Meta:
         model = Borrower
         fields = '__all__'
-    
-    def get_loan_count(self, obj):
-        return obj.loans.count()
 
 
 class BorrowerListSerializer(serializers.ModelSerializer):
     """Lighter serializer for list views"""
-    loan_count = serializers.SerializerMethodField()
+    loan_count = serializers.IntegerField(read_only=True)
+    outstanding_exposure = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    last_loan_status = serializers.CharField(read_only=True, allow_null=True)
     
     class Meta:
         model = Borrower
         fields = ['id', 'first_name', 'last_name', 'national_id', 'district', 
                   'traditional_authority', 'business_industry', 'monthly_income', 
-                  'gender', 'date_of_birth', 'loan_count']
-    
-    def get_loan_count(self, obj):
-        return obj.loans.count()
+                  'gender', 'date_of_birth', 'loan_count', 'outstanding_exposure',
+                  'last_loan_status']
 
 
 class CollateralSerializer(serializers.ModelSerializer):
@@ -115,14 +115,24 @@ class LoanListSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Loan
-        fields = ['id', 'loan_number', 'borrower_name', 'branch_name', 'loan_type', 
+        fields = ['id', 'loan_number', 'borrower', 'borrower_name', 'branch', 'branch_name', 'loan_type', 
                   'principal_amount', 'monthly_interest_rate', 'tenure_months', 
-                  'disbursement_date', 'status']
+                  'application_date', 'disbursement_date', 'status']
     
     def get_borrower_name(self, obj):
         return f"{obj.borrower.first_name} {obj.borrower.last_name}"
 
 
+class BorrowerLoanHistorySerializer(LoanListSerializer):
+    """Loan list row with per-loan repayment behavior (see analytics.loan_behavior_annotations)"""
+    installments_due = serializers.IntegerField(read_only=True)
+    installments_on_time = serializers.IntegerField(read_only=True)
+    max_days_late = serializers.IntegerField(read_only=True)
+    
+    class Meta(LoanListSerializer.Meta):
+        fields = LoanListSerializer.Meta.fields + ['maturity_date', 'installments_due', 'installments_on_time', 'max_days_late']
+
+
 class GroupRiskMetricSerializer(serializers.ModelSerializer):
     branch_name = serializers.CharField(source='branch.get_name_display', read_only=True)
     loan_type_display = serializers.CharField(source='get_loan_type_display', read_only=True)
@@ -224,6 +234,26 @@ class GuarantorCollateralSerializer(serializers.ModelSerializer):
         model = GuarantorCollateral
         fields = '__all__'
 
+class ClientScreeningSummarySerializer(serializers.ModelSerializer):
+    """Screening header fields, without the nested assessments"""
+    class Meta:
+        model = ClientScreening
+        fields = ['id', 'borrower', 'screening_date', 'status', 'requested_amount',
+                  'recommended_loan_amount', 'client_risk_score', 'cluster_group', 'past_defaults']
+
+
+class GuaranteeLinkSerializer(serializers.ModelSerializer):
+    """A Guarantor row seen from the guarantor's side: whom they back"""
+    borrower_name = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Guarantor
+        fields = ['id', 'borrower', 'borrower_name', 'relationship_to_borrower', 'collateral_backing']
+    
+    def get_borrower_name(self, obj):
+        return f"{obj.borrower.first_name} {obj.borrower.last_name}"
+
+
 class ClientScreeningSerializer(serializers.ModelSerializer):
     household_assessment = HouseholdAssessmentSerializer(read_only=True)
     business_assessments = BusinessAssessmentSerializer(many=True, read_only=True)
@@ -239,5 +269,18 @@ class ClientScreeningSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['client_risk_score', 'cluster_group', 'recommended_loan_amount', 'status', 'created_at', 'updated_at']
 
+    # Nested sub-resources; when the context carries "expand", only those listed are rendered
+    EXPANDABLE_FIELDS = (
+        'household_assessment', 'business_assessments', 'informal_loans', 'spouse_assessment',
+        'guarantor_assessments', 'client_profile', 'behavioral_verification',
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = self.context.get('expand')
+        if expand is not None:
+            for name in set(self.EXPANDABLE_FIELDS) - set(expand):
+                self.fields.pop(name)
+
     def get_borrower_name(self, obj):
         return f"{obj.borrower.first_name} {obj.borrower.last_name}"
@@ -0,0 +1,94 @@
+"""
+Model signal handlers
+Bump analytics cache generations, keep the GroupRiskMetric cube current and
+post LGD changes to the active model version on writes. Queryset update() and
+bulk_create()/bulk_update() do not send signals; code that writes that way
+calls analytics_cache.bump() itself and relies on the next cube refresh and
+model training.
+"""
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from . import analytics_cache, cube, training
+from .models import Loan, Repayment, Recovery, LoanRiskMetric
+
+SOURCES = {
+    Loan: analytics_cache.LOAN,
+    Repayment: analytics_cache.REPAYMENT,
+    Recovery: analytics_cache.RECOVERY,
+    LoanRiskMetric: analytics_cache.RISK_METRIC,
+}
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_save, sender=Repayment)
+@receiver(post_save, sender=Recovery)
+@receiver(post_save, sender=LoanRiskMetric)
+@receiver(post_delete, sender=Loan)
+@receiver(post_delete, sender=Repayment)
+@receiver(post_delete, sender=Recovery)
+@receiver(post_delete, sender=LoanRiskMetric)
+def invalidate_analytics(sender, **kwargs):
+    # Bump after commit as well, so a read racing the transaction cannot
+    # cache pre-commit data under the new generation
+    source = SOURCES[sender]
+    analytics_cache.bump(source)
+    transaction.on_commit(lambda: analytics_cache.bump(source))
+
+
+def _loan_id(sender, instance):
+    return instance.pk if sender is Loan else instance.loan_id
+
+
+@receiver(pre_save, sender=Loan)
+@receiver(pre_save, sender=Repayment)
+@receiver(pre_save, sender=Recovery)
+@receiver(pre_delete, sender=Loan)
+@receiver(pre_delete, sender=Repayment)
+@receiver(pre_delete, sender=Recovery)
+@receiver(pre_save, sender=LoanRiskMetric)
+@receiver(pre_delete, sender=LoanRiskMetric)
+def stash_group_metric_state(sender, instance, **kwargs):
+    # A loan being added has no contribution yet; post_save applies all of it
+    if sender is Loan and instance._state.adding:
+        return
+    deleting = sender is Loan and kwargs['signal'] is pre_delete
+    cube.stash_loan_state(_loan_id(sender, instance), deleting=deleting)
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_save, sender=Repayment)
+@receiver(post_save, sender=Recovery)
+@receiver(post_delete, sender=Loan)
+@receiver(post_delete, sender=Repayment)
+@receiver(post_delete, sender=Recovery)
+@receiver(post_save, sender=LoanRiskMetric)
+@receiver(post_delete, sender=LoanRiskMetric)
+def update_group_metrics(sender, instance, **kwargs):
+    # Runs inside the writer's transaction, so a rollback undoes the deltas too
+    deleted = sender is Loan and kwargs['signal'] is post_delete
+    created = sender is Loan and kwargs.get('created', False)
+    cube.apply_loan_change(_loan_id(sender, instance), deleted=deleted, created=created)
+
+
+@receiver(pre_save, sender=Loan)
+@receiver(pre_save, sender=Recovery)
+@receiver(pre_delete, sender=Loan)
+@receiver(pre_delete, sender=Recovery)
+def stash_lgd_state(sender, instance, **kwargs):
+    if sender is Loan and instance._state.adding:
+        return
+    deleting = sender is Loan and kwargs['signal'] is pre_delete
+    training.stash_lgd_state(_loan_id(sender, instance), deleting=deleting)
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_save, sender=Recovery)
+@receiver(post_delete, sender=Loan)
+@receiver(post_delete, sender=Recovery)
+def update_lgd_stats(sender, instance, **kwargs):
+    # The delta is posted on commit, so a rolled-back write leaves the model alone
+    deleted = sender is Loan and kwargs['signal'] is post_delete
+    created = sender is Loan and kwargs.get('created', False)
+    training.apply_lgd_change(_loan_id(sender, instance), deleted=deleted, created=created)
@@ -1,3 +1,1003 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from scipy import optimize, special
+
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    Branch, LoanOfficer, Borrower, Spouse, Guarantor, Loan, Collateral, Repayment, LoanRiskMetric,
+    Recovery, GroupRiskMetric, ClientScreening, HouseholdAssessment, InformalLoan
+)
+from . import analytics_cache, cube, model_store, training
+from .jobs import Job, JobRunner, RUNNING, SUCCEEDED
+from .bayesian_models import BayesianPDModel, BayesianLGDModel, BayesianHazardModel, BetaSufficientStats
+from .features import lgd_observations
+from .scoring import rescore_portfolio, parse_since
+from .model_store import ModelBundle, ModelRegistry
+
+
+def make_branch(name='LILONGWE'):
+    return Branch.objects.create(name=name, code=name[:3])
+
+
+def make_officer(branch, employee_id='LO-001'):
+    return LoanOfficer.objects.create(
+        first_name='Chikondi', last_name='Banda', employee_id=employee_id,
+        branch=branch, phone='0999000000', hire_date=date(2020, 1, 1)
+    )
+
+
+def make_borrower(national_id):
+    return Borrower.objects.create(
+        first_name='Tiyamike', last_name='Phiri', national_id=national_id,
+        date_of_birth=date(1990, 5, 1), gender='F', phone='0888000000',
+        village='Area 25', traditional_authority='Kalumbu', district='Lilongwe',
+        business_type='Grocery', business_industry='RETAIL',
+        monthly_income=Decimal('250000'), transport_mode='BICYCLE'
+    )
+
+
+def make_loan(number, borrower, branch, officer, installments=3):
+    """An active loan with a repayment schedule, one collateral item and risk metrics"""
+    start = date(2025, 1, 1)
+    loan = Loan.objects.create(
+        loan_number=f'LN{number:06d}', borrower=borrower, branch=branch, loan_officer=officer,
+        loan_type='BUSINESS', principal_amount=Decimal('300000'), monthly_interest_rate=Decimal('5'),
+        tenure_months=installments, application_date=start, disbursement_date=start, status='ACTIVE'
+    )
+    for n in range(1, installments + 1):
+        Repayment.objects.create(
+            loan=loan, installment_number=n, scheduled_date=start + timedelta(days=30 * n),
+            scheduled_principal=Decimal('100000'), scheduled_interest=Decimal('15000'),
+            scheduled_total=Decimal('115000')
+        )
+    Collateral.objects.create(
+        loan=loan, collateral_name='Bicycle', collateral_type='BICYCLE', description='Phoenix',
+        valuation_date=start, appraised_value_mwk=Decimal('80000'),
+        market_value_estimate_mwk=Decimal('90000'), condition='GOOD', owner_type='BORROWER'
+    )
+    LoanRiskMetric.objects.create(
+        loan=loan, pd_mean=Decimal('0.05'), pd_lower_hdi=Decimal('0.03'), pd_upper_hdi=Decimal('0.08'),
+        lgd_mean=Decimal('0.45'), lgd_lower_hdi=Decimal('0.30'), lgd_upper_hdi=Decimal('0.60'),
+        ead=Decimal('300000'), expected_loss=Decimal('6750')
+    )
+    return loan
+
+
+def make_screening(borrower, informal_loans=2):
+    """A screening with a household assessment and some informal loans"""
+    screening = ClientScreening.objects.create(
+        borrower=borrower, loan_usage_intention='Restock shop', requested_amount=Decimal('300000')
+    )
+    HouseholdAssessment.objects.create(
+        screening=screening, total_monthly_income=Decimal('250000'),
+        total_monthly_expenses=Decimal('180000'), household_stability_years=Decimal('6')
+    )
+    for n in range(informal_loans):
+        InformalLoan.objects.create(
+            screening=screening, lender_name=f'Lender {n}', lender_relationship='Neighbour',
+            amount=Decimal('20000'), repayment_schedule='Weekly'
+        )
+    return screening
+
+
+class QueryCountTestCase(TestCase):
+    """Fixtures and helpers for asserting that endpoints do not issue N+1 queries"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.branch = make_branch()
+        self.officer = make_officer(self.branch)
+        self.next_number = 1
+
+    def add_loans(self, count):
+        loans = []
+        for _ in range(count):
+            borrower = make_borrower(f'NID{self.next_number:06d}')
+            loans.append(make_loan(self.next_number, borrower, self.branch, self.officer))
+            self.next_number += 1
+        return loans
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries), response
+
+
+class LoanEndpointQueryTests(QueryCountTestCase):
+
+    def test_list_query_count_is_constant(self):
+        self.add_loans(2)
+        small, _ = self.count_queries('/api/loans/')
+        self.add_loans(8)
+        large, response = self.count_queries('/api/loans/')
+        self.assertEqual(response.data['count'], 10)
+        self.assertEqual(small, large)
+        # Page count plus one joined select
+        self.assertLessEqual(large, 2)
+
+    def test_list_uses_lean_serializer(self):
+        self.add_loans(1)
+        _, response = self.count_queries('/api/loans/')
+        row = response.data['results'][0]
+        self.assertEqual(row['borrower_name'], 'Tiyamike Phiri')
+        self.assertNotIn('repayments', row)
+        self.assertNotIn('collateral_items', row)
+
+    def test_detail_query_count_does_not_grow_with_repayments(self):
+        short, = self.add_loans(1)
+        borrower = make_borrower('NID999999')
+        long = make_loan(999, borrower, self.branch, self.officer, installments=12)
+        short_count, _ = self.count_queries(f'/api/loans/{short.id}/')
+        long_count, response = self.count_queries(f'/api/loans/{long.id}/')
+        self.assertEqual(len(response.data['repayments']), 12)
+        self.assertEqual(response.data['risk_metric']['pd_mean'], '0.0500')
+        self.assertEqual(short_count, long_count)
+
+
+class BorrowerEndpointQueryTests(QueryCountTestCase):
+
+    def add_family(self, borrower, guarantors=2):
+        Spouse.objects.create(
+            borrower=borrower, first_name='Mphatso', last_name='Phiri', age=35, gender='M',
+            employment_status='SELF_EMPLOYED', relationship_start_date=date(2015, 1, 1)
+        )
+        for n in range(guarantors):
+            Guarantor.objects.create(
+                borrower=borrower, first_name='Kondwani', last_name='Tembo',
+                national_id=f'G{borrower.id:05d}{n}', age=45, gender='M',
+                relationship_to_borrower='SIBLING', employment_status='EMPLOYED', phone='0999111111'
+            )
+
+    def test_list_query_count_is_constant(self):
+        self.add_loans(2)
+        small, _ = self.count_queries('/api/borrowers/')
+        self.add_loans(8)
+        large, response = self.count_queries('/api/borrowers/')
+        self.assertEqual(response.data['count'], 10)
+        self.assertEqual(small, large)
+
+    def test_list_annotates_loan_summary(self):
+        loan, = self.add_loans(1)
+        # Pay off the first installment: 100000 of principal retired
+        Repayment.objects.filter(loan=loan, installment_number=1).update(actual_amount_paid=Decimal('115000'))
+        _, response = self.count_queries('/api/borrowers/')
+        row = response.data['results'][0]
+        self.assertEqual(row['loan_count'], 1)
+        self.assertEqual(row['last_loan_status'], 'ACTIVE')
+        self.assertEqual(Decimal(row['outstanding_exposure']), Decimal('200000'))
+
+    def test_detail_query_count_does_not_grow_with_guarantors(self):
+        first, second = (loan.borrower for loan in self.add_loans(2))
+        self.add_family(first, guarantors=1)
+        self.add_family(second, guarantors=5)
+        few, _ = self.count_queries(f'/api/borrowers/{first.id}/')
+        many, response = self.count_queries(f'/api/borrowers/{second.id}/')
+        self.assertEqual(len(response.data['guarantors']), 5)
+        self.assertEqual(response.data['spouse']['first_name'], 'Mphatso')
+        self.assertEqual(response.data['loan_count'], 1)
+        self.assertEqual(few, many)
+
+    def test_loans_query_count_does_not_grow_with_loans(self):
+        borrower = self.add_loans(1)[0].borrower
+        few, _ = self.count_queries(f'/api/borrowers/{borrower.id}/loans/')
+        for number in range(100, 104):
+            make_loan(number, borrower, self.branch, self.officer, installments=6)
+        many, response = self.count_queries(f'/api/borrowers/{borrower.id}/loans/')
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(few, many)
+
+
+class BorrowerOverviewTests(QueryCountTestCase):
+
+    def test_query_count_does_not_grow_with_history(self):
+        borrower = self.add_loans(1)[0].borrower
+        few, _ = self.count_queries(f'/api/borrowers/{borrower.id}/360/')
+        for number in range(100, 106):
+            make_loan(number, borrower, self.branch, self.officer, installments=12)
+        many, response = self.count_queries(f'/api/borrowers/{borrower.id}/360/')
+        self.assertEqual(response.data['loans']['count'], 7)
+        self.assertEqual(response.data['loan_summary']['total_loans'], 7)
+        self.assertEqual(few, many)
+
+    def test_repayment_behavior(self):
+        loan, = self.add_loans(1)
+        Repayment.objects.filter(loan=loan, installment_number=1).update(
+            payment_status='ON_TIME', actual_amount_paid=Decimal('115000'), actual_payment_date=date(2025, 1, 31)
+        )
+        Repayment.objects.filter(loan=loan, installment_number=2).update(payment_status='LATE_PAYMENT', days_late=12)
+        _, response = self.count_queries(f'/api/borrowers/{loan.borrower_id}/360/')
+        behavior = response.data['repayment_behavior']
+        self.assertEqual(behavior['installments_due'], 3)
+        self.assertEqual(behavior['max_days_late'], 12)
+        self.assertAlmostEqual(behavior['on_time_ratio'], 1 / 3)
+        self.assertEqual(behavior['last_payment_date'], date(2025, 1, 31))
+        row = response.data['loans']['results'][0]
+        self.assertEqual((row['installments_due'], row['installments_on_time']), (3, 1))
+
+    def test_guarantor_links(self):
+        backer, backed = (loan.borrower for loan in self.add_loans(2))
+        Guarantor.objects.create(
+            borrower=backed, first_name=backer.first_name, last_name=backer.last_name,
+            national_id=backer.national_id, age=35, gender='F',
+            relationship_to_borrower='FRIEND', employment_status='SELF_EMPLOYED', phone='0888000000'
+        )
+        _, response = self.count_queries(f'/api/borrowers/{backer.id}/360/')
+        links = response.data['guaranteeing']
+        self.assertEqual([link['borrower'] for link in links], [backed.id])
+        self.assertEqual(response.data['profile']['guarantors'], [])
+
+    def test_invalid_window(self):
+        borrower = self.add_loans(1)[0].borrower
+        response = self.client.get(f'/api/borrowers/{borrower.id}/360/?recent_days=soon')
+        self.assertEqual(response.status_code, 400)
+
+
+class ClientScreeningEndpointQueryTests(QueryCountTestCase):
+
+    def add_screenings(self, count, informal_loans=2):
+        return [
+            make_screening(loan.borrower, informal_loans=informal_loans)
+            for loan in self.add_loans(count)
+        ]
+
+    def test_list_returns_header_fields_by_default(self):
+        self.add_screenings(1)
+        _, response = self.count_queries('/api/client-screenings/')
+        row = response.data['results'][0]
+        self.assertEqual(row['borrower_name'], 'Tiyamike Phiri')
+        self.assertNotIn('household_assessment', row)
+        self.assertNotIn('informal_loans', row)
+
+    def test_list_query_count_is_constant(self):
+        self.add_screenings(2)
+        url = '/api/client-screenings/?expand=all'
+        small, _ = self.count_queries(url)
+        self.add_screenings(6, informal_loans=4)
+        large, response = self.count_queries(url)
+        self.assertEqual(response.data['count'], 8)
+        self.assertEqual(small, large)
+
+    def test_expand_selected_sub_resources(self):
+        self.add_screenings(1, informal_loans=3)
+        _, response = self.count_queries('/api/client-screenings/?expand=household_assessment,informal_loans')
+        row = response.data['results'][0]
+        self.assertEqual(Decimal(row['household_assessment']['net_monthly_cashflow']), Decimal('70000'))
+        self.assertEqual(len(row['informal_loans']), 3)
+        self.assertIsNone(row.get('spouse_assessment'))
+        self.assertNotIn('guarantor_assessments', row)
+
+    def test_detail_renders_everything(self):
+        screening, = self.add_screenings(1)
+        _, response = self.count_queries(f'/api/client-screenings/{screening.id}/')
+        self.assertEqual(len(response.data['informal_loans']), 2)
+        self.assertIsNone(response.data['spouse_assessment'])
+        self.assertEqual(response.data['guarantor_assessments'], [])
+
+    def test_unknown_expand_is_rejected(self):
+        self.add_screenings(1)
+        response = self.client.get('/api/client-screenings/?expand=loans')
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetPaginationTests(QueryCountTestCase):
+
+    def walk(self, url, link='next'):
+        """Follow pagination links from url; returns the rows and the query count of each page"""
+        rows, counts = [], []
+        while url:
+            count, response = self.count_queries(url)
+            rows.extend(response.data['results'])
+            counts.append(count)
+            url = response.data[link]
+        return rows, counts, response
+
+    def test_repayment_cursor_walk_covers_every_row_in_key_order(self):
+        self.add_loans(4)
+        rows, counts, last = self.walk('/api/repayments/?cursor=&page_size=5&count=false')
+        expected = list(Repayment.objects.order_by('loan_id', 'installment_number').values_list('id', flat=True))
+        self.assertEqual([row['id'] for row in rows], expected)
+        self.assertIsNone(last.data['count'])
+        # Deep pages cost the same as the first: one seek, no COUNT(*)
+        self.assertEqual(set(counts), {1})
+
+        # 12 rows: walking back from the last page yields the middle page, then the first
+        back, _, _ = self.walk(last.data['previous'], link='previous')
+        self.assertEqual([row['id'] for row in back], expected[5:10] + expected[:5])
+
+    def test_loan_cursor_descending_date_with_count(self):
+        loans = self.add_loans(5)
+        for offset, loan in enumerate(loans):
+            Loan.objects.filter(pk=loan.pk).update(application_date=date(2025, 1, 1) + timedelta(days=offset % 2))
+        rows, _, last = self.walk('/api/loans/?cursor=&ordering=-application_date&page_size=2')
+        expected = list(Loan.objects.order_by('-application_date', '-id').values_list('id', flat=True))
+        self.assertEqual([row['id'] for row in rows], expected)
+        self.assertEqual(last.data['count'], 5)
+
+    def test_uncounted_page_numbers(self):
+        self.add_loans(3)
+        count, response = self.count_queries('/api/loans/?count=false&page_size=2')
+        self.assertEqual(count, 1)
+        self.assertIsNone(response.data['count'])
+        self.assertIsNotNone(response.data['next'])
+        _, response = self.count_queries('/api/loans/?count=false&page_size=2&page=2')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor_and_ordering(self):
+        self.add_loans(1)
+        self.assertEqual(self.client.get('/api/loans/?cursor=not-a-cursor').status_code, 404)
+        self.assertEqual(self.client.get('/api/loans/?cursor=&ordering=status').status_code, 400)
+
+
+class AnalyticsCacheTests(QueryCountTestCase):
+    """Writes bump their source generation, so the next analytics request recomputes"""
+
+    def setUp(self):
+        super().setUp()
+        caches[analytics_cache.CACHE_ALIAS].clear()
+        self.add_loans(2)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def test_loan_write_invalidates_statistics(self):
+        first = self.get('/api/loans/statistics/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        second = self.get('/api/loans/statistics/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+
+        generation = analytics_cache.generation(analytics_cache.LOAN)
+        loan = self.add_loans(1)[0]
+        self.assertGreater(analytics_cache.generation(analytics_cache.LOAN), generation)
+        fresh = self.get('/api/loans/statistics/')
+        self.assertEqual(fresh['X-Cache'], 'MISS')
+        self.assertEqual(fresh.data['total_loans'], first.data['total_loans'] + 1)
+
+        loan.status = 'DEFAULTED'
+        loan.save()
+        self.assertEqual(self.get('/api/loans/statistics/')['X-Cache'], 'MISS')
+
+    def test_cache_stats_counts_hits_and_misses(self):
+        self.get('/api/loans/statistics/')
+        self.get('/api/loans/statistics/')
+        self.get('/api/loans/statistics/?group_by=branch')
+        stats = self.get('/api/analytics/cache/').data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+        self.assertAlmostEqual(stats['hit_ratio'], 1 / 3)
+        self.assertEqual(set(stats['generations']), {'loan', 'repayment', 'recovery', 'risk_metric'})
+
+
+class GroupRiskMetricDeltaTests(TestCase):
+    """Incremental cube maintenance must leave the table equal to a rebuild"""
+    COLUMNS = cube.DELTA_FIELDS + ['par30_rate', 'par60_rate', 'par90_rate', 'recovery_rate', 'mean_pd', 'mean_lgd']
+
+    def setUp(self):
+        self.branch = make_branch()
+        self.officer = make_officer(self.branch)
+        self.loans = [
+            make_loan(n, make_borrower(f'NID{n:06d}'), self.branch, self.officer)
+            for n in range(1, 5)
+        ]
+        cube.refresh_group_metrics()
+
+    def snapshot(self):
+        return {
+            (metric.branch_id, metric.loan_type, metric.tenure_months): [
+                float(getattr(metric, column)) for column in self.COLUMNS
+            ]
+            for metric in GroupRiskMetric.objects.all()
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.snapshot()
+        cube.refresh_group_metrics()
+        rebuilt = self.snapshot()
+        self.assertEqual(sorted(incremental, key=str), sorted(rebuilt, key=str))
+        for cell, values in rebuilt.items():
+            for column, got, expected in zip(self.COLUMNS, incremental[cell], values):
+                self.assertAlmostEqual(got, expected, delta=0.011, msg=f"{cell} {column}")
+
+    def test_loan_created_after_refresh(self):
+        make_loan(10, make_borrower('NID000010'), self.branch, self.officer, installments=6)
+        overall = GroupRiskMetric.objects.get(branch=None, loan_type=None, tenure_months=None)
+        self.assertEqual(overall.loan_count, 5)
+        self.assertMatchesRebuild()
+
+    def test_write_sequence_matches_rebuild(self):
+        first, second, third, fourth = self.loans
+        make_loan(10, make_borrower('NID000010'), self.branch, self.officer, installments=6)
+
+        repayment = first.repayments.get(installment_number=1)
+        repayment.actual_amount_paid = repayment.scheduled_total
+        repayment.save()
+
+        second.status = 'DEFAULTED'
+        second.save()
+        Recovery.objects.create(
+            loan=second, recovery_date=date(2025, 6, 1), recovery_amount=Decimal('40000'),
+            recovery_method='Collateral Sale'
+        )
+
+        third.branch = make_branch('BLANTYRE')
+        third.save()
+        metric = third.risk_metric
+        metric.pd_mean, metric.lgd_mean = Decimal('0.2'), Decimal('0.7')
+        metric.save()
+        first.risk_metric.delete()
+
+        fourth.delete()
+
+        with transaction.atomic(), cube.batch_deltas():
+            for repayment in first.repayments.filter(installment_number__gt=1):
+                repayment.actual_amount_paid = repayment.scheduled_total
+                repayment.save()
+
+        self.assertMatchesRebuild()
+
+
+class BayesianPDModelTests(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.X = np.column_stack([np.ones(2000), rng.normal(size=(2000, 2))])
+        self.true_w = np.array([-1.0, 0.8, -0.5])
+        self.y = (rng.random(2000) < special.expit(self.X @ self.true_w)).astype(float)
+
+    def neg_log_posterior(self, w, prior_precision=1.0):
+        logits = self.X @ w
+        ll = np.sum(self.y * -np.logaddexp(0, -logits) + (1 - self.y) * -np.logaddexp(0, logits))
+        return 0.5 * prior_precision * np.sum(w ** 2) - ll
+
+    def test_newton_fit_matches_generic_optimizer(self):
+        model = BayesianPDModel()
+        model.fit(self.X, self.y)
+        reference = optimize.minimize(self.neg_log_posterior, np.zeros(3), method='BFGS', options={'gtol': 1e-8})
+        np.testing.assert_allclose(model.coef_mean, reference.x, atol=1e-4)
+        # Recovers the generating weights within a few posterior standard deviations
+        self.assertTrue(np.all(np.abs(model.coef_mean - self.true_w) < 4 * np.sqrt(np.diag(model.coef_cov))))
+
+    def test_covariance_is_inverse_hessian_at_map(self):
+        model = BayesianPDModel()
+        model.fit(self.X, self.y)
+        p = special.expit(self.X @ model.coef_mean)
+        hessian = self.X.T @ np.diag(p * (1 - p)) @ self.X + np.eye(3)
+        np.testing.assert_allclose(model.coef_cov @ hessian, np.eye(3), atol=1e-8)
+
+
+class BayesianLGDModelTests(TestCase):
+
+    def setUp(self):
+        self.lgds = np.random.default_rng(11).beta(2.0, 5.0, size=400)
+
+    def test_mode_maximizes_conjugate_posterior(self):
+        model = BayesianLGDModel()
+        model.update(self.lgds)
+        nu0, s1, s2 = model._prior_stats()
+        x = self.lgds
+        nu, s1, s2 = nu0 + x.size, s1 + np.log(x).sum(), s2 + np.log1p(-x).sum()
+
+        def neg_log_posterior(log_ab):
+            a, b = np.exp(log_ab)
+            return nu * special.betaln(a, b) - (a - 1) * s1 - (b - 1) * s2
+
+        reference = optimize.minimize(neg_log_posterior, np.zeros(2), method='Nelder-Mead',
+                                      options={'xatol': 1e-10, 'fatol': 1e-12, 'maxiter': 5000})
+        np.testing.assert_allclose([model.alpha, model.beta], np.exp(reference.x), rtol=1e-4)
+        self.assertAlmostEqual(model.predict().mean, 2 / 7, delta=0.02)
+
+    def test_incremental_updates_match_batch(self):
+        batch = BayesianLGDModel()
+        batch.update(self.lgds)
+        incremental = BayesianLGDModel()
+        for chunk in np.array_split(self.lgds, 7):
+            incremental.update(chunk)
+        np.testing.assert_allclose([incremental.alpha, incremental.beta], [batch.alpha, batch.beta], rtol=1e-8)
+
+        incremental.update(np.array([0.9, 0.95]))
+        incremental.remove(np.array([0.9, 0.95]))
+        np.testing.assert_allclose([incremental.alpha, incremental.beta], [batch.alpha, batch.beta], rtol=1e-8)
+
+    def test_total_losses_and_full_recoveries_are_point_masses(self):
+        interior = BayesianLGDModel()
+        interior.update(self.lgds)
+        model = BayesianLGDModel()
+        model.update(np.concatenate([self.lgds, np.ones(100), np.zeros(20)]))
+        # The 0s and 1s leave the Beta part alone instead of pulling it into a U shape
+        np.testing.assert_allclose([model.alpha, model.beta], [interior.alpha, interior.beta], rtol=1e-10)
+        p_zero, p_one = model.point_masses()
+        self.assertAlmostEqual(p_zero, 20 / 522)
+        self.assertAlmostEqual(p_one, 100 / 522)
+        result = model.predict()
+        self.assertAlmostEqual(result.mean, p_one + (1 - p_zero - p_one) * interior.alpha / (interior.alpha + interior.beta))
+        self.assertEqual(result.upper_hdi, 1.0)
+
+
+class TempModelDirMixin:
+    """Point the model registry and this worker's bundle at a temporary MODEL_DIR"""
+
+    def setUp(self):
+        super().setUp()
+        self.model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.model_dir)
+        self.registry = ModelRegistry(self.model_dir)
+        for patcher in (mock.patch.object(model_store, 'registry', self.registry),
+                        mock.patch.object(model_store, '_bundle', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+def make_bundle(seed=0):
+    """A bundle with every array populated, as training would leave it"""
+    rng = np.random.default_rng(seed)
+    bundle = ModelBundle()
+    bundle.pd_model.fit(np.column_stack([np.ones(200), rng.normal(size=(200, 2))]), (rng.random(200) < 0.2).astype(float))
+    bundle.lgd_model.update(rng.beta(2.0, 5.0, size=50))
+    bundle.hazard_model.fit(20.0 * rng.weibull(1.5, size=200), (rng.random(200) < 0.7).astype(float))
+    bundle.feature_mean, bundle.feature_std = rng.normal(size=2), rng.random(2) + 0.5
+    bundle.metadata = {'trained_at': '2026-01-01T00:00:00', 'seed': seed}
+    return bundle
+
+
+class ModelRegistryTests(TempModelDirMixin, SimpleTestCase):
+
+    def test_save_activate_load_round_trip(self):
+        bundle = make_bundle()
+        version = self.registry.save(bundle, activate=False)
+        self.assertEqual(version, 1)
+        self.assertEqual(self.registry.versions(), [1])
+        self.assertIsNone(self.registry.active_version())
+        # The staging directory was renamed into place, not left behind
+        self.assertEqual(os.listdir(self.registry.versions_dir), ['0001'])
+
+        self.registry.activate(version)
+        self.assertEqual(self.registry.active_version(), 1)
+        loaded = self.registry.load()
+        self.assertEqual(loaded.version, 1)
+        self.assertEqual(loaded.metadata['seed'], 0)
+        self.assertIsInstance(loaded.pd_model.coef_mean, np.memmap)
+        np.testing.assert_array_equal(loaded.pd_model.coef_mean, bundle.pd_model.coef_mean)
+        np.testing.assert_array_equal(loaded.pd_model.coef_cov, bundle.pd_model.coef_cov)
+        np.testing.assert_array_equal(loaded.pd_model.coef_chol, bundle.pd_model.cholesky())
+        np.testing.assert_array_equal(loaded.feature_std, bundle.feature_std)
+        np.testing.assert_array_equal(loaded.hazard_model.param_cov, bundle.hazard_model.param_cov)
+        self.assertEqual((loaded.lgd_model.alpha, loaded.lgd_model.beta), (bundle.lgd_model.alpha, bundle.lgd_model.beta))
+        self.assertEqual((loaded.hazard_model.shape, loaded.hazard_model.scale),
+                         (bundle.hazard_model.shape, bundle.hazard_model.scale))
+
+        X = np.random.default_rng(1).normal(size=(5, 3))
+        np.testing.assert_allclose(loaded.pd_model.predict_proba_closed_form(X).mean,
+                                   bundle.pd_model.predict_proba_closed_form(X).mean)
+        self.assertNotIsInstance(self.registry.load(mmap=False).pd_model.coef_mean, np.memmap)
+
+    def test_activate_switches_pointer_and_rolls_back(self):
+        self.registry.save(make_bundle(0))
+        self.registry.save(make_bundle(1))
+        self.assertEqual(self.registry.versions(), [1, 2])
+        self.assertEqual(self.registry.active_version(), 2)
+        self.assertEqual(self.registry.load().metadata['seed'], 1)
+
+        self.registry.activate(1)
+        self.assertEqual(self.registry.load().metadata['seed'], 0)
+        self.assertEqual(sorted(os.listdir(self.model_dir)), ['ACTIVE', 'versions'])
+        with self.assertRaises(ValueError):
+            self.registry.activate(3)
+        self.assertEqual(self.registry.active_version(), 1)
+
+
+class BundleReloadTests(TempModelDirMixin, SimpleTestCase):
+    """Workers pick up a newly activated version once MODEL_RELOAD_INTERVAL has passed"""
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        for patcher in (mock.patch.object(model_store.time, 'monotonic', lambda: self.now),
+                        mock.patch.object(model_store, 'MODEL_RELOAD_INTERVAL', 5.0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_new_version_is_picked_up_after_interval(self):
+        self.registry.save(make_bundle(0))
+        current = model_store.get_bundle()
+        self.assertEqual(current.version, 1)
+
+        # Another worker trains and activates version 2
+        self.registry.save(make_bundle(1))
+        self.now += 4.9
+        self.assertIs(model_store.get_bundle(), current)
+
+        self.now += 0.2
+        reloaded = model_store.get_bundle()
+        self.assertEqual(reloaded.version, 2)
+        self.assertEqual(reloaded.metadata['seed'], 1)
+        # A request still holding the old bundle keeps scoring with it
+        self.assertEqual(current.version, 1)
+
+        # Rolling back is the same pointer switch
+        self.registry.activate(1)
+        self.now += 5.0
+        self.assertEqual(model_store.get_bundle().version, 1)
+
+    def test_unreadable_version_keeps_current_bundle(self):
+        self.registry.save(make_bundle(0))
+        current = model_store.get_bundle()
+        with open(self.registry.active_path, 'w') as f:
+            f.write('7')
+        self.now += 5.0
+        self.assertIs(model_store.get_bundle(), current)
+
+
+class LGDStatsMaintenanceTests(TempModelDirMixin, TestCase):
+    """Loan and recovery writes keep the active LGD statistics equal to a full rescan"""
+
+    def setUp(self):
+        super().setUp()
+        branch = make_branch()
+        officer = make_officer(branch)
+        self.loans = [make_loan(n, make_borrower(f'NID{n:06d}'), branch, officer) for n in range(1, 4)]
+        self.loans[0].status = 'DEFAULTED'
+        self.loans[0].save()
+        bundle = ModelBundle()
+        bundle.lgd_model.update(lgd_observations()['lgd'])
+        model_store.publish_bundle(bundle)
+
+    def assertMatchesRescan(self):
+        expected = BetaSufficientStats.from_observations(lgd_observations()['lgd']).to_array()
+        version = self.registry.active_version()
+        np.testing.assert_allclose(self.registry.lgd_stats(version), expected, atol=1e-9)
+        np.testing.assert_allclose(model_store.get_bundle().lgd_model.stats.to_array(), expected, atol=1e-9)
+
+    def test_recovery_writes_post_deltas(self):
+        first, second, third = self.loans
+        with self.captureOnCommitCallbacks(execute=True):
+            recovery = Recovery.objects.create(
+                loan=first, recovery_date=date(2025, 6, 1), recovery_amount=Decimal('120000'),
+                recovery_method='Collateral Sale'
+            )
+        self.assertMatchesRescan()
+        self.assertEqual(model_store.get_bundle().lgd_model.stats.n_one, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recovery.recovery_amount = Decimal('300000')
+            recovery.save()
+        self.assertMatchesRescan()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.status = 'WRITTEN_OFF'
+            second.save()
+            recovery.delete()
+        self.assertMatchesRescan()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Recovery.objects.create(
+                loan=second, recovery_date=date(2025, 6, 1), recovery_amount=Decimal('50000'),
+                recovery_method='Cash'
+            )
+            second.delete()
+        self.assertMatchesRescan()
+
+    def test_rolled_back_write_posts_nothing(self):
+        before = self.registry.lgd_stats(self.registry.active_version())
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Recovery.objects.create(
+                        loan=self.loans[0], recovery_date=date(2025, 6, 1), recovery_amount=Decimal('120000'),
+                        recovery_method='Cash'
+                    )
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        np.testing.assert_array_equal(self.registry.lgd_stats(self.registry.active_version()), before)
+
+    def test_other_workers_pick_up_posted_stats(self):
+        stale = model_store.get_bundle()
+        # Another worker posts the delta; this one only sees it on its next poll
+        with mock.patch.object(training, 'apply_lgd_delta', lambda delta: self.registry.update_lgd_stats(
+            self.registry.active_version(), delta
+        )), self.captureOnCommitCallbacks(execute=True):
+            Recovery.objects.create(
+                loan=self.loans[0], recovery_date=date(2025, 6, 1), recovery_amount=Decimal('120000'),
+                recovery_method='Cash'
+            )
+        self.assertIs(model_store.get_bundle(), stale)
+        with mock.patch.object(model_store, 'MODEL_RELOAD_INTERVAL', 0):
+            fresh = model_store.get_bundle()
+        self.assertIsNot(fresh, stale)
+        self.assertEqual(fresh.version, stale.version)
+        self.assertEqual(fresh.lgd_model.stats.n, 1)
+
+
+class BayesianHazardModelTests(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        # Weibull(shape 1.5, scale 20) default times, censored at a uniform follow-up horizon
+        default_times = 20.0 * rng.weibull(1.5, size=3000)
+        follow_up = rng.uniform(5, 40, size=3000)
+        self.durations = np.minimum(default_times, follow_up)
+        self.events = (default_times <= follow_up).astype(float)
+
+    def test_censored_fit_matches_generic_optimizer(self):
+        model = BayesianHazardModel()
+        model.fit(self.durations, self.events)
+        z, d = np.log(self.durations), self.events
+
+        def neg_log_posterior(theta):
+            k, log_scale = np.exp(theta[0]), theta[1]
+            ll = np.sum(d * (theta[0] + (k - 1) * z - k * log_scale)) - np.sum(np.exp(k * (z - log_scale)))
+            return 0.5 * (1.0 * theta[0] ** 2 + 1e-2 * theta[1] ** 2) - ll
+
+        reference = optimize.minimize(neg_log_posterior, np.array([0.0, np.log(20.0)]), method='BFGS',
+                                      options={'gtol': 1e-8})
+        np.testing.assert_allclose([model.shape, model.scale], np.exp(reference.x), rtol=1e-5)
+        # Censoring handled: the generating parameters are recovered
+        self.assertAlmostEqual(model.shape, 1.5, delta=0.1)
+        self.assertAlmostEqual(model.scale, 20.0, delta=1.0)
+
+    def test_laplace_covariance_is_positive_definite(self):
+        model = BayesianHazardModel()
+        model.fit(self.durations, self.events)
+        self.assertTrue(np.all(np.linalg.eigvalsh(model.param_cov) > 0))
+        survival = model.survival_batch(np.array([5.0, 20.0]))
+        self.assertTrue(np.all(survival.lower_hdi <= survival.mean))
+        self.assertTrue(np.all(survival.mean <= survival.upper_hdi))
+
+    def test_all_event_data_keeps_real_uncertainty(self):
+        rng = np.random.default_rng(5)
+        cases = {
+            'spread': 20.0 * rng.weibull(1.5, size=200),
+            'near ties': np.array([12.0, 12.01, 11.99]),
+            'ties': np.full(50, 12.0),
+        }
+        for name, durations in cases.items():
+            with self.subTest(name):
+                model = BayesianHazardModel()
+                with np.errstate(over='raise', invalid='raise'):
+                    model.fit(durations, np.ones_like(durations))
+                self.assertLessEqual(model.shape, 100.0 + 1e-6)
+                if model.param_cov is not None:
+                    self.assertTrue(np.all(np.linalg.eigvalsh(model.param_cov) > 0))
+                survival = model.survival_batch(np.array([6.0, 12.0, 18.0]))
+                self.assertTrue(np.all(survival.upper_hdi - survival.lower_hdi > 0))
+        # Tied durations leave the mode on the shape bound, where Laplace does not apply
+        self.assertIsNone(model.param_cov)
+
+    def test_term_structure_hdis_match_posterior_draws(self):
+        model = BayesianHazardModel()
+        model.fit(self.durations, self.events)
+        ages, horizons = np.array([0.0, 6.0, 24.0]), np.array([1.0, 6.0, 12.0])
+        curves = model.conditional_survival_batch(ages, horizons)
+        self.assertTrue(np.all(curves.lower_hdi < curves.mean))
+        self.assertTrue(np.all(curves.mean < curves.upper_hdi))
+        # From age 0 the conditional curve is the unconditional one
+        unconditional = model.survival_batch(horizons)
+        np.testing.assert_allclose(curves.lower_hdi[0], unconditional.lower_hdi, rtol=1e-9)
+        np.testing.assert_allclose(curves.upper_hdi[0], unconditional.upper_hdi, rtol=1e-9)
+
+        # Intervals agree with quantiles over draws from the Laplace posterior
+        theta = np.random.default_rng(9).multivariate_normal(
+            np.log([model.shape, model.scale]), model.param_cov, size=20000
+        )
+        k, scale = np.exp(theta[:, 0])[:, None, None], np.exp(theta[:, 1])[:, None, None]
+        cum_hazard = lambda t: (t / scale) ** k
+        draws = np.exp(cum_hazard(ages[:, None]) - cum_hazard(ages[:, None] + horizons[None, :]))
+        np.testing.assert_allclose(curves.lower_hdi, np.quantile(draws, 0.025, axis=0), atol=5e-3)
+        np.testing.assert_allclose(curves.upper_hdi, np.quantile(draws, 0.975, axis=0), atol=5e-3)
+
+        hazard = model.hazard_rate_batch(ages[1:])
+        rates = (k[:, :, 0] / scale[:, :, 0]) * (ages[1:] / scale[:, :, 0]) ** (k[:, :, 0] - 1)
+        np.testing.assert_allclose(hazard.lower_hdi, np.quantile(rates, 0.025, axis=0), rtol=0.02)
+        np.testing.assert_allclose(hazard.upper_hdi, np.quantile(rates, 0.975, axis=0), rtol=0.02)
+
+
+class RiskModelInputTests(TestCase):
+    """Malformed batch inputs are rejected before any model is loaded"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def assertRejected(self, url, payload):
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn('error', response.data)
+
+    def test_predict_batch_rejects_malformed_features(self):
+        url = '/api/models/predict_batch/'
+        self.assertRejected(url, {'features': [[100000, 5, 12, 250000], [100000, 5]]})
+        self.assertRejected(url, {'features': [[100000, 'five', 12, 250000]]})
+        self.assertRejected(url, {'features': 'abc'})
+
+    def test_loan_selection_is_validated(self):
+        for url in ('/api/models/predict_batch/', '/api/models/survival_curves/'):
+            self.assertRejected(url, {'loan_ids': ['abc']})
+            self.assertRejected(url, {'loan_ids': 7})
+            self.assertRejected(url, {'filters': ['branch']})
+            self.assertRejected(url, {'filters': {'branch': 'abc'}})
+        self.assertRejected('/api/models/loss_distribution/', {'filters': 'ACTIVE'})
+        self.assertRejected('/api/models/survival_curves/', {'horizons': [1, 'x']})
+
+
+class RescorePortfolioTests(TestCase):
+
+    def setUp(self):
+        branch = make_branch()
+        officer = make_officer(branch)
+        self.loans = [make_loan(n, make_borrower(f'NID{n:06d}'), branch, officer) for n in range(1, 4)]
+        # One loan has never been scored, so the upsert both inserts and updates
+        LoanRiskMetric.objects.filter(loan=self.loans[2]).delete()
+
+    def bundle(self, pd):
+        bundle = ModelBundle()
+        bundle.pd_model.coef_mean = np.array([special.logit(pd), 0.0, 0.0, 0.0, 0.0])
+        bundle.pd_model.coef_cov = np.zeros((5, 5))
+        return bundle
+
+    def pd_by_loan(self):
+        return dict(LoanRiskMetric.objects.values_list('loan_id', 'pd_mean'))
+
+    def test_rescoring_twice_upserts_one_metric_per_loan(self):
+        summary = rescore_portfolio(self.bundle(0.1))
+        self.assertEqual(summary['rows'], 3)
+        self.assertEqual(self.pd_by_loan(), {loan.pk: Decimal('0.1000') for loan in self.loans})
+
+        rescore_portfolio(self.bundle(0.3))
+        self.assertEqual(LoanRiskMetric.objects.count(), 3)
+        self.assertEqual(self.pd_by_loan(), {loan.pk: Decimal('0.3000') for loan in self.loans})
+        metric = LoanRiskMetric.objects.get(loan=self.loans[0])
+        # EAD is the outstanding principal; nothing has been repaid yet
+        self.assertEqual(metric.ead, Decimal('300000'))
+        self.assertAlmostEqual(float(metric.expected_loss), 0.3 * float(metric.lgd_mean) * 300000, delta=1)
+
+    def test_since_limits_rescore_to_recently_updated_loans(self):
+        rescore_portfolio(self.bundle(0.1))
+        cutoff = timezone.now()
+        Loan.objects.exclude(pk=self.loans[0].pk).update(updated_at=cutoff - timedelta(days=1))
+        Loan.objects.filter(pk=self.loans[0].pk).update(updated_at=cutoff + timedelta(seconds=1))
+
+        summary = rescore_portfolio(self.bundle(0.3), since=cutoff)
+        self.assertEqual(summary['rows'], 1)
+        self.assertEqual(self.pd_by_loan(), {
+            self.loans[0].pk: Decimal('0.3000'), self.loans[1].pk: Decimal('0.1000'), self.loans[2].pk: Decimal('0.1000')
+        })
+
+    def test_parse_since(self):
+        self.assertIsNone(parse_since(None))
+        self.assertIsNone(parse_since(''))
+        day = parse_since('2025-06-01')
+        self.assertTrue(timezone.is_aware(day))
+        self.assertEqual((day.year, day.month, day.day, day.hour), (2025, 6, 1, 0))
+        self.assertEqual(parse_since('2025-06-01T12:30:00+00:00').hour, 12)
+        self.assertEqual(parse_since('last'), LoanRiskMetric.objects.latest('calculated_at').calculated_at)
+        with self.assertRaises(ValueError):
+            parse_since('yesterday')
+
+
+class PortfolioMetricsTests(QueryCountTestCase):
+
+    def test_var_and_expected_loss_share_book_and_exposure(self):
+        loans = self.add_loans(3)
+        LoanRiskMetric.objects.filter(loan=loans[0]).delete()
+        _, response = self.count_queries('/api/loans/portfolio_metrics/')
+        data = response.data
+        self.assertEqual((data['loan_count'], data['scored_loans']), (3, 2))
+        self.assertEqual(Decimal(data['total_outstanding']), Decimal('900000'))
+        # The unscored loan takes the scored average (PD 0.05, LGD 0.45) on its outstanding balance
+        self.assertAlmostEqual(data['expected_loss'], 900000 * 0.05 * 0.45, places=2)
+        self.assertGreater(data['portfolio_var'], data['expected_loss'])
+
+    def test_scored_loans_use_stored_exposure(self):
+        loans = self.add_loans(2)
+        metric = loans[0].risk_metric
+        metric.ead = Decimal('100000')
+        metric.save()
+        _, response = self.count_queries('/api/loans/portfolio_metrics/')
+        self.assertAlmostEqual(response.data['expected_loss'], 400000 * 0.05 * 0.45, places=2)
+
+    def test_query_count_is_constant(self):
+        self.add_loans(2)
+        small, _ = self.count_queries('/api/loans/portfolio_metrics/')
+        self.add_loans(8)
+        large, response = self.count_queries('/api/loans/portfolio_metrics/')
+        self.assertEqual(response.data['loan_count'], 10)
+        self.assertEqual(small, large)
+
+
+class JobLockTests(SimpleTestCase):
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.job_dir)
+
+    def runner(self):
+        return JobRunner(job_dir=self.job_dir)
+
+    def test_one_claimant_wins_a_stale_lock(self):
+        for attempt in range(20):
+            stale = Job(id=f'stale{attempt}', kind='train', status=SUCCEEDED)
+            self.runner()._write(stale)
+            with open(f'{self.job_dir}/train.lock', 'w') as f:
+                f.write(stale.id)
+
+            barrier = threading.Barrier(6)
+            winners = []
+
+            def claim(n):
+                job = Job(id=f'{attempt}-{n}', kind='train')
+                runner = self.runner()
+                runner._write(job)
+                barrier.wait()
+                if runner._claim('train', job) is None:
+                    winners.append(job.id)
+
+            threads = [threading.Thread(target=claim, args=(n,)) for n in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(len(winners), 1)
+            with open(f'{self.job_dir}/train.lock') as f:
+                self.assertEqual(f.read(), winners[0])
+            self.runner()._release('train', Job(id=winners[0], kind='train'))
+
+    def test_removing_a_stale_holder_keeps_a_fresh_lock(self):
+        lock_path = f'{self.job_dir}/train.lock'
+        with open(lock_path, 'w') as f:
+            f.write('fresh')
+        # A submitter that read an older, stale holder must leave the fresh lock alone
+        self.runner()._remove_lock(lock_path, 'stale', Job(id='late', kind='train'))
+        with open(lock_path) as f:
+            self.assertEqual(f.read(), 'fresh')
+        self.runner()._release('train', Job(id='fresh', kind='train'))
+        self.assertFalse(os.path.exists(lock_path))
+
+
+class JobPruneTests(SimpleTestCase):
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.job_dir)
+        self.runner = JobRunner(job_dir=self.job_dir, ttl=60)
+
+    def age(self, job, seconds):
+        self.runner._write(job)
+        path = os.path.join(self.job_dir, f'{job.id}.json')
+        past = os.path.getmtime(path) - seconds
+        os.utime(path, (past, past))
+
+    def test_prune_removes_only_expired_finished_jobs(self):
+        self.age(Job(id='old', kind='train', status=SUCCEEDED), 120)
+        self.age(Job(id='recent', kind='train', status=SUCCEEDED), 10)
+        self.age(Job(id='running', kind='refresh', status=RUNNING), 120)
+        self.age(Job(id='crashed', kind='rescore', status=RUNNING, pid=2 ** 22 + 1), 120)
+
+        self.assertEqual(self.runner.prune(), 2)
+        self.assertIsNone(self.runner.get('old'))
+        self.assertIsNone(self.runner.get('crashed'))
+        self.assertIsNotNone(self.runner.get('recent'))
+        self.assertIsNotNone(self.runner.get('running'))
+
+    def test_submit_prunes(self):
+        self.age(Job(id='old', kind='train', status=SUCCEEDED), 120)
+        job, created = self.runner.submit('train', lambda report: {})
+        self.runner._executor.shutdown(wait=True)
+        self.assertTrue(created)
+        self.assertEqual(self.runner.get(job.id).status, SUCCEEDED)
+        self.assertIsNone(self.runner.get('old'))
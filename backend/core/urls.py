@@ -11,15 +11,13 @@ from .views import (
     ClientScreeningViewSet, ClientProfileViewSet, InformalLoanViewSet,
     SpouseAssessmentViewSet, GuarantorAssessmentViewSet, HouseholdAssessmentViewSet,
     BusinessAssessmentViewSet, BusinessItemViewSet, ClientCollateralViewSet,
-    GuarantorCollateralViewSet, BehavioralVerificationViewSet
+    GuarantorCollateralViewSet, BehavioralVerificationViewSet, AnalyticsViewSet
 )
-
-# Temporarily disabled Bayesian models (requires numpy, scipy, pymc)
-# from .model_views import RiskModelView
+from .model_views import RiskModelView
 
 # Create router and register viewsets
 router = DefaultRouter()
-# router.register(r'models', RiskModelView, basename='models')
+router.register(r'models', RiskModelView, basename='models')
 router.register(r'branches', BranchViewSet, basename='branch')
 router.register(r'loan-officers', LoanOfficerViewSet, basename='loan-officer')
 router.register(r'borrowers', BorrowerViewSet, basename='borrower')
@@ -32,6 +30,7 @@ router.register(r'recoveries', RecoveryViewSet, basename='recovery')
 router.register(r'risk-metrics/loan', LoanRiskMetricViewSet, basename='loan-risk-metric')
 router.register(r'risk-metrics/group', GroupRiskMetricViewSet, basename='group-risk-metric')
 router.register(r'macro-monthly', MacroMonthlyViewSet, basename='macro-monthly')
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
 
 # Client Screening Routes
 router.register(r'client-screenings', ClientScreeningViewSet, basename='client-screening')
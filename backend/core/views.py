@@ -1,13 +1,15 @@
 """
 Django REST Framework ViewSets for all models
 """
+import numpy as np
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.db.models import Count, Sum, Avg, Q, F
+from django.db.models import Q, F, Count, Sum, FloatField
 from django.utils import timezone
+from dataclasses import asdict
 from datetime import timedelta
-from decimal import Decimal
 
 from .models import (
     Branch, LoanOfficer, Borrower, Spouse, Guarantor,
@@ -26,8 +28,18 @@ from .serializers import (
     ClientScreeningSerializer, ClientProfileSerializer, InformalLoanSerializer,
     SpouseAssessmentSerializer, GuarantorAssessmentSerializer, HouseholdAssessmentSerializer,
     BusinessAssessmentSerializer, BusinessItemSerializer, ClientCollateralSerializer,
-    GuarantorCollateralSerializer, BehavioralVerificationSerializer
+    GuarantorCollateralSerializer, BehavioralVerificationSerializer,
+    BorrowerLoanHistorySerializer, ClientScreeningSummarySerializer, GuaranteeLinkSerializer
 )
+from .analytics import (
+    portfolio_at_risk, loan_statistics, repayment_statistics, cube_query, borrower_annotations,
+    loan_summary, repayment_behavior, loan_behavior_annotations, RECENT_BEHAVIOR_DAYS, LOAN_DIMENSIONS, REPAYMENT_DIMENSIONS, CUBE_DIMENSIONS, CUBE_MEASURES
+)
+from .pagination import KeysetPagination
+from .analytics_cache import cached_analytics, cache_stats, LOAN, REPAYMENT, RISK_METRIC
+from .loss_simulation import asrf_var
+from .jobs import runner as job_runner
+from .cube import refresh_job
 
 
 class BranchViewSet(viewsets.ModelViewSet):
@@ -53,16 +65,75 @@ class BorrowerViewSet(viewsets.ModelViewSet):
     filterset_fields = ['district', 'business_industry', 'gender']
     search_fields = ['first_name', 'last_name', 'national_id']
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return queryset.annotate(**borrower_annotations())
+        if self.action in ('retrieve', 'update', 'partial_update', 'overview'):
+            return queryset.annotate(**borrower_annotations()).select_related('spouse').prefetch_related('guarantors')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return BorrowerListSerializer
+        return BorrowerSerializer
+
     @action(detail=True, methods=['get'])
     def loans(self, request, pk=None):
         """
         Get loans for a specific borrower
         """
         borrower = self.get_object()
-        loans = Loan.objects.filter(borrower=borrower)
+        loans = Loan.objects.filter(borrower=borrower).select_related(
+            'borrower', 'branch', 'loan_officer', 'risk_metric'
+        ).prefetch_related('collateral_items', 'repayments')
         serializer = LoanSerializer(loans, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'], url_path='360')
+    def overview(self, request, pk=None):
+        """
+        Borrower 360: profile, loan summary, repayment behavior, screenings,
+        guarantor links and a paginated loan history, from a fixed number of
+        queries however many loans and repayments the borrower has.
+        Params: page (loan history page), recent_days (behavior window, default 365)
+        """
+        try:
+            recent_days = int(request.query_params.get('recent_days', RECENT_BEHAVIOR_DAYS))
+        except ValueError:
+            return Response({"error": "recent_days must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if recent_days < 1:
+            return Response({"error": "recent_days must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+
+        borrower = self.get_object()
+        today = timezone.now().date()
+        loans = Loan.objects.filter(borrower=borrower)
+
+        history = loans.select_related('borrower', 'branch').annotate(
+            **loan_behavior_annotations(today)
+        ).order_by('-application_date', '-id')
+        page = self.paginate_queryset(history)
+        history_data = BorrowerLoanHistorySerializer(page, many=True).data
+        screenings = ClientScreening.objects.filter(borrower=borrower).order_by('-screening_date', '-id')
+        # Guarantor rows naming this borrower, i.e. loans they stand behind
+        guaranteeing = Guarantor.objects.filter(
+            national_id=borrower.national_id
+        ).exclude(borrower=borrower).select_related('borrower')
+
+        return Response({
+            "profile": BorrowerSerializer(borrower).data,
+            "loan_summary": {
+                **loan_summary(loans),
+                "outstanding_exposure": borrower.outstanding_exposure,
+            },
+            "repayment_behavior": repayment_behavior(
+                Repayment.objects.filter(loan__borrower=borrower), as_of=today, recent_days=recent_days
+            ),
+            "screenings": ClientScreeningSummarySerializer(screenings, many=True).data,
+            "guaranteeing": GuaranteeLinkSerializer(guaranteeing, many=True).data,
+            "loans": self.get_paginated_response(history_data).data,
+        })
+
 
 class SpouseViewSet(viewsets.ModelViewSet):
     """ViewSet for Spouse model"""
@@ -85,76 +156,105 @@ class LoanViewSet(viewsets.ModelViewSet):
     serializer_class = LoanSerializer
     filterset_fields = ['branch', 'loan_type', 'status']
     search_fields = ['loan_number', 'borrower__first_name', 'borrower__last_name']
+    pagination_class = KeysetPagination
+    keyset_orderings = {
+        'id': ('id',),
+        'application_date': ('application_date', 'id'),
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return queryset.select_related('borrower', 'branch')
+        if self.action in ('retrieve', 'update', 'partial_update'):
+            return queryset.select_related(
+                'borrower', 'branch', 'loan_officer', 'risk_metric'
+            ).prefetch_related('collateral_items', 'repayments')
+        return queryset
+
+    def get_serializer_class(self):
+        # List pages use the lean form; detail keeps repayments, collateral and risk
+        if self.action == 'list':
+            return LoanListSerializer
+        return LoanSerializer
 
     @action(detail=False, methods=['get'])
+    @cached_analytics(LOAN)
     def statistics(self, request):
         """
         Get aggregated loan statistics
+        Optional group_by (branch, loan_type, status, loan_officer) adds
+        every measure per group.
         """
+        group_by = request.query_params.get('group_by')
+        if group_by and group_by not in LOAN_DIMENSIONS:
+            return Response(
+                {"error": f"group_by must be one of {sorted(LOAN_DIMENSIONS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         queryset = self.filter_queryset(self.get_queryset())
-        
-        # Basic aggregates
-        total_loans = queryset.count()
-        total_principal = queryset.aggregate(Sum('principal_amount'))['principal_amount__sum'] or 0
-        active_loans = queryset.filter(status='ACTIVE').count()
-        defaulted_loans = queryset.filter(status='DEFAULTED').count()
-        avg_loan_amount = queryset.aggregate(Avg('principal_amount'))['principal_amount__avg'] or 0
-        
-        # Group by Loan Type
-        by_loan_type = {}
-        type_stats = queryset.values('loan_type').annotate(count=Count('id'))
-        for stat in type_stats:
-            by_loan_type[stat['loan_type']] = stat['count']
-            
-        # Group by Branch
-        by_branch = {}
-        branch_stats = queryset.values('branch__name').annotate(count=Count('id'))
-        for stat in branch_stats:
-            by_branch[stat['branch__name']] = stat['count']
-            
-        data = {
-            "total_loans": total_loans,
-            "total_principal": total_principal,
-            "active_loans": active_loans,
-            "defaulted_loans": defaulted_loans,
-            "avg_loan_amount": avg_loan_amount,
-            "by_loan_type": by_loan_type,
-            "by_branch": by_branch
-        }
+        data = loan_statistics(queryset, group_by)
         return Response(data)
 
     @action(detail=False, methods=['get'])
+    @cached_analytics(LOAN, REPAYMENT, RISK_METRIC)
     def portfolio_metrics(self, request):
         """
         Get portfolio-level risk metrics
         """
         queryset = self.filter_queryset(self.get_queryset())
         
-        total_outstanding = queryset.filter(status='ACTIVE').aggregate(Sum('principal_amount'))['principal_amount__sum'] or 0
-        
-        # Simplified PAR calculations (mock logic for now as we don't have full arrears history in this view)
-        # In a real app, we'd query Repayments with days_late > 30
-        
-        # Mocking PAR based on status for demonstration
-        par30_loans = queryset.filter(status='ACTIVE', repayments__days_late__gt=30).distinct()
-        par30_amount = par30_loans.aggregate(Sum('principal_amount'))['principal_amount__sum'] or 0
-        
-        par30_rate = (par30_amount / total_outstanding) if total_outstanding > 0 else 0
-        
-        # Bayesian Model Aggregates (Mocked or fetched from RiskMetric)
-        # In a real app, we'd aggregate the LoanRiskMetric values
-        avg_pd = queryset.aggregate(Avg('risk_metric__pd_mean'))['risk_metric__pd_mean__avg'] or 0.05
-        avg_lgd = queryset.aggregate(Avg('risk_metric__lgd_mean'))['risk_metric__lgd_mean__avg'] or 0.45
-        
+        # Outstanding principal and arrears from the repayment schedules;
+        # the portfolio is active loans unless a status filter is given
+        book = queryset if 'status' in request.query_params else queryset.filter(status='ACTIVE')
+
+        # Expected loss rides along in the PAR aggregate. EAD is the stored
+        # LoanRiskMetric.ead (outstanding principal at the last rescore), as in
+        # /models/loss_distribution/. Unscored loans take the average PD/LGD
+        # of scored ones (0.05 / 0.45 when none are scored) on their outstanding.
+        scored = Q(pd_value__isnull=False)
+        par = portfolio_at_risk(
+            book.annotate(
+                pd_value=F('risk_metric__pd_mean'), lgd_value=F('risk_metric__lgd_mean'), ead_value=F('risk_metric__ead')
+            ),
+            loan_count=Count('id'),
+            scored_loans=Count('id', filter=scored),
+            pd_total=Sum('pd_value'),
+            lgd_total=Sum('lgd_value'),
+            scored_expected_loss=Sum(F('pd_value') * F('lgd_value') * F('ead_value'), output_field=FloatField()),
+            unscored_outstanding=Sum('outstanding', filter=~scored),
+        )
+        total_outstanding = par['total_outstanding']
+        scored_loans = par['scored_loans']
+        avg_pd = float(par['pd_total']) / scored_loans if scored_loans else 0.05
+        avg_lgd = float(par['lgd_total']) / scored_loans if scored_loans else 0.45
+        unscored_ead = float(par['unscored_outstanding'] or 0)
+        expected_loss = float(par['scored_expected_loss'] or 0) + avg_pd * avg_lgd * unscored_ead
+
+        # 99.9% one-factor (ASRF) loss quantile from the stored metrics. It is
+        # additive in LGD x EAD at a given PD, so one row per distinct stored PD
+        # (at most 10,001 at four decimals) stands in for one row per loan.
+        exposure_by_pd = list(LoanRiskMetric.objects.filter(loan__in=book).order_by().values('pd_mean').annotate(
+            exposure=Sum(F('lgd_mean') * F('ead'), output_field=FloatField())
+        ).values_list('pd_mean', 'exposure'))
+        pd_values = [float(pd) for pd, _ in exposure_by_pd] + [avg_pd]
+        exposures = [exposure for _, exposure in exposure_by_pd] + [avg_lgd * unscored_ead]
+        portfolio_var = asrf_var(pd_values, np.ones(len(pd_values)), exposures)
+
         data = {
-            "par30_rate": par30_rate,
-            "par60_rate": par30_rate * Decimal('0.6'), # Mock
-            "par90_rate": par30_rate * Decimal('0.3'), # Mock
+            "par30_rate": par['par30_rate'],
+            "par60_rate": par['par60_rate'],
+            "par90_rate": par['par90_rate'],
             "total_outstanding": total_outstanding,
-            "total_at_risk_30": par30_amount,
+            "total_at_risk_30": par['total_at_risk_30'],
+            "total_at_risk_60": par['total_at_risk_60'],
+            "total_at_risk_90": par['total_at_risk_90'],
             "pd_rate": avg_pd,
             "lgd_rate": avg_lgd,
-            "portfolio_var": float(total_outstanding) * float(avg_pd) * float(avg_lgd) # Simplified VaR
+            "expected_loss": expected_loss,
+            "portfolio_var": portfolio_var,
+            "loan_count": par['loan_count'],
+            "scored_loans": scored_loans
         }
         return Response(data)
 
@@ -172,32 +272,28 @@ class RepaymentViewSet(viewsets.ModelViewSet):
     serializer_class = RepaymentSerializer
     filterset_fields = ['loan', 'payment_status']
     ordering_fields = ['scheduled_date', 'actual_payment_date']
+    pagination_class = KeysetPagination
+    keyset_orderings = {
+        'loan': ('loan_id', 'installment_number'),
+        'scheduled_date': ('scheduled_date', 'id'),
+    }
 
     @action(detail=False, methods=['get'])
+    @cached_analytics(REPAYMENT, LOAN)
     def statistics(self, request):
         """
         Get repayment statistics
+        Optional group_by (branch, loan_type, payment_status) adds every
+        measure per group.
         """
+        group_by = request.query_params.get('group_by')
+        if group_by and group_by not in REPAYMENT_DIMENSIONS:
+            return Response(
+                {"error": f"group_by must be one of {sorted(REPAYMENT_DIMENSIONS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         queryset = self.filter_queryset(self.get_queryset())
-        
-        total_repayments = queryset.count()
-        on_time_count = queryset.filter(payment_status='ON_TIME').count()
-        late_count = queryset.filter(payment_status='LATE_PAYMENT').count()
-        partial_count = queryset.filter(payment_status='PARTIAL_PAYMENT').count()
-        missed_count = queryset.filter(payment_status='MISSED_PAYMENT').count()
-        
-        on_time_rate = (on_time_count / total_repayments) if total_repayments > 0 else 0
-        avg_days_late = queryset.filter(days_late__gt=0).aggregate(Avg('days_late'))['days_late__avg'] or 0
-        
-        data = {
-            "total_repayments": total_repayments,
-            "on_time_count": on_time_count,
-            "late_count": late_count,
-            "partial_count": partial_count,
-            "missed_count": missed_count,
-            "on_time_rate": on_time_rate,
-            "avg_days_late": avg_days_late
-        }
+        data = repayment_statistics(queryset, group_by)
         return Response(data)
 
 
@@ -220,7 +316,68 @@ class GroupRiskMetricViewSet(viewsets.ModelViewSet):
     """ViewSet for GroupRiskMetric model"""
     queryset = GroupRiskMetric.objects.all()
     serializer_class = GroupRiskMetricSerializer
-    filterset_fields = ['branch', 'loan_type', 'tenure_months']
+    # NULL dimensions are roll-up rows; filter them with e.g. ?branch__isnull=true
+    filterset_fields = {
+        'branch': ['exact', 'isnull'],
+        'loan_type': ['exact', 'isnull'],
+        'tenure_months': ['exact', 'isnull'],
+    }
+
+    @action(detail=False, methods=['post'])
+    def refresh(self, request):
+        """
+        Queue a rebuild of the whole group metric cube.
+        Returns 202 with the job; poll it at /models/jobs/<id>/.
+        """
+        job, created = job_runner.submit('group_metrics', refresh_job)
+        return Response(
+            {**asdict(job), "deduplicated": not created},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class AnalyticsViewSet(viewsets.GenericViewSet):
+    """Cross-cutting analytics endpoints over the loan book"""
+    queryset = Loan.objects.all()
+    filterset_fields = ['branch', 'loan_type', 'status']
+
+    @action(detail=False, methods=['get'])
+    @cached_analytics(LOAN, REPAYMENT, RISK_METRIC)
+    def cube(self, request):
+        """
+        Group loans by any whitelisted dimensions and compute the requested
+        measures in one SQL query, e.g.
+        ?dimensions=branch,disbursement_month&measures=count,outstanding,par30
+        Accepts the same branch/loan_type/status filters as /loans/.
+        Returns columns: {name: [value per group]} for dimensions and measures.
+        """
+        split = lambda name, default: [v for v in request.query_params.get(name, default).split(',') if v]
+        dimensions = split('dimensions', '')
+        measures = split('measures', 'count,principal')
+
+        unknown = [d for d in dimensions if d not in CUBE_DIMENSIONS] + [m for m in measures if m not in CUBE_MEASURES]
+        if unknown or len(set(dimensions)) != len(dimensions):
+            return Response({
+                "error": f"Unknown or repeated dimensions/measures: {unknown or dimensions}",
+                "dimensions": list(CUBE_DIMENSIONS),
+                "measures": list(CUBE_MEASURES),
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        columns = cube_query(queryset, dimensions, measures)
+        return Response({
+            "dimensions": dimensions,
+            "measures": measures,
+            "rows": len(next(iter(columns.values()))) if columns else 0,
+            "columns": columns,
+        })
+
+    @action(detail=False, methods=['get'])
+    def cache(self, request):
+        """
+        Analytics cache hit/miss counters, hit ratio and source generations
+        """
+        return Response(cache_stats())
 
 
 class MacroMonthlyViewSet(viewsets.ModelViewSet):
@@ -238,6 +395,44 @@ class ClientScreeningViewSet(viewsets.ModelViewSet):
     serializer_class = ClientScreeningSerializer
     filterset_fields = ['borrower', 'status', 'cluster_group']
     ordering_fields = ['screening_date', 'client_risk_score']
+    # Sub-resources by loading strategy: reverse one-to-ones join, reverse foreign keys prefetch
+    joined_expansions = ('household_assessment', 'spouse_assessment', 'client_profile', 'behavioral_verification')
+    prefetched_expansions = ('business_assessments', 'informal_loans', 'guarantor_assessments')
+
+    def get_expand(self):
+        """
+        Sub-resources to render, from ?expand=household_assessment,informal_loans
+        or ?expand=all. List pages default to header fields only; detail views
+        render everything.
+        """
+        value = self.request.query_params.get('expand')
+        if value is None:
+            return () if self.action == 'list' else ClientScreeningSerializer.EXPANDABLE_FIELDS
+        requested = tuple(name.strip() for name in value.split(',') if name.strip())
+        if requested == ('all',):
+            return ClientScreeningSerializer.EXPANDABLE_FIELDS
+        unknown = sorted(set(requested) - set(ClientScreeningSerializer.EXPANDABLE_FIELDS))
+        if unknown:
+            raise ValidationError({
+                "error": f"Unknown expand values: {', '.join(unknown)}. "
+                         f"Valid values: all, {', '.join(ClientScreeningSerializer.EXPANDABLE_FIELDS)}"
+            })
+        return requested
+
+    def get_queryset(self):
+        queryset = super().get_queryset().select_related('borrower')
+        if self.action in ('create', 'destroy'):
+            return queryset
+        expand = self.get_expand()
+        joined = [name for name in self.joined_expansions if name in expand]
+        prefetched = [name for name in self.prefetched_expansions if name in expand]
+        return queryset.select_related(*joined).prefetch_related(*prefetched)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action not in ('create', 'destroy'):
+            context['expand'] = self.get_expand()
+        return context
 
 
 class ClientProfileViewSet(viewsets.ModelViewSet):
@@ -151,6 +151,28 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Bayesian model registry: seconds between checks for a newly activated version
+MODEL_RELOAD_INTERVAL = config('MODEL_RELOAD_INTERVAL', default=5.0, cast=float)
+
+# Analytics response cache: bounded LRU in process memory by default
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analytics': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'analytics',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': config('ANALYTICS_CACHE_MAX_ENTRIES', default=2000, cast=int),
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+# Seconds a cached analytics response may be served (bounds cross-process staleness)
+ANALYTICS_CACHE_TIMEOUT = config('ANALYTICS_CACHE_TIMEOUT', default=300, cast=int)
+
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = config(
     'CORS_ALLOWED_ORIGINS',
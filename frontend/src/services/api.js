@@ -23,6 +23,9 @@ export const endpoints = {
         loans: '/loans/statistics/',
         portfolio: '/loans/portfolio_metrics/',
         repayments: '/repayments/statistics/',
+    },
+    analytics: {
+        cube: '/analytics/cube/',
     }
 };
 